@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Admissions clearing-house simulator
+Candidates list programs in order of preference, programs rank their
+applicants by formula total, and seats are filled by candidate-proposing
+deferred acceptance
+"""
+
+import heapq
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from formula_batch import Cohort
+from formula_parser import AdvancedFormulaCalculator, Formula
+from formula_ranking import CohortRanker
+
+
+UNASSIGNED = -1
+
+
+@dataclass
+class Preferences:
+    """Every candidate's ranked program list, stored flat
+
+    programs holds program indices, most preferred first; ends holds each
+    candidate's end offset into it.
+    """
+    ends: np.ndarray
+    programs: np.ndarray
+
+    @classmethod
+    def from_lists(
+        cls, lists: Sequence[Sequence[str]], program_ids: Sequence[str]
+    ) -> "Preferences":
+        """Preferences from program id lists, one per candidate"""
+        index = {program_id: i for i, program_id in enumerate(program_ids)}
+        programs = []
+        for choices in lists:
+            for program_id in choices:
+                if program_id not in index:
+                    raise ValueError(f"Unknown program in preferences: {program_id}")
+                programs.append(index[program_id])
+        preferences = cls(
+            ends=np.cumsum([len(choices) for choices in lists], dtype=np.int64),
+            programs=np.array(programs, dtype=np.int64)
+        )
+        preferences.validate(len(program_ids))
+        return preferences
+
+    @property
+    def size(self) -> int:
+        return len(self.ends)
+
+    @property
+    def candidates(self) -> np.ndarray:
+        """Candidate of every application"""
+        return np.repeat(np.arange(self.size), np.diff(self.ends, prepend=0))
+
+    @property
+    def choices(self) -> np.ndarray:
+        """Preference position (0 = first choice) of every application"""
+        counts = np.diff(self.ends, prepend=0)
+        return np.arange(len(self.programs)) - np.repeat(self.ends - counts, counts)
+
+    def validate(self, program_count: int) -> None:
+        """Raise ValueError for unknown programs or a program listed twice"""
+        if len(self.programs) and (self.programs.min() < 0 or self.programs.max() >= program_count):
+            raise ValueError("Preferences refer to a program that does not exist")
+        pairs = np.sort(self.candidates * program_count + self.programs)
+        if (pairs[1:] == pairs[:-1]).any():
+            raise ValueError("A candidate lists the same program more than once")
+
+
+@dataclass
+class ProgramOutcome:
+    """One program after the round
+
+    threshold is the lowest admitted total, the figure published as the
+    cut-off and comparable to last_year_threshold; None when no one was
+    admitted. eligible counts applicants who met the requirements and passed
+    every stage.
+    """
+    program_id: str
+    seats: int
+    applicants: int
+    eligible: int
+    admitted: int
+    threshold: Optional[float]
+    last_year_threshold: Optional[float]
+
+    @property
+    def full(self) -> bool:
+        return self.admitted >= self.seats
+
+
+@dataclass
+class AllocationResult:
+    """Final assignment of every candidate
+
+    assignment holds a program index per candidate (UNASSIGNED if none),
+    choice the preference position it came from and total_score the
+    candidate's total there (NaN when unassigned).
+    """
+    assignment: np.ndarray
+    choice: np.ndarray
+    total_score: np.ndarray
+    program_ids: List[str]
+    programs: List[ProgramOutcome]
+    proposals: int
+    ranking_seconds: float
+    matching_seconds: float
+
+    def program_of(self, candidate: int) -> Optional[str]:
+        program = self.assignment[candidate]
+        return None if program == UNASSIGNED else self.program_ids[program]
+
+    def admitted(self, program_id: str) -> np.ndarray:
+        """Candidates assigned to a program"""
+        return np.flatnonzero(self.assignment == self.program_ids.index(program_id))
+
+
+class AllocationSimulator:
+    """Candidate-proposing deferred acceptance over a catalog of programs
+
+    Each program ranks only its own applicants, with CohortRanker, so
+    RANKING and MULTIPLIER stage thresholds are judged against that pool and
+    the program's seats. Applicants who fail the requirements or a stage are
+    never admitted there. Ties are broken by tie_breaker (higher first), then
+    by candidate order, so every program's priority order is strict and the
+    result is the candidate-optimal stable assignment.
+
+    Each program keeps its tentatively admitted candidates in a heap with the
+    worst on top: a proposal is held while seats are free, displaces the
+    worst held candidate when it ranks higher, and is rejected otherwise.
+    """
+
+    def __init__(
+        self,
+        formulas: List[Formula],
+        seats: Dict[str, int],
+        calculator: Optional[AdvancedFormulaCalculator] = None
+    ):
+        self.formulas = formulas
+        self.program_ids = [formula.program_id for formula in formulas]
+        if len(set(self.program_ids)) != len(self.program_ids):
+            raise ValueError("Program ids must be unique")
+        missing = [pid for pid in self.program_ids if pid not in seats]
+        if missing:
+            raise ValueError(f"No seat count for programs: {', '.join(missing[:5])}")
+        self.seats = [int(seats[pid]) for pid in self.program_ids]
+        self.ranker = CohortRanker(calculator)
+
+    def simulate(
+        self,
+        cohort: Cohort,
+        preferences: Preferences,
+        tie_breaker: Optional[np.ndarray] = None
+    ) -> AllocationResult:
+        """Rank every program's applicants, then run deferred acceptance"""
+        if preferences.size != cohort.size:
+            raise ValueError("Preferences and cohort have different candidate counts")
+        preferences.validate(len(self.formulas))
+
+        began = time.perf_counter()
+        priority, totals, eligible = self.rank_applicants(cohort, preferences, tie_breaker)
+        ranked = time.perf_counter()
+        held, proposals = self.match(preferences, priority)
+        matched = time.perf_counter()
+
+        return self._result(
+            preferences, totals, eligible, held, proposals,
+            ranking_seconds=ranked - began,
+            matching_seconds=matched - ranked
+        )
+
+    # MARK: - Ranking
+
+    def rank_applicants(
+        self,
+        cohort: Cohort,
+        preferences: Preferences,
+        tie_breaker: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per-application priority and total, and eligible count per program
+
+        priority is the application's position in its program's ranking,
+        best first, or -1 when the applicant is not eligible there.
+        """
+        applications = len(preferences.programs)
+        candidates = preferences.candidates
+        priority = np.full(applications, -1, dtype=np.int64)
+        totals = np.zeros(applications)
+        eligible = np.zeros(len(self.formulas), dtype=np.int64)
+
+        order = np.argsort(preferences.programs, kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(
+            np.bincount(preferences.programs, minlength=len(self.formulas))
+        )))
+        for program, formula in enumerate(self.formulas):
+            indices = order[bounds[program]:bounds[program + 1]]
+            if not len(indices):
+                continue
+            applicants = candidates[indices]
+            result = self.ranker.rank(
+                formula, cohort.take(applicants), self.seats[program],
+                tie_breaker=None if tie_breaker is None else tie_breaker[applicants]
+            )
+            totals[indices] = result.total_scores
+            priority[indices[result.ranking]] = np.arange(len(result.ranking))
+            eligible[program] = len(result.ranking)
+        return priority, totals, eligible
+
+    # MARK: - Matching
+
+    def match(self, preferences: Preferences, priority: np.ndarray) -> Tuple[np.ndarray, int]:
+        """(held application per candidate or -1, proposal count)"""
+        size = preferences.size
+        ends = preferences.ends.tolist()
+        programs = preferences.programs.tolist()
+        ranks = priority.tolist()
+        seats = self.seats
+        heaps: List[List[int]] = [[] for _ in self.formulas]
+
+        # Heap keys are -(rank * size + candidate): the worst held candidate
+        # is on top, and the candidate is recovered from the key.
+        next_application = [0] + ends[:-1]
+        held = [UNASSIGNED] * size
+        free = list(range(size - 1, -1, -1))
+        proposals = 0
+        heappush, heapreplace = heapq.heappush, heapq.heapreplace
+
+        while free:
+            candidate = free.pop()
+            application = next_application[candidate]
+            end = ends[candidate]
+            while application < end:
+                rank = ranks[application]
+                application += 1
+                if rank < 0:
+                    continue
+                proposals += 1
+                program = programs[application - 1]
+                heap = heaps[program]
+                key = rank * size + candidate
+                if len(heap) < seats[program]:
+                    heappush(heap, -key)
+                elif heap and -heap[0] > key:
+                    displaced = -heapreplace(heap, -key) % size
+                    held[displaced] = UNASSIGNED
+                    free.append(displaced)
+                else:
+                    continue
+                held[candidate] = application - 1
+                break
+            next_application[candidate] = application
+
+        return np.array(held, dtype=np.int64), proposals
+
+    def _result(
+        self,
+        preferences: Preferences,
+        totals: np.ndarray,
+        eligible: np.ndarray,
+        held: np.ndarray,
+        proposals: int,
+        ranking_seconds: float,
+        matching_seconds: float
+    ) -> AllocationResult:
+        assigned = held != UNASSIGNED
+        applications = held[assigned]
+        assignment = np.full(preferences.size, UNASSIGNED, dtype=np.int64)
+        assignment[assigned] = preferences.programs[applications]
+        choice = np.full(preferences.size, UNASSIGNED, dtype=np.int64)
+        choice[assigned] = preferences.choices[applications]
+        total_score = np.full(preferences.size, np.nan)
+        total_score[assigned] = totals[applications]
+
+        count = len(self.formulas)
+        admitted = np.bincount(assignment[assigned], minlength=count)
+        lowest = np.full(count, np.inf)
+        np.minimum.at(lowest, assignment[assigned], total_score[assigned])
+        applicants = np.bincount(preferences.programs, minlength=count)
+
+        outcomes = [
+            ProgramOutcome(
+                program_id=formula.program_id,
+                seats=self.seats[program],
+                applicants=int(applicants[program]),
+                eligible=int(eligible[program]),
+                admitted=int(admitted[program]),
+                threshold=float(lowest[program]) if admitted[program] else None,
+                last_year_threshold=formula.metadata.last_year_threshold
+            )
+            for program, formula in enumerate(self.formulas)
+        ]
+        return AllocationResult(
+            assignment=assignment,
+            choice=choice,
+            total_score=total_score,
+            program_ids=self.program_ids,
+            programs=outcomes,
+            proposals=proposals,
+            ranking_seconds=ranking_seconds,
+            matching_seconds=matching_seconds
+        )
+
+
+def simulate_allocation(
+    formulas: List[Formula],
+    seats: Dict[str, int],
+    cohort: Cohort,
+    preferences: Sequence[Sequence[str]],
+    tie_breaker: Optional[np.ndarray] = None,
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> AllocationResult:
+    """Run one admissions round with preferences given as program id lists"""
+    simulator = AllocationSimulator(formulas, seats, calculator)
+    return simulator.simulate(
+        cohort, Preferences.from_lists(preferences, simulator.program_ids), tie_breaker
+    )
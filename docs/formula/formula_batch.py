@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Vectorized cohort scoring for a single admission formula
+Evaluates a Formula over columnar NumPy arrays instead of one candidate at a time
+"""
+
+from dataclasses import dataclass, field, replace
+from itertools import product
+from typing import Dict, FrozenSet, List, Optional
+
+import numpy as np
+
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    BonusRule,
+    CompactScores,
+    ComponentType,
+    ExtendedScores,
+    Formula,
+    FormulaComponent,
+    FormulaRequirements,
+    FormulaStage,
+    MATURA_SUBJECTS,
+    MISSING_SCORE,
+    OlympiadLevel,
+    Operation,
+    OperationType,
+    alternative_subjects,
+    fixed_subjects,
+    group_alternatives,
+    has_alternatives,
+    resolve_level_coefficients,
+    resolve_matura_field,
+    subject_key,
+    threshold_cutoff,
+)
+
+
+# MARK: - Cohort
+
+OLYMPIAD_LEVELS = list(OlympiadLevel)
+
+
+@dataclass
+class Entries:
+    """Per-candidate lists stored flat
+
+    fields holds one array per entry attribute; ends holds each candidate's
+    end offset into them.
+    """
+    ends: np.ndarray
+    fields: Dict[str, np.ndarray]
+
+    @property
+    def counts(self) -> np.ndarray:
+        return np.diff(self.ends, prepend=0)
+
+    def rows(self) -> np.ndarray:
+        """Candidate of every entry"""
+        return np.repeat(np.arange(len(self.ends)), self.counts)
+
+    def take(self, indices: np.ndarray) -> "Entries":
+        counts = self.counts[indices]
+        ends = np.cumsum(counts)
+        starts = (self.ends - self.counts)[indices]
+        positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - counts), counts)
+        return Entries(ends, {name: values[positions] for name, values in self.fields.items()})
+
+
+def olympiad_entries(scores: List[ExtendedScores]) -> Entries:
+    results = [o for s in scores for o in s.olympiad_results or []]
+    return Entries(
+        ends=np.cumsum([len(s.olympiad_results or []) for s in scores], dtype=np.int64),
+        fields={
+            "level": np.array([OLYMPIAD_LEVELS.index(o.level) for o in results], dtype=np.int64),
+            "subject": np.array([o.subject for o in results], dtype=object),
+            "name": np.array([o.name for o in results], dtype=object),
+        }
+    )
+
+
+def certificate_entries(scores: List[ExtendedScores]) -> Entries:
+    certificates = [c for s in scores for c in s.certificates or []]
+    return Entries(
+        ends=np.cumsum([len(s.certificates or []) for s in scores], dtype=np.int64),
+        fields={
+            "type": np.array([c.type for c in certificates], dtype=object),
+            "level": np.array([c.level for c in certificates], dtype=object),
+            "score": np.array(
+                [np.nan if c.score is None else c.score for c in certificates], dtype=np.float64
+            ),
+        }
+    )
+
+
+@dataclass
+class Cohort:
+    """Columnar candidate scores, one row per candidate
+
+    Matura columns are keyed by MaturaScores field name. Missing results
+    (None in the scalar model) are NaN in every float column. olympiads and
+    certificates hold the lists themselves, for bonus conditions.
+    """
+    size: int
+    matura: Dict[str, np.ndarray] = field(default_factory=dict)
+    practical_exams: Dict[str, np.ndarray] = field(default_factory=dict)
+    has_practical_exams: Optional[np.ndarray] = None
+    interview_score: Optional[np.ndarray] = None
+    portfolio_score: Optional[np.ndarray] = None
+    previous_degree_gpa: Optional[np.ndarray] = None
+    is_bilingual: Optional[np.ndarray] = None
+    olympiad_count: Optional[np.ndarray] = None
+    olympiad_points: Optional[np.ndarray] = None
+    certificate_count: Optional[np.ndarray] = None
+    olympiads: Optional[Entries] = None
+    certificates: Optional[Entries] = None
+
+    @classmethod
+    def from_scores(
+        cls,
+        scores: List[ExtendedScores],
+        calculator: Optional[AdvancedFormulaCalculator] = None
+    ) -> "Cohort":
+        """Build a cohort from scalar ExtendedScores or CompactScores records"""
+        calculator = calculator or AdvancedFormulaCalculator()
+        size = len(scores)
+
+        def column(values: List[Optional[float]]) -> np.ndarray:
+            return np.array(
+                [np.nan if v is None else v for v in values], dtype=np.float64
+            )
+
+        if scores and all(isinstance(s, CompactScores) for s in scores):
+            # Unpack all Matura bytes in one pass
+            packed = np.frombuffer(b"".join(s.matura for s in scores), dtype=np.uint8)
+            packed = packed.reshape(size, len(MATURA_SUBJECTS))
+            values = np.where(packed == MISSING_SCORE, np.nan, packed.astype(np.float64))
+            matura = {name: values[:, slot] for slot, name in enumerate(MATURA_SUBJECTS)}
+        else:
+            matura = {
+                name: column([getattr(s.matura_scores, name) for s in scores])
+                for name in MATURA_SUBJECTS
+            }
+
+        exam_ids = sorted({eid for s in scores for eid in (s.practical_exams or {})})
+        practical_exams = {
+            eid: column([(s.practical_exams or {}).get(eid) for s in scores])
+            for eid in exam_ids
+        }
+
+        return cls(
+            size=size,
+            matura=matura,
+            practical_exams=practical_exams,
+            has_practical_exams=np.array([bool(s.practical_exams) for s in scores]),
+            interview_score=column([s.interview_score for s in scores]),
+            portfolio_score=column([s.portfolio_score for s in scores]),
+            previous_degree_gpa=column([s.previous_degree_gpa for s in scores]),
+            is_bilingual=np.array([s.is_bilingual for s in scores], dtype=bool),
+            olympiad_count=np.array(
+                [len(s.olympiad_results or []) for s in scores], dtype=np.int64
+            ),
+            olympiad_points=np.array(
+                [sum(calculator._get_olympiad_bonus(o) for o in s.olympiad_results or [])
+                 for s in scores],
+                dtype=np.float64
+            ),
+            certificate_count=np.array(
+                [len(s.certificates or []) for s in scores], dtype=np.int64
+            ),
+            olympiads=olympiad_entries(scores),
+            certificates=certificate_entries(scores),
+        )
+
+    def take(self, indices: np.ndarray) -> "Cohort":
+        """Sub-cohort of the given rows, in the given order"""
+        def pick(values: Optional[np.ndarray]) -> Optional[np.ndarray]:
+            return None if values is None else values[indices]
+
+        return Cohort(
+            size=len(indices),
+            matura={name: values[indices] for name, values in self.matura.items()},
+            practical_exams={
+                eid: values[indices] for eid, values in self.practical_exams.items()
+            },
+            has_practical_exams=pick(self.has_practical_exams),
+            interview_score=pick(self.interview_score),
+            portfolio_score=pick(self.portfolio_score),
+            previous_degree_gpa=pick(self.previous_degree_gpa),
+            is_bilingual=pick(self.is_bilingual),
+            olympiad_count=pick(self.olympiad_count),
+            olympiad_points=pick(self.olympiad_points),
+            certificate_count=pick(self.certificate_count),
+            olympiads=None if self.olympiads is None else self.olympiads.take(indices),
+            certificates=None if self.certificates is None else self.certificates.take(indices),
+        )
+
+    def filled(self, values: Optional[np.ndarray]) -> np.ndarray:
+        """Column with missing values read as 0, like the scalar calculator"""
+        if values is None:
+            return np.zeros(self.size)
+        return np.where(np.isnan(values), 0.0, values)
+
+
+@dataclass
+class BatchResult:
+    """Per-candidate results of a vectorized calculation
+
+    stage_scores is NaN and stage_passed False for stages a candidate never
+    reached, mirroring the stage_results list of the scalar calculator.
+    """
+    total_scores: np.ndarray
+    bonus_points: np.ndarray
+    meets_requirements: np.ndarray
+    stage_scores: np.ndarray
+    stage_passed: np.ndarray
+    stage_ids: List[str]
+
+
+# MARK: - Batch Calculator
+
+def sum_slots(slots: Dict[str, np.ndarray], size: int) -> np.ndarray:
+    """Stage scores from slot columns, summed in the scalar dict order"""
+    stage_score = np.zeros(size)
+    for values in slots.values():
+        stage_score = stage_score + values
+    return stage_score
+
+
+def _best_assignment_columns(
+    keys: List[List[str]], matrices: List[np.ndarray]
+) -> List[np.ndarray]:
+    """Per-candidate best assignment of subjects to a group of slots
+
+    matrices[i] holds slot i's option values, one column per subject in
+    keys[i] plus a last column for no subject. Only a slot's best len(keys)
+    options can appear in an optimal assignment, so combinations of those are
+    enumerated instead of every combination of subjects.
+    """
+    count = len(matrices)
+    codes_of = {key: code for code, key in enumerate(sorted({k for slot in keys for k in slot}))}
+    ranked_values: List[np.ndarray] = []
+    ranked_codes: List[np.ndarray] = []
+    for slot_keys, matrix in zip(keys, matrices):
+        codes = np.array([codes_of[key] for key in slot_keys] + [-1])
+        order = np.argsort(-matrix, axis=1, kind="stable")[:, :count]
+        ranked_values.append(np.take_along_axis(matrix, order, axis=1))
+        ranked_codes.append(codes[order])
+
+    n = matrices[0].shape[0]
+    best_total = np.full(n, -np.inf)
+    best = [np.zeros(n) for _ in range(count)]
+    for combination in product(*(range(values.shape[1]) for values in ranked_values)):
+        values = [v[:, p] for v, p in zip(ranked_values, combination)]
+        codes = [c[:, p] for c, p in zip(ranked_codes, combination)]
+        valid = np.ones(n, dtype=bool)
+        for a in range(count):
+            for b in range(a + 1, count):
+                valid &= (codes[a] != codes[b]) | (codes[a] < 0)
+        total = sum(values)
+        better = valid & (total > best_total)
+        best_total = np.where(better, total, best_total)
+        best = [np.where(better, v, old) for v, old in zip(values, best)]
+    return best
+
+
+class BatchFormulaCalculator:
+    """Evaluates formulas over a whole Cohort with array operations"""
+
+    def __init__(self, calculator: Optional[AdvancedFormulaCalculator] = None):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+
+    def calculate(self, formula: Formula, cohort: Cohort) -> BatchResult:
+        """Calculate admission points for every candidate in the cohort"""
+        n = cohort.size
+        meets = self._check_requirements(formula.requirements, cohort)
+        alive = meets.copy()
+        total = np.zeros(n)
+        stage_scores = np.full((n, len(formula.stages)), np.nan)
+        stage_passed = np.zeros((n, len(formula.stages)), dtype=bool)
+
+        for index, stage in enumerate(formula.stages):
+            score = self._calculate_stage(stage, cohort)
+            stage_scores[:, index] = np.where(alive, score, np.nan)
+
+            cutoff = threshold_cutoff(stage.threshold, stage.max_points)
+            passed = alive if cutoff is None else alive & (score >= cutoff)
+            stage_passed[:, index] = passed
+
+            coefficient = stage.coefficient or 1.0
+            total = np.where(passed, total + score * coefficient, total)
+            alive = passed
+
+        bonus = np.zeros(n)
+        if formula.bonuses:
+            bonus = np.where(meets, self._calculate_bonuses(formula.bonuses, cohort), 0.0)
+            total = total + bonus
+
+        total = np.where(meets, np.minimum(total, formula.metadata.max_possible_score), 0.0)
+
+        return BatchResult(
+            total_scores=total,
+            bonus_points=bonus,
+            meets_requirements=meets,
+            stage_scores=stage_scores,
+            stage_passed=stage_passed,
+            stage_ids=[stage.id for stage in formula.stages]
+        )
+
+    def _calculate_stage(self, stage: FormulaStage, cohort: Cohort) -> np.ndarray:
+        """Calculate stage scores, summing slots in the scalar dict order"""
+        components = self.component_slots(stage, cohort)
+        return sum_slots(self.operation_slots(stage, components, cohort.size), cohort.size)
+
+    def component_slots(self, stage: FormulaStage, cohort: Cohort) -> Dict[str, np.ndarray]:
+        """Component columns keyed by id, before operations run"""
+        slots: Dict[str, np.ndarray] = {}
+        for component in stage.components:
+            slots[component.id] = self._calculate_component(component, cohort)
+
+        last = {c.id: c for c in stage.components}
+        choosers = [c for c in last.values() if has_alternatives(c)]
+        if choosers:
+            taken = fixed_subjects(stage.components, self.calculator.subject_mappings)
+            slots.update(self._assign_alternatives(choosers, cohort, taken))
+        return slots
+
+    def operation_slots(
+        self, stage: FormulaStage, components: Dict[str, np.ndarray], size: int
+    ) -> Dict[str, np.ndarray]:
+        """Slot columns after operations, as StageResult.component_scores
+        holds them; components itself when the stage has no operations"""
+        if not stage.operations:
+            return components
+        slots = dict(components)
+        for operation in stage.operations:
+            if operation.result_id:
+                slots[operation.result_id] = self._apply_operation(operation, slots, size)
+        return slots
+
+    def _assign_alternatives(
+        self, choosers: List[FormulaComponent], cohort: Cohort, taken: FrozenSet[str]
+    ) -> Dict[str, np.ndarray]:
+        """Best component columns when each subject fills at most one component
+        and the subjects in taken are already used by fixed components"""
+        mappings = self.calculator.subject_mappings
+        keys: List[List[str]] = []
+        matrices: List[np.ndarray] = []
+        for component in choosers:
+            pairs = alternative_subjects(component, mappings, taken)
+            keys.append([subject_key(attr_name) for _, attr_name in pairs])
+            # One column per subject option, the last for no subject left
+            matrices.append(np.column_stack([
+                self._calculate_component(
+                    replace(component, subject=subject, alternatives=None), cohort
+                )
+                for subject in [s for s, _ in pairs] + [""]
+            ]))
+
+        assigned: Dict[str, np.ndarray] = {}
+        for group in group_alternatives(keys):
+            if len(group) == 1:
+                assigned[choosers[group[0]].id] = matrices[group[0]].max(axis=1)
+                continue
+            columns = _best_assignment_columns(
+                [keys[i] for i in group], [matrices[i] for i in group]
+            )
+            for i, column in zip(group, columns):
+                assigned[choosers[i].id] = column
+        return assigned
+
+    def _calculate_component(
+        self, component: FormulaComponent, cohort: Cohort
+    ) -> np.ndarray:
+        """Calculate weighted component scores"""
+        weight = component.weight
+
+        if component.type == ComponentType.MATURA_EXAM:
+            level = component.level or "R"
+            base = self._matura_column(component.subject or "", level, cohort)
+            coefficient, bilingual_coefficient = resolve_level_coefficients(
+                component.level_coefficients, level
+            )
+            if coefficient != bilingual_coefficient and cohort.is_bilingual is not None:
+                coefficient = np.where(
+                    cohort.is_bilingual, bilingual_coefficient, coefficient
+                )
+            weighted = base * coefficient * weight
+        elif component.type == ComponentType.PRACTICAL_EXAM:
+            weighted = cohort.filled(cohort.practical_exams.get(component.id)) * weight
+        elif component.type == ComponentType.INTERVIEW:
+            weighted = cohort.filled(cohort.interview_score) * weight
+        elif component.type == ComponentType.PORTFOLIO:
+            weighted = cohort.filled(cohort.portfolio_score) * weight
+        elif component.type == ComponentType.PREVIOUS_DEGREE:
+            weighted = cohort.filled(cohort.previous_degree_gpa) * 10 * weight
+        else:
+            weighted = np.zeros(cohort.size)
+
+        # As in the scalar path, a component below min_score is 0 and is not
+        # clamped afterwards (a negative weight would otherwise cap it below 0)
+        failed = weighted < component.min_score if component.min_score else None
+
+        if component.max_score:
+            weighted = np.minimum(weighted, component.max_score * weight)
+
+        if failed is not None:
+            weighted = np.where(failed, 0.0, weighted)
+
+        return weighted
+
+    def _matura_column(self, subject: str, level: str, cohort: Cohort) -> np.ndarray:
+        """Base Matura scores for subject, missing results read as 0"""
+        attr_name = resolve_matura_field(subject, level, self.calculator.subject_mappings)
+        if attr_name is None:
+            return np.zeros(cohort.size)
+        return cohort.filled(cohort.matura.get(attr_name))
+
+    def _apply_operation(
+        self, operation: Operation, slots: Dict[str, np.ndarray], size: int
+    ) -> np.ndarray:
+        """Apply operation column-wise"""
+        zeros = np.zeros(size)
+        values = [slots.get(cid, zeros) for cid in operation.component_ids]
+
+        if operation.type == OperationType.MAX:
+            return np.maximum.reduce(values) if values else zeros
+        elif operation.type == OperationType.MIN:
+            return np.minimum.reduce(values) if values else zeros
+        elif operation.type in (
+            OperationType.SUM, OperationType.AVERAGE, OperationType.DIVIDE
+        ):
+            total = zeros
+            for v in values:
+                total = total + v
+            if operation.type == OperationType.AVERAGE:
+                return total / len(values) if values else zeros
+            if operation.type == OperationType.DIVIDE:
+                return total / (operation.value or 1.0)
+            return total
+        elif operation.type == OperationType.MULTIPLY:
+            product = np.ones(size)
+            for v in values:
+                product = product * v
+            return product * (operation.value or 1.0)
+        elif operation.type == OperationType.THRESHOLD:
+            value = values[0] if values else zeros
+            return np.where(value >= (operation.value or 0), value, 0.0)
+
+        return zeros
+
+    def _calculate_bonuses(self, bonuses: List[BonusRule], cohort: Cohort) -> np.ndarray:
+        """Calculate bonus points column-wise"""
+        return self.calculator.bonus_table(bonuses).columns(cohort)
+
+    def _check_requirements(
+        self, reqs: Optional[FormulaRequirements], cohort: Cohort
+    ) -> np.ndarray:
+        """Mask of candidates meeting the formula requirements"""
+        meets = np.ones(cohort.size, dtype=bool)
+        if not reqs:
+            return meets
+
+        for subject in reqs.mandatory_subjects or []:
+            extended = self._matura_column(subject, "R", cohort)
+            basic = self._matura_column(subject, "P", cohort)
+            meets &= (extended != 0) | (basic != 0)
+
+        for subject, min_score in (reqs.minimum_scores or {}).items():
+            meets &= self._matura_column(subject, "R", cohort) >= min_score
+
+        if reqs.practical_test_required:
+            if cohort.has_practical_exams is None:
+                meets[:] = False
+            else:
+                meets &= cohort.has_practical_exams
+
+        return meets
+
+
+def calculate_batch(
+    formula: Formula,
+    cohort: Cohort,
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> BatchResult:
+    """Calculate admission points for a whole cohort with array operations"""
+    return BatchFormulaCalculator(calculator).calculate(formula, cohort)
@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the formula calculator
+Generates realistic synthetic formulas and candidate cohorts, measures parse
+latency, calculation latency, cohort throughput and peak memory, and compares
+the results against a stored baseline
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from formula_batch import BatchFormulaCalculator, Cohort
+from formula_catalog import CatalogEngine
+from formula_cse import CatalogPlan
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    BonusType,
+    Certificate,
+    ExtendedScores,
+    Formula,
+    FormulaType,
+    MaturaScores,
+    OlympiadLevel,
+    OlympiadResult,
+    OperationType,
+    ThresholdType,
+)
+from formula_profiler import measure_overhead
+
+
+RESULTS_VERSION = 1
+
+# Extended-level subjects a candidate may choose, with the share who take each
+ELECTIVE_SUBJECTS = {
+    "physics": 0.25,
+    "chemistry": 0.2,
+    "biology": 0.3,
+    "computer_science": 0.15,
+    "geography": 0.25,
+    "history": 0.15,
+    "social_studies": 0.15,
+}
+
+
+# MARK: - Formula Generator
+
+class FormulaGenerator:
+    """Produces formula JSON modeled on the specification examples
+
+    Programs are drawn from four templates: Warsaw Tech Architecture (mixed,
+    practical exam), MISH (multi-stage with interview), the 600-point medical
+    formula (simple) and a conditional portfolio program. Each program also
+    gets one operation, stage threshold and bonus type taken in rotation, so
+    any catalog of eight or more programs covers every FormulaType,
+    OperationType, ThresholdType and BonusType.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.random = random.Random(seed)
+        self.count = 0
+        self.templates = [self._architecture, self._mish, self._medicine, self._portfolio]
+
+    def formula(self) -> Dict[str, Any]:
+        """One formula as a decoded JSON object"""
+        index = self.count
+        self.count += 1
+        template = self.templates[index % len(self.templates)]
+        data = template(index)
+        data["program_id"] = f"{data['program_id']}-{index}"
+
+        stage = data["stages"][0]
+        stage.setdefault("operations", []).append(self._operation(index, stage))
+        threshold_type = _rotate(ThresholdType, index)
+        stage.setdefault("threshold", self._threshold(threshold_type, stage["max_points"]))
+
+        bonus_type = _rotate(BonusType, index)
+        data.setdefault("bonuses", []).append({
+            "id": f"{bonus_type.value}_bonus",
+            "type": bonus_type.value,
+            "condition": f"{bonus_type.value} achievement",
+            "points": self.random.choice([10, 20, 50]),
+            "max_bonus": self.random.choice([None, 50, 100])
+        })
+        return data
+
+    def catalog(self, size: int) -> List[Dict[str, Any]]:
+        return [self.formula() for _ in range(size)]
+
+    def _operation(self, index: int, stage: Dict[str, Any]) -> Dict[str, Any]:
+        operation_type = _rotate(OperationType, index)
+        ids = [c["id"] for c in stage["components"]]
+        component_ids = self.random.sample(ids, min(len(ids), 2))
+        value = None
+        if operation_type in (OperationType.MULTIPLY, OperationType.DIVIDE):
+            value = self.random.choice([0.5, 2.0])
+        elif operation_type == OperationType.THRESHOLD:
+            value = self.random.choice([15, 30])
+            component_ids = component_ids[:1]
+        return {
+            "id": f"op_{operation_type.value}",
+            "type": operation_type.value,
+            "component_ids": component_ids,
+            "value": value,
+            "result_id": f"{operation_type.value}_result"
+        }
+
+    def _threshold(self, threshold_type: ThresholdType, max_points: float) -> Dict[str, Any]:
+        if threshold_type == ThresholdType.MINIMUM:
+            value = round(max_points * self.random.uniform(0.1, 0.3))
+        elif threshold_type == ThresholdType.PERCENTAGE:
+            value = self.random.choice([10, 20, 30])
+        elif threshold_type == ThresholdType.RANKING:
+            value = self.random.choice([50, 100, 300])
+        else:
+            value = self.random.choice([2, 3])
+        return {"type": threshold_type.value, "value": value}
+
+    def _matura(
+        self, component_id: str, subject: str, weight: float, **extra: Any
+    ) -> Dict[str, Any]:
+        component = {
+            "id": component_id,
+            "type": "matura_exam",
+            "subject": subject,
+            "level": "R",
+            "weight": weight,
+            "required": True
+        }
+        component.update(extra)
+        return component
+
+    def _metadata(self, description: str, max_score: float) -> Dict[str, Any]:
+        threshold = round(max_score * self.random.uniform(0.5, 0.9), 1)
+        return {
+            "description": description,
+            "max_possible_score": max_score,
+            "scoring_unit": "points",
+            "last_year_threshold": threshold,
+            "average_threshold": round(threshold * self.random.uniform(0.9, 1.0), 1)
+        }
+
+    def _architecture(self, index: int) -> Dict[str, Any]:
+        elective = self.random.choice(["FIZ", "INF", "GEO"])
+        return {
+            "version": "2.0",
+            "university_id": "pw",
+            "program_id": "pw-architektura",
+            "type": FormulaType.MIXED.value,
+            "stages": [{
+                "id": "main",
+                "name": "Rekrutacja główna",
+                "components": [
+                    {"id": "psp", "type": "practical_exam", "weight": 1.0,
+                     "required": True, "min_score": 60, "max_score": 200},
+                    self._matura("mat", "MAT", 0.75),
+                    self._matura("jo", "J.OBC", 0.25),
+                    self._matura("wyb1", elective, 0.5),
+                ],
+                "practical_exams": [{
+                    "id": "psp",
+                    "name": "Test sprawności plastycznej",
+                    "type": "drawing",
+                    "weight": 1.0,
+                    "tasks": [
+                        {"name": "Zadanie graficzne 1", "points": 100, "duration": 120},
+                        {"name": "Zadanie graficzne 2", "points": 100, "duration": 120}
+                    ],
+                    "min_score": 60,
+                    "max_points": 200
+                }],
+                "max_points": 400
+            }],
+            "requirements": {"practical_test_required": True},
+            "metadata": self._metadata("Architektura - Politechnika Warszawska", 400)
+        }
+
+    def _mish(self, index: int) -> Dict[str, Any]:
+        coefficients = {"basic": 0.4, "extended": 1.0, "bilingual": 1.3}
+        return {
+            "version": "2.0",
+            "university_id": "uw",
+            "program_id": "uw-mish",
+            "type": FormulaType.MULTI_STAGE.value,
+            "stages": [
+                {
+                    "id": "stage1",
+                    "name": "Etap I - Ocena świadectw",
+                    "components": [
+                        self._matura("pol", "POL", 0.3, level_coefficients=coefficients),
+                        self._matura("his", "HIS", 0.4, level_coefficients=coefficients),
+                        self._matura("jo", "J.OBC", 0.3, level_coefficients=coefficients),
+                    ],
+                    "coefficient": 0.6,
+                    "max_points": 100
+                },
+                {
+                    "id": "stage2",
+                    "name": "Etap II - Rozmowa kwalifikacyjna",
+                    "components": [
+                        {"id": "interview", "type": "interview", "weight": 1.0,
+                         "required": True, "max_score": 100}
+                    ],
+                    "coefficient": 0.4,
+                    "max_points": 100
+                }
+            ],
+            "requirements": {
+                "mandatory_subjects": ["MAT", "POL", "J.OBC"],
+                "interview_required": True
+            },
+            "metadata": self._metadata("MISH - Uniwersytet Warszawski", 100)
+        }
+
+    def _medicine(self, index: int) -> Dict[str, Any]:
+        return {
+            "version": "2.0",
+            "university_id": "umed-lodz",
+            "program_id": "medicine",
+            "type": FormulaType.SIMPLE.value,
+            "stages": [{
+                "id": "main",
+                "name": "Standard recruitment",
+                "components": [
+                    self._matura("bio", "BIO", 2.0, max_score=100),
+                    self._matura("chem", "CHEM", 2.0, max_score=100),
+                    self._matura("third_mat", "MAT", 2.0, max_score=100),
+                    self._matura("third_fiz", "FIZ", 2.0, max_score=100),
+                ],
+                "operations": [{
+                    "id": "third",
+                    "type": "max",
+                    "component_ids": ["third_mat", "third_fiz"],
+                    "result_id": "third_result"
+                }],
+                "max_points": 600
+            }],
+            "requirements": {
+                "mandatory_subjects": ["BIO", "CHEM"],
+                "minimum_scores": {"BIO": 30}
+            },
+            "metadata": self._metadata("Kierunek lekarski - Uniwersytet Medyczny", 600)
+        }
+
+    def _portfolio(self, index: int) -> Dict[str, Any]:
+        return {
+            "version": "2.0",
+            "university_id": "asp",
+            "program_id": "asp-design",
+            "type": FormulaType.CONDITIONAL.value,
+            "stages": [{
+                "id": "main",
+                "name": "Portfolio i dyplom",
+                "components": [
+                    {"id": "portfolio", "type": "portfolio", "weight": 2.0,
+                     "required": True, "max_score": 100},
+                    {"id": "degree", "type": "previous_degree", "weight": 1.0,
+                     "required": False},
+                    self._matura("pol", "POL", 0.5),
+                ],
+                "max_points": 300
+            }],
+            "metadata": self._metadata("Wzornictwo - Akademia Sztuk Pięknych", 300)
+        }
+
+
+def _rotate(enum_type, index: int):
+    members = list(enum_type)
+    return members[index % len(members)]
+
+
+# MARK: - Cohort Generator
+
+def generate_candidates(size: int, seed: int = 0) -> List[ExtendedScores]:
+    """Candidates with correlated Matura results and occasional extras
+
+    Each candidate has a latent ability that drives every result, takes the
+    mandatory extended subjects plus a random set of electives, and may bring
+    practical exam, interview, portfolio, olympiad and certificate results.
+    """
+    rng = random.Random(seed)
+
+    def result(ability: float) -> int:
+        return max(0, min(100, round(rng.gauss(ability, 12))))
+
+    candidates = []
+    for _ in range(size):
+        ability = rng.gauss(62, 18)
+        matura = MaturaScores(
+            mathematics=result(ability),
+            mathematics_basic=result(ability + 15),
+            polish=result(ability) if rng.random() < 0.6 else None,
+            polish_basic=result(ability + 10),
+            foreign_language=result(ability + 5),
+            foreign_language_basic=result(ability + 20),
+            **{
+                subject: result(ability)
+                for subject, share in ELECTIVE_SUBJECTS.items()
+                if rng.random() < share
+            }
+        )
+
+        olympiad_results = None
+        if rng.random() < 0.02:
+            olympiad_results = [OlympiadResult(
+                name="Olimpiada Matematyczna",
+                level=rng.choice(list(OlympiadLevel)),
+                subject="MAT"
+            )]
+        certificates = None
+        if rng.random() < 0.1:
+            certificates = [Certificate(type="CAE", level="C1")]
+
+        candidates.append(ExtendedScores(
+            matura_scores=matura,
+            practical_exams={"psp": round(rng.uniform(20, 200), 1)} if rng.random() < 0.2 else None,
+            interview_score=round(rng.uniform(0, 100), 1) if rng.random() < 0.3 else None,
+            portfolio_score=round(rng.uniform(0, 100), 1) if rng.random() < 0.1 else None,
+            previous_degree_gpa=round(rng.uniform(3.0, 5.0), 2) if rng.random() < 0.05 else None,
+            olympiad_results=olympiad_results,
+            certificates=certificates,
+            is_bilingual=rng.random() < 0.05
+        ))
+    return candidates
+
+
+# MARK: - Measurements
+
+@dataclass
+class Metric:
+    """One benchmark measurement; lower_is_better decides regression direction"""
+    value: float
+    unit: str
+    lower_is_better: bool
+
+
+@dataclass
+class Regression:
+    name: str
+    baseline: float
+    current: float
+    change: float
+
+    def describe(self) -> str:
+        return (
+            f"{self.name}: {self.baseline:.4g} -> {self.current:.4g} "
+            f"({self.change:+.1%})"
+        )
+
+
+def _seconds_per_call(function: Callable[[], Any], calls: int, repeat: int) -> float:
+    """Median wall time of one call over repeat rounds of calls calls each"""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        rounds.append((time.perf_counter() - start) / calls)
+    return statistics.median(rounds)
+
+
+def run_benchmarks(
+    formula_count: int = 200,
+    cohort_size: int = 10_000,
+    seed: int = 0,
+    repeat: int = 5
+) -> Dict[str, Metric]:
+    """Run every benchmark and return metrics keyed by name"""
+    calculator = AdvancedFormulaCalculator()
+    batch = BatchFormulaCalculator(calculator)
+    documents = [json.dumps(d) for d in FormulaGenerator(seed).catalog(formula_count)]
+    formulas = [calculator.parse_formula_json(d) for d in documents]
+    plans = [calculator.compile(f) for f in formulas]
+    candidates = generate_candidates(cohort_size, seed)
+    sample = candidates[:200]
+    pairs = len(formulas) * len(sample)
+    metrics: Dict[str, Metric] = {}
+
+    parse_seconds = _seconds_per_call(
+        lambda: [calculator.parse_formula_json(d) for d in documents], 1, repeat
+    )
+    metrics["parse_formula_us"] = Metric(1e6 * parse_seconds / len(documents), "us", True)
+
+    compile_seconds = _seconds_per_call(
+        lambda: [calculator.compile(f) for f in formulas], 1, repeat
+    )
+    metrics["compile_formula_us"] = Metric(1e6 * compile_seconds / len(formulas), "us", True)
+
+    def scalar_pass() -> None:
+        for formula in formulas:
+            for scores in sample:
+                calculator.calculate(formula, scores)
+
+    def compiled_pass() -> None:
+        for plan in plans:
+            for scores in sample:
+                plan.evaluate(scores, breakdown=False)
+
+    scalar_seconds = _seconds_per_call(scalar_pass, 1, repeat)
+    compiled_seconds = _seconds_per_call(compiled_pass, 1, repeat)
+    metrics["calculate_us"] = Metric(1e6 * scalar_seconds / pairs, "us", True)
+    metrics["compiled_evaluate_us"] = Metric(1e6 * compiled_seconds / pairs, "us", True)
+
+    shared = CatalogPlan(formulas, calculator)
+    shared_seconds = _seconds_per_call(lambda: [shared.evaluate(s) for s in sample], 1, repeat)
+    metrics["shared_evaluate_us"] = Metric(1e6 * shared_seconds / pairs, "us", True)
+    metrics["shared_dedup_ratio"] = Metric(shared.stats.dedup_ratio, "x", False)
+
+    overhead = measure_overhead(formulas, sample[:50], repeat)
+    metrics["profiled_calculate_us"] = Metric(overhead["timers_us"], "us", True)
+    metrics["traced_calculate_us"] = Metric(overhead["trace_us"], "us", True)
+
+    cohort = Cohort.from_scores(candidates, calculator)
+    cohort_seconds = _seconds_per_call(
+        lambda: Cohort.from_scores(candidates, calculator), 1, repeat
+    )
+    metrics["cohort_build_per_s"] = Metric(cohort_size / cohort_seconds, "candidates/s", False)
+
+    batch_seconds = _seconds_per_call(
+        lambda: [batch.calculate(f, cohort) for f in formulas], 1, repeat
+    )
+    metrics["batch_throughput_per_s"] = Metric(
+        cohort_size * len(formulas) / batch_seconds, "results/s", False
+    )
+
+    engine = CatalogEngine(formulas, calculator)
+    catalog_seconds = _seconds_per_call(lambda: engine.score(cohort), 1, repeat)
+    metrics["catalog_throughput_per_s"] = Metric(
+        cohort_size * len(formulas) / catalog_seconds, "results/s", False
+    )
+
+    metrics["cohort_peak_mb"] = Metric(_peak_cohort_memory(cohort_size, seed, formulas[0]), "MB", True)
+    return metrics
+
+
+def _peak_cohort_memory(cohort_size: int, seed: int, formula: Formula) -> float:
+    """Peak traced allocation while generating, columnising and scoring a cohort"""
+    tracemalloc.start()
+    try:
+        candidates = generate_candidates(cohort_size, seed)
+        cohort = Cohort.from_scores(candidates)
+        BatchFormulaCalculator().calculate(formula, cohort)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+# MARK: - Results
+
+def results_document(
+    metrics: Dict[str, Metric], config: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Machine-readable results with enough context to compare runs"""
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "config": config,
+        "metrics": {name: asdict(metric) for name, metric in metrics.items()}
+    }
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.1
+) -> List[Regression]:
+    """Metrics that got worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, metric in current["metrics"].items():
+        previous = baseline["metrics"].get(name)
+        if not previous or not previous["value"]:
+            continue
+        change = metric["value"] / previous["value"] - 1
+        worse = change if metric["lower_is_better"] else -change
+        if worse > tolerance:
+            regressions.append(Regression(name, previous["value"], metric["value"], change))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark formula parsing and scoring on synthetic data"
+    )
+    parser.add_argument("-f", "--formulas", type=int, default=200, help="catalog size")
+    parser.add_argument("-n", "--cohort-size", type=int, default=10_000, help="candidates")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="generator seed")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="rounds per timing")
+    parser.add_argument("-o", "--output", help="write results JSON to this file")
+    parser.add_argument("-b", "--baseline", help="results JSON to compare against")
+    parser.add_argument(
+        "-t", "--tolerance", type=float, default=0.1,
+        help="allowed relative slowdown before a metric counts as a regression"
+    )
+    args = parser.parse_args(argv)
+
+    config = {
+        "formulas": args.formulas,
+        "cohort_size": args.cohort_size,
+        "seed": args.seed,
+        "repeat": args.repeat
+    }
+    metrics = run_benchmarks(args.formulas, args.cohort_size, args.seed, args.repeat)
+    document = results_document(metrics, config)
+
+    for name, metric in metrics.items():
+        print(f"{name:28} {metric.value:14.2f} {metric.unit}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print("warning: baseline was recorded with a different config", file=sys.stderr)
+        regressions = compare(document, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression.describe()}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
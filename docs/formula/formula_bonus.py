@@ -0,0 +1,712 @@
+#!/usr/bin/env python3
+"""
+Bonus conditions and table-driven bonus evaluation
+Parses BonusRule.condition expressions such as
+'expr: olympiads(level="central_winner", subject="MAT") > 0 and MAT_R >= 50'
+once per rule list, and evaluates the rules per candidate or over a whole cohort
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from formula_batch import OLYMPIAD_LEVELS, Cohort, Entries
+from formula_parser import (
+    MATURA_SUBJECTS,
+    OLYMPIAD_POINTS,
+    SUBJECT_SLOTS,
+    BonusRule,
+    BonusType,
+    ExtendedScores,
+    InputKey,
+    OlympiadLevel,
+    matura_vector,
+    resolve_matura_field,
+)
+
+
+class ConditionError(ValueError):
+    """Raised for conditions that are not valid expressions"""
+
+    def __init__(self, message: str, condition: str, position: Optional[int] = None):
+        self.condition = condition
+        self.position = position
+        where = f" at column {position + 1}" if position is not None else ""
+        super().__init__(f"{message}{where}: {condition!r}")
+
+
+# Non-Matura values a condition may read, by name
+SCORE_NAMES: Dict[str, str] = {
+    "interview": "interview_score",
+    "portfolio": "portfolio_score",
+    "gpa": "previous_degree_gpa",
+    "bilingual": "is_bilingual",
+}
+
+# Functions over the candidate's lists and the filters each accepts:
+# olympiads() counts results, olympiad_points() sums their OLYMPIAD_POINTS,
+# certificates() counts certificates, certificate_score() is the best score.
+FUNCTIONS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "olympiads": ("olympiad_results", ("level", "subject", "name")),
+    "olympiad_points": ("olympiad_results", ("level", "subject", "name")),
+    "certificates": ("certificates", ("type", "level")),
+    "certificate_score": ("certificates", ("type", "level")),
+}
+
+CONSTANTS: Dict[str, float] = {"true": 1.0, "always": 1.0, "false": 0.0}
+
+# Conditions starting with this marker are expressions. Anything else
+# ("Central olympiad winner", "Not applicable to transfer students") is a
+# plain description of the rule, which always applies.
+EXPRESSION_PREFIX = "expr:"
+
+OLYMPIAD_POINT_TABLE = np.array(
+    [OLYMPIAD_POINTS.get(level, 0) for level in OLYMPIAD_LEVELS], dtype=np.float64
+)
+
+
+# MARK: - Parser
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<number>\d+(?:\.\d*)?|\.\d+)
+  | (?P<string>"[^"]*"|'[^']*')
+  | (?P<name>[A-Za-z_][\w.]*)
+  | (?P<op><=|>=|==|!=|[-+*/<>=(),])
+""", re.VERBOSE)
+
+KEYWORDS = ("and", "or", "not")
+COMPARISONS = ("<", "<=", ">", ">=", "==", "!=")
+
+
+@dataclass(frozen=True)
+class Token:
+    kind: str
+    text: str
+    position: int
+
+
+@dataclass(frozen=True)
+class Number:
+    value: float
+
+
+@dataclass(frozen=True)
+class Name:
+    text: str
+    position: int
+
+
+@dataclass(frozen=True)
+class Call:
+    function: str
+    filters: Tuple[Tuple[str, str], ...]
+    position: int
+
+
+@dataclass(frozen=True)
+class Unary:
+    operator: str
+    operand: "Node"
+
+
+@dataclass(frozen=True)
+class Binary:
+    operator: str
+    left: "Node"
+    right: "Node"
+
+
+Node = Union[Number, Name, Call, Unary, Binary]
+
+
+def tokenize(condition: str) -> List[Token]:
+    tokens = []
+    position = 0
+    while position < len(condition):
+        match = _TOKEN.match(condition, position)
+        if not match:
+            raise ConditionError(
+                f"Unexpected character {condition[position]!r}", condition, position
+            )
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "name" and text.lower() in KEYWORDS:
+            kind, text = "op", text.lower()
+        elif kind == "string":
+            text = text[1:-1]
+        if kind != "space":
+            tokens.append(Token(kind, text, position))
+        position = match.end()
+    tokens.append(Token("end", "", len(condition)))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent over the condition grammar:
+
+    or := and ("or" and)*;  and := not ("and" not)*;  not := "not" not | compare
+    compare := sum (("<" | "<=" | ">" | ">=" | "==" | "!=") sum)?
+    sum := product (("+" | "-") product)*;  product := unary (("*" | "/") unary)*
+    unary := "-" unary | number | name | name "(" [filter ("," filter)*] ")" | "(" or ")"
+    filter := name "=" (string | number)
+    """
+
+    def __init__(self, condition: str):
+        self.condition = condition
+        self.tokens = tokenize(condition)
+        self.index = 0
+
+    def parse(self) -> Node:
+        node = self._or()
+        token = self._peek()
+        if token.kind != "end":
+            raise self._error(f"Unexpected {token.text!r}", token)
+        return node
+
+    def _peek(self) -> Token:
+        return self.tokens[self.index]
+
+    def _take(self) -> Token:
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def _accept(self, *operators: str) -> Optional[Token]:
+        token = self._peek()
+        if token.kind == "op" and token.text in operators:
+            return self._take()
+        return None
+
+    def _expect(self, operator: str) -> Token:
+        token = self._accept(operator)
+        if token is None:
+            found = self._peek()
+            raise self._error(f"Expected {operator!r}, found {found.text or 'end'!r}", found)
+        return token
+
+    def _error(self, message: str, token: Token) -> ConditionError:
+        return ConditionError(message, self.condition, token.position)
+
+    def _or(self) -> Node:
+        node = self._and()
+        while self._accept("or"):
+            node = Binary("or", node, self._and())
+        return node
+
+    def _and(self) -> Node:
+        node = self._not()
+        while self._accept("and"):
+            node = Binary("and", node, self._not())
+        return node
+
+    def _not(self) -> Node:
+        if self._accept("not"):
+            return Unary("not", self._not())
+        return self._compare()
+
+    def _compare(self) -> Node:
+        node = self._sum()
+        token = self._accept(*COMPARISONS)
+        if token:
+            node = Binary(token.text, node, self._sum())
+        return node
+
+    def _sum(self) -> Node:
+        node = self._product()
+        while True:
+            token = self._accept("+", "-")
+            if not token:
+                return node
+            node = Binary(token.text, node, self._product())
+
+    def _product(self) -> Node:
+        node = self._unary()
+        while True:
+            token = self._accept("*", "/")
+            if not token:
+                return node
+            node = Binary(token.text, node, self._unary())
+
+    def _unary(self) -> Node:
+        if self._accept("-"):
+            return Unary("-", self._unary())
+        if self._accept("("):
+            node = self._or()
+            self._expect(")")
+            return node
+        token = self._take()
+        if token.kind == "number":
+            return Number(float(token.text))
+        if token.kind != "name":
+            raise self._error(f"Unexpected {token.text or 'end'!r}", token)
+        if not self._accept("("):
+            return Name(token.text, token.position)
+
+        filters: List[Tuple[str, str]] = []
+        if not self._accept(")"):
+            while True:
+                key = self._take()
+                if key.kind != "name":
+                    raise self._error("Expected a filter name", key)
+                self._expect("=")
+                value = self._take()
+                if value.kind not in ("string", "number", "name"):
+                    raise self._error("Expected a filter value", value)
+                filters.append((key.text, value.text))
+                if self._accept(")"):
+                    break
+                self._expect(",")
+        return Call(token.text, tuple(filters), token.position)
+
+
+def condition_expression(condition: Optional[str]) -> Optional[str]:
+    """Expression of an "expr:" condition, None for a plain description"""
+    text = (condition or "").strip()
+    if not text.startswith(EXPRESSION_PREFIX):
+        return None
+    return text[len(EXPRESSION_PREFIX):].strip()
+
+
+@lru_cache(maxsize=4096)
+def parse_condition(condition: str) -> Node:
+    """Expression tree of a condition; raises ConditionError"""
+    return _Parser(condition).parse()
+
+
+# MARK: - Compiled Conditions
+
+Scalar = Callable[[ExtendedScores, Sequence[Optional[int]]], float]
+Vector = Callable[[Cohort], np.ndarray]
+
+_ARITHMETIC: Dict[str, Callable[[Any, Any], Any]] = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+}
+
+
+class Condition:
+    """A condition compiled for one set of subject mappings
+
+    Values are numbers; comparisons and logic give 1 or 0, and a condition
+    holds when its value is non-zero. Missing results read as 0, and division
+    by zero gives 0.
+    """
+
+    def __init__(self, condition: str, subject_mappings: Dict[str, str]):
+        self.text = condition
+        self.subject_mappings = subject_mappings
+        self.inputs: Set[InputKey] = set()
+        tree = parse_condition(condition)
+        self._scalar = self._compile_scalar(tree)
+        self._vector = self._compile_vector(tree)
+        self.constant: Optional[bool] = None
+        if not self.inputs:
+            self.constant = bool(self._scalar(None, []))
+        # 1 if the value never falls as a Matura result rises, -1 if it never
+        # rises, 0 if Matura results do not affect it, None if unknown
+        self.direction = self._direction(tree)
+
+    def holds(
+        self, scores: ExtendedScores, matura: Optional[Sequence[Optional[int]]] = None
+    ) -> bool:
+        if matura is None:
+            matura = matura_vector(scores.matura_scores)
+        return bool(self._scalar(scores, matura))
+
+    def mask(self, cohort: Cohort) -> np.ndarray:
+        values = self._vector(cohort)
+        return np.broadcast_to(values != 0, (cohort.size,))
+
+    # MARK: - Names
+
+    def _resolve(self, node: Name) -> Tuple[str, Any]:
+        """("matura", slot) or ("score", field) for a name"""
+        lowered = node.text.lower()
+        if lowered in SCORE_NAMES:
+            return "score", SCORE_NAMES[lowered]
+        subject, level = node.text, "R"
+        if len(subject) > 2 and subject[-2] == "_" and subject[-1].upper() in ("R", "P"):
+            subject, level = subject[:-2], subject[-1].upper()
+        attr_name = resolve_matura_field(subject.upper(), level, self.subject_mappings)
+        if attr_name is None:
+            attr_name = resolve_matura_field(subject, level, self.subject_mappings)
+        if attr_name is None:
+            raise ConditionError(f"Unknown name {node.text!r}", self.text, node.position)
+        return "matura", SUBJECT_SLOTS[attr_name]
+
+    def _filters(self, node: Call) -> Tuple[str, Dict[str, Any]]:
+        if node.function not in FUNCTIONS:
+            raise ConditionError(f"Unknown function {node.function!r}", self.text, node.position)
+        source, allowed = FUNCTIONS[node.function]
+        filters: Dict[str, Any] = {}
+        for key, value in node.filters:
+            if key not in allowed:
+                raise ConditionError(
+                    f"{node.function}() has no filter {key!r}", self.text, node.position
+                )
+            if key == "level" and source == "olympiad_results":
+                try:
+                    value = OlympiadLevel(value)
+                except ValueError:
+                    raise ConditionError(
+                        f"Unknown olympiad level {value!r}", self.text, node.position
+                    ) from None
+            filters[key] = value
+        self.inputs.add(source)
+        return source, filters
+
+    # MARK: - Monotonicity
+
+    def _direction(self, node: Node) -> Optional[int]:
+        if isinstance(node, (Number, Call)):
+            return 0
+        if isinstance(node, Name):
+            if node.text.lower() in CONSTANTS:
+                return 0
+            return 1 if self._resolve(node)[0] == "matura" else 0
+        if isinstance(node, Unary):
+            return _negate(self._direction(node.operand))
+
+        left = self._direction(node.left)
+        right = self._direction(node.right)
+        operator = node.operator
+        if operator in ("+", "and", "or"):
+            return _combine(left, right)
+        if operator in ("-", ">", ">="):
+            return _combine(left, _negate(right))
+        if operator in ("<", "<="):
+            return _combine(_negate(left), right)
+        if left == 0 and right == 0:
+            return 0
+        # Scaling by a constant keeps or reverses the direction
+        constant = node.right if operator == "/" or right == 0 else node.left
+        varying = left if constant is node.right else right
+        if operator in ("*", "/") and isinstance(constant, Number):
+            if constant.value > 0:
+                return varying
+            if constant.value < 0 and operator == "*":
+                return _negate(varying)
+        return None
+
+    # MARK: - Scalar
+
+    def _compile_scalar(self, node: Node) -> Scalar:
+        if isinstance(node, Number):
+            value = node.value
+            return lambda scores, matura: value
+        if isinstance(node, Name):
+            lowered = node.text.lower()
+            if lowered in CONSTANTS:
+                constant = CONSTANTS[lowered]
+                return lambda scores, matura: constant
+            kind, key = self._resolve(node)
+            if kind == "matura":
+                self.inputs.add(("matura", key))
+                return lambda scores, matura: matura[key] or 0
+            self.inputs.add(key)
+            return lambda scores, matura: float(getattr(scores, key) or 0)
+        if isinstance(node, Call):
+            return self._scalar_call(node)
+        if isinstance(node, Unary):
+            operand = self._compile_scalar(node.operand)
+            if node.operator == "not":
+                return lambda scores, matura: float(not operand(scores, matura))
+            return lambda scores, matura: -operand(scores, matura)
+
+        left = self._compile_scalar(node.left)
+        right = self._compile_scalar(node.right)
+        if node.operator == "and":
+            return lambda scores, matura: float(
+                bool(left(scores, matura)) and bool(right(scores, matura))
+            )
+        if node.operator == "or":
+            return lambda scores, matura: float(
+                bool(left(scores, matura)) or bool(right(scores, matura))
+            )
+        if node.operator == "/":
+            def divide(scores: ExtendedScores, matura: Sequence[Optional[int]]) -> float:
+                divisor = right(scores, matura)
+                return left(scores, matura) / divisor if divisor else 0.0
+            return divide
+        apply = _ARITHMETIC[node.operator]
+        return lambda scores, matura: float(apply(left(scores, matura), right(scores, matura)))
+
+    def _scalar_call(self, node: Call) -> Scalar:
+        source, filters = self._filters(node)
+        items = list(filters.items())
+
+        def matching(scores: ExtendedScores) -> List[Any]:
+            return [
+                entry for entry in getattr(scores, source) or []
+                if all(getattr(entry, key) == value for key, value in items)
+            ]
+
+        if node.function in ("olympiads", "certificates"):
+            return lambda scores, matura: float(len(matching(scores)))
+        if node.function == "olympiad_points":
+            return lambda scores, matura: float(sum(
+                OLYMPIAD_POINTS.get(o.level, 0) for o in matching(scores)
+            ))
+        return lambda scores, matura: float(max(
+            [c.score for c in matching(scores) if c.score is not None], default=0.0
+        ))
+
+    # MARK: - Vector
+
+    def _compile_vector(self, node: Node) -> Vector:
+        if isinstance(node, Number):
+            value = node.value
+            return lambda cohort: np.full(cohort.size, value)
+        if isinstance(node, Name):
+            lowered = node.text.lower()
+            if lowered in CONSTANTS:
+                constant = CONSTANTS[lowered]
+                return lambda cohort: np.full(cohort.size, constant)
+            kind, key = self._resolve(node)
+            if kind == "matura":
+                name = MATURA_SUBJECTS[key]
+                return lambda cohort: cohort.filled(cohort.matura.get(name))
+            if key == "is_bilingual":
+                return lambda cohort: (
+                    np.zeros(cohort.size) if cohort.is_bilingual is None
+                    else cohort.is_bilingual.astype(np.float64)
+                )
+            return lambda cohort: cohort.filled(getattr(cohort, key))
+        if isinstance(node, Call):
+            return self._vector_call(node)
+        if isinstance(node, Unary):
+            operand = self._compile_vector(node.operand)
+            if node.operator == "not":
+                return lambda cohort: (operand(cohort) == 0).astype(np.float64)
+            return lambda cohort: -operand(cohort)
+
+        left = self._compile_vector(node.left)
+        right = self._compile_vector(node.right)
+        if node.operator == "and":
+            return lambda cohort: ((left(cohort) != 0) & (right(cohort) != 0)).astype(np.float64)
+        if node.operator == "or":
+            return lambda cohort: ((left(cohort) != 0) | (right(cohort) != 0)).astype(np.float64)
+        if node.operator == "/":
+            def divide(cohort: Cohort) -> np.ndarray:
+                numerator, divisor = left(cohort), right(cohort)
+                safe = np.where(divisor != 0, divisor, 1.0)
+                return np.where(divisor != 0, numerator / safe, 0.0)
+            return divide
+        apply = _ARITHMETIC[node.operator]
+        return lambda cohort: np.asarray(apply(left(cohort), right(cohort)), dtype=np.float64)
+
+    def _vector_call(self, node: Call) -> Vector:
+        source, filters = self._filters(node)
+        attribute = "olympiads" if source == "olympiad_results" else "certificates"
+        function = node.function
+
+        def evaluate(cohort: Cohort) -> np.ndarray:
+            entries: Optional[Entries] = getattr(cohort, attribute)
+            if entries is None:
+                return np.zeros(cohort.size)
+            selected = np.ones(len(entries.rows()), dtype=bool)
+            for key, value in filters.items():
+                if key == "level" and source == "olympiad_results":
+                    value = OLYMPIAD_LEVELS.index(value)
+                selected &= entries.fields[key] == value
+            rows = entries.rows()[selected]
+            if function in ("olympiads", "certificates"):
+                return np.bincount(rows, minlength=cohort.size).astype(np.float64)
+            if function == "olympiad_points":
+                points = OLYMPIAD_POINT_TABLE[entries.fields["level"][selected]]
+                return np.bincount(rows, weights=points, minlength=cohort.size)
+            best = np.zeros(cohort.size)
+            scores = entries.fields["score"][selected]
+            present = ~np.isnan(scores)
+            np.fmax.at(best, rows[present], scores[present])
+            return best
+
+        return evaluate
+
+
+def _negate(direction: Optional[int]) -> Optional[int]:
+    return None if direction is None else -direction
+
+
+def _combine(left: Optional[int], right: Optional[int]) -> Optional[int]:
+    """Direction of a value that rises with both operands"""
+    if left is None or right is None:
+        return None
+    if left == 0 or left == right:
+        return right
+    return left if right == 0 else None
+
+
+# MARK: - Bonus Table
+
+@dataclass
+class CompiledBonus:
+    """One rule: a gate, the points for its type, a multiplier and a cap
+
+    condition is None when the rule's condition is a plain description, which
+    always applies.
+    """
+    rule: BonusRule
+    condition: Optional[Condition]
+    multiplier: float
+    cap: Optional[float]
+
+
+def _counts(values: Optional[np.ndarray], size: int) -> np.ndarray:
+    return np.zeros(size, dtype=np.int64) if values is None else values
+
+
+class BonusTable:
+    """Bonus rules compiled once, evaluated per candidate or per cohort
+
+    A rule's base points come from its type: olympiad rules award the
+    OLYMPIAD_POINTS of the candidate's results, certificate rules their
+    points per certificate, and either falls back to points when the
+    candidate has none; other rules award points. The base is scaled by
+    multiplier, capped by max_bonus, and awarded only when the condition
+    holds. A condition marked with EXPRESSION_PREFIX must be a valid
+    expression, and ConditionError is raised otherwise; any other condition
+    is a description.
+    """
+
+    def __init__(self, bonuses: List[BonusRule], subject_mappings: Dict[str, str]):
+        self.rules: List[CompiledBonus] = []
+        self.inputs: Set[InputKey] = set()
+        for bonus in bonuses:
+            condition = None
+            expression = condition_expression(bonus.condition)
+            if expression is not None:
+                condition = Condition(expression, subject_mappings)
+                self.inputs |= condition.inputs
+            self.rules.append(CompiledBonus(
+                rule=bonus,
+                condition=condition,
+                multiplier=1.0 if bonus.multiplier is None else bonus.multiplier,
+                cap=bonus.max_bonus or None
+            ))
+            if bonus.type == BonusType.OLYMPIAD:
+                self.inputs.add("olympiad_results")
+            elif bonus.type == BonusType.CERTIFICATE:
+                self.inputs.add("certificates")
+
+    def points(
+        self, scores: ExtendedScores, matura: Optional[Sequence[Optional[int]]] = None
+    ) -> float:
+        """Total bonus points for one candidate; matura as from matura_vector"""
+        total = 0
+        for compiled in self.rules:
+            condition = compiled.condition
+            if condition is not None and condition.constant is not True:
+                if matura is None:
+                    matura = matura_vector(scores.matura_scores)
+                if not condition.holds(scores, matura):
+                    continue
+            bonus = compiled.rule
+            if bonus.type == BonusType.OLYMPIAD and scores.olympiad_results:
+                points = 0
+                for olympiad in scores.olympiad_results:
+                    points += OLYMPIAD_POINTS.get(olympiad.level, 0)
+            elif bonus.type == BonusType.CERTIFICATE and scores.certificates:
+                points = len(scores.certificates) * bonus.points
+            else:
+                points = bonus.points
+            if compiled.multiplier != 1.0:
+                points = points * compiled.multiplier
+            if compiled.cap is not None:
+                points = min(points, compiled.cap)
+            total += points
+        return total
+
+    def columns(self, cohort: Cohort) -> np.ndarray:
+        """Bonus points for every candidate in a cohort"""
+        total = np.zeros(cohort.size)
+        olympiads = _counts(cohort.olympiad_count, cohort.size)
+        certificates = _counts(cohort.certificate_count, cohort.size)
+        for compiled in self.rules:
+            bonus = compiled.rule
+            if bonus.type == BonusType.OLYMPIAD:
+                points = np.where(
+                    olympiads > 0, cohort.filled(cohort.olympiad_points), bonus.points
+                )
+            elif bonus.type == BonusType.CERTIFICATE:
+                points = np.where(certificates > 0, certificates * bonus.points, bonus.points)
+            else:
+                points = np.full(cohort.size, float(bonus.points))
+            if compiled.multiplier != 1.0:
+                points = points * compiled.multiplier
+            if compiled.cap is not None:
+                points = np.minimum(points, compiled.cap)
+            condition = compiled.condition
+            if condition is not None and condition.constant is not True:
+                points = np.where(condition.mask(cohort), points, 0.0)
+            total = total + points
+        return total
+
+    def constant(self) -> Optional[float]:
+        """Bonus points when they are the same for every candidate, else None"""
+        total = 0.0
+        for compiled in self.rules:
+            condition = compiled.condition
+            if condition is not None and condition.constant is None:
+                return None
+            if compiled.rule.type in (BonusType.OLYMPIAD, BonusType.CERTIFICATE):
+                return None
+            if condition is not None and not condition.constant:
+                continue
+            points = compiled.rule.points * compiled.multiplier
+            if compiled.cap is not None:
+                points = min(points, compiled.cap)
+            total += points
+        return total
+
+    @property
+    def monotone(self) -> bool:
+        """True when no Matura result can lower the bonus by rising"""
+        for compiled in self.rules:
+            condition = compiled.condition
+            if condition is None or condition.direction == 0:
+                continue
+            never_negative = (
+                compiled.rule.points >= 0 and compiled.multiplier >= 0
+                and (compiled.cap is None or compiled.cap >= 0)
+            )
+            if condition.direction != 1 or not never_negative:
+                return False
+        return True
+
+    def upper_bound(self) -> Optional[float]:
+        """Most bonus points any candidate can get, None if unbounded"""
+        total = 0.0
+        for compiled in self.rules:
+            if compiled.condition is not None and compiled.condition.constant is False:
+                continue
+            if compiled.cap is not None:
+                total += max(compiled.cap, 0.0)
+            elif compiled.rule.type in (BonusType.OLYMPIAD, BonusType.CERTIFICATE):
+                return None
+            else:
+                total += max(compiled.rule.points * compiled.multiplier, 0.0)
+        return total
+
+
+def compile_condition(
+    condition: str, subject_mappings: Optional[Dict[str, str]] = None
+) -> Condition:
+    """Compile an expression, with or without the "expr:" marker, raising
+    ConditionError if it is not valid"""
+    if subject_mappings is None:
+        from formula_parser import AdvancedFormulaCalculator
+        subject_mappings = AdvancedFormulaCalculator().subject_mappings
+    expression = condition_expression(condition)
+    return Condition(condition if expression is None else expression, subject_mappings)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Content-addressed result cache for the formula calculator
+Memoizes calculate() by formula fingerprint and canonical scores, with LRU/TTL
+eviction and per-program invalidation when a formula changes
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    CalculationResult,
+    ExtendedScores,
+    Formula,
+    matura_vector,
+)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot fingerprint {type(value).__name__}")
+
+
+def _number(value: Optional[float]) -> Optional[float]:
+    """Ints and floats of equal value fingerprint the same"""
+    return None if value is None else float(value)
+
+
+def formula_fingerprint(formula: Formula) -> str:
+    """Version plus SHA-256 of the formula's canonical JSON
+
+    Stable across processes; any change to the formula's content changes it.
+    """
+    canonical = json.dumps(
+        asdict(formula), sort_keys=True, separators=(",", ":"),
+        ensure_ascii=False, default=_json_default
+    )
+    digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return f"{formula.version}:{digest}"
+
+
+def scores_key(scores: ExtendedScores) -> Tuple[Hashable, ...]:
+    """Canonical hashable form of a candidate's scores
+
+    Practical exams are ordered by id; ints and floats of equal value compare
+    and hash the same, as the calculator treats them the same.
+    """
+    return (
+        matura_vector(scores.matura_scores),
+        tuple(sorted(scores.practical_exams.items())) if scores.practical_exams else scores.practical_exams,
+        scores.interview_score,
+        scores.portfolio_score,
+        scores.previous_degree_gpa,
+        None if scores.olympiad_results is None else tuple(
+            (o.name, o.level, o.subject) for o in scores.olympiad_results
+        ),
+        None if scores.certificates is None else tuple(
+            (c.type, c.level, c.score) for c in scores.certificates
+        ),
+        scores.is_bilingual,
+        scores.exam_system
+    )
+
+
+def scores_fingerprint(scores: ExtendedScores) -> str:
+    """SHA-256 of the canonical scores, stable across processes"""
+    (
+        matura, practical, interview, portfolio, gpa,
+        olympiads, certificates, bilingual, exam_system
+    ) = scores_key(scores)
+    canonical = json.dumps([
+        [_number(v) for v in matura],
+        None if practical is None else [[k, _number(v)] for k, v in practical],
+        _number(interview), _number(portfolio), _number(gpa),
+        None if olympiads is None else [[n, l.value, s] for n, l, s in olympiads],
+        None if certificates is None else [[t, l, _number(s)] for t, l, s in certificates],
+        bilingual, exam_system.value
+    ], separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    """Result cache counters"""
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    invalidations: int
+    size: int
+    max_size: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ResultCache:
+    """Thread-safe memoizing front end for AdvancedFormulaCalculator.calculate
+
+    Entries are keyed by program, formula fingerprint and canonical scores.
+    When a formula arrives whose fingerprint differs from the one last seen
+    for its program_id, that program's entries are dropped; other programs
+    are untouched. Fingerprints are memoized per Formula object, so formulas
+    must not be mutated in place once passed here (parse a new one, or call
+    forget_formula first). Cached results are shared between callers and must
+    not be mutated either.
+    """
+
+    def __init__(
+        self,
+        calculator: Optional[AdvancedFormulaCalculator] = None,
+        max_size: int = 100_000,
+        ttl: Optional[float] = None,
+        max_formulas: int = 4096,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_formulas = max_formulas
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        # key -> (result, expiry time or None), least recently used first
+        self._entries: "OrderedDict[Tuple, Tuple[CalculationResult, Optional[float]]]" = OrderedDict()
+        self._keys_by_program: Dict[str, Set[Tuple]] = {}
+        self._current: Dict[str, str] = {}
+        # id(formula) -> (formula, fingerprint); holding the formula keeps its id unique
+        self._fingerprints: "OrderedDict[int, Tuple[Formula, str]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def fingerprint(self, formula: Formula) -> str:
+        with self._lock:
+            memo = self._fingerprints.get(id(formula))
+            if memo is not None and memo[0] is formula:
+                self._fingerprints.move_to_end(id(formula))
+                return memo[1]
+
+        fingerprint = formula_fingerprint(formula)
+        with self._lock:
+            self._fingerprints[id(formula)] = (formula, fingerprint)
+            if len(self._fingerprints) > self.max_formulas:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+
+    def forget_formula(self, formula: Formula) -> None:
+        """Drop the memoized fingerprint, e.g. before mutating a formula"""
+        with self._lock:
+            self._fingerprints.pop(id(formula), None)
+
+    def calculate(self, formula: Formula, scores: ExtendedScores) -> CalculationResult:
+        program_id = formula.program_id
+        fingerprint = self.fingerprint(formula)
+        key = (program_id, fingerprint, scores_key(scores))
+
+        with self._lock:
+            if self._current.get(program_id) != fingerprint:
+                self._invalidate(program_id)
+                self._current[program_id] = fingerprint
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, expires = entry
+                if expires is None or self.clock() < expires:
+                    self._hits += 1
+                    self._entries.move_to_end(key)
+                    return result
+                self._remove(key)
+                self._expirations += 1
+            self._misses += 1
+
+        result = self.calculator.calculate(formula, scores)
+
+        with self._lock:
+            if self._current.get(program_id) != fingerprint:
+                return result  # The formula changed while calculating
+            expires = None if self.ttl is None else self.clock() + self.ttl
+            self._entries[key] = (result, expires)
+            self._entries.move_to_end(key)
+            self._keys_by_program.setdefault(program_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest, _ = self._entries.popitem(last=False)
+                self._keys_by_program[oldest[0]].discard(oldest)
+                self._evictions += 1
+        return result
+
+    def invalidate(self, program_id: str) -> int:
+        """Drop every entry for a program; returns how many were dropped"""
+        with self._lock:
+            self._current.pop(program_id, None)
+            return self._invalidate(program_id)
+
+    def _invalidate(self, program_id: str) -> int:
+        keys = self._keys_by_program.pop(program_id, set())
+        for key in keys:
+            del self._entries[key]
+        self._invalidations += len(keys)
+        return len(keys)
+
+    def _remove(self, key: Tuple) -> None:
+        del self._entries[key]
+        self._keys_by_program[key[0]].discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_program.clear()
+            self._current.clear()
+            self._fingerprints.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                expirations=self._expirations,
+                invalidations=self._invalidations,
+                size=len(self._entries),
+                max_size=self.max_size
+            )
@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""
+Columnar on-disk candidate store
+One typed file per column, memory-mapped on read, so scoring a national
+cohort reads only the columns a formula uses, one chunk at a time
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from formula_batch import OLYMPIAD_LEVELS, BatchFormulaCalculator, BatchResult, Cohort, Entries
+from formula_bonus import OLYMPIAD_POINT_TABLE, BonusTable
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    Certificate,
+    CompactScores,
+    ExamSystem,
+    ExtendedScores,
+    Formula,
+    InputKey,
+    MATURA_SUBJECTS,
+    MISSING_SCORE,
+    MaturaScores,
+    OlympiadResult,
+    matura_vector,
+)
+from formula_session import PRACTICAL_EXAMS, component_inputs, requirement_inputs
+
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+DEFAULT_CHUNK_SIZE = 65536
+
+# Sentinel for absent strings in string-id columns; absent floats are NaN
+# and absent Matura results in byte columns are MISSING_SCORE.
+NO_STRING = 0xFFFFFFFF
+
+EXAM_SYSTEMS = list(ExamSystem)
+
+# One value per candidate. Matura columns start as bytes like CompactScores
+# and are widened to float64 the first time a non-whole result arrives.
+# Olympiad and certificate lists are stored flat, with each candidate's
+# cumulative end offset into the entry columns.
+ROW_COLUMNS: Dict[str, str] = {
+    "interview_score": "<f8",
+    "portfolio_score": "<f8",
+    "previous_degree_gpa": "<f8",
+    "is_bilingual": "u1",
+    "exam_system": "u1",
+    "has_practical_exams": "u1",
+    "olympiad_ends": "<i8",
+    "certificate_ends": "<i8",
+}
+OLYMPIAD_COLUMNS: Dict[str, str] = {
+    "olympiad_name": "<u4",
+    "olympiad_level": "u1",
+    "olympiad_subject": "<u4",
+}
+CERTIFICATE_COLUMNS: Dict[str, str] = {
+    "certificate_type": "<u4",
+    "certificate_level": "<u4",
+    "certificate_score": "<f8",
+}
+
+
+def formula_inputs(formula: Formula, subject_mappings: Dict[str, str]) -> Set[InputKey]:
+    """Inputs a formula reads, as formula_session input keys
+
+    Bonuses add "olympiad_results" or "certificates" when they count them,
+    and whatever their conditions read.
+    """
+    inputs = requirement_inputs(formula.requirements, subject_mappings)
+    for stage in formula.stages:
+        for component in stage.components:
+            inputs |= component_inputs(component, subject_mappings)
+    if formula.bonuses:
+        inputs |= BonusTable(formula.bonuses, subject_mappings).inputs
+    return inputs
+
+
+def _float_column(values: Iterable[Optional[float]]) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype="<f8")
+
+
+def _matura_values(scores: Sequence[Union[ExtendedScores, CompactScores]]) -> np.ndarray:
+    """Matura results as a (candidates, subjects) float array, NaN where missing"""
+    if scores and all(isinstance(s, CompactScores) for s in scores):
+        packed = np.frombuffer(b"".join(s.matura for s in scores), dtype=np.uint8)
+        packed = packed.reshape(len(scores), len(MATURA_SUBJECTS))
+        return np.where(packed == MISSING_SCORE, np.nan, packed.astype(np.float64))
+    values = np.full((len(scores), len(MATURA_SUBJECTS)), np.nan)
+    for row, s in enumerate(scores):
+        for slot, score in enumerate(matura_vector(s.matura_scores)):
+            if score is not None:
+                values[row, slot] = score
+    return values
+
+
+def _packable(values: np.ndarray) -> bool:
+    present = values[~np.isnan(values)]
+    return bool(((present >= 0) & (present < MISSING_SCORE) & (present == np.floor(present))).all())
+
+
+class CandidateStore:
+    """A directory of column files plus a JSON manifest
+
+    Rows are candidates in the order they were appended. Readers map each
+    column on first use and see the row count of the manifest they opened;
+    append writes the columns first and replaces the manifest last, so an
+    interrupted append leaves the store as it was. A widened Matura column
+    is written to a new file named in the manifest, never over the committed
+    one. Empty olympiad, certificate and practical exam lists read back as
+    None.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._load()
+
+    def _load(self) -> None:
+        path = self.path
+        with open(os.path.join(path, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path}: store format {manifest.get('format')}, expected {FORMAT_VERSION}")
+        self.size: int = manifest["rows"]
+        self.olympiads: int = manifest["olympiads"]
+        self.certificates: int = manifest["certificates"]
+        self.matura_dtypes: Dict[str, str] = manifest["matura"]
+        self.practical_exams: List[str] = manifest["practical_exams"]
+        self.strings: List[str] = manifest["strings"]
+        self.files: Dict[str, str] = manifest.get("files", {})
+        self._string_ids = {value: i for i, value in enumerate(self.strings)}
+        self._maps: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def create(cls, path: str) -> "CandidateStore":
+        """Empty store in a new directory"""
+        os.makedirs(path)
+        cls._write_manifest(path, {
+            "format": FORMAT_VERSION,
+            "rows": 0,
+            "olympiads": 0,
+            "certificates": 0,
+            "matura": {name: "u1" for name in MATURA_SUBJECTS},
+            "practical_exams": [],
+            "strings": []
+        })
+        return cls(path)
+
+    @staticmethod
+    def _write_manifest(path: str, manifest: Dict[str, Any]) -> None:
+        target = os.path.join(path, MANIFEST)
+        temporary = f"{target}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(temporary, target)
+
+    def __len__(self) -> int:
+        return self.size
+
+    # MARK: - Columns
+
+    def _file(self, name: str, files: Optional[Dict[str, str]] = None) -> str:
+        """Path of a column file; files maps renamed columns to their file"""
+        files = self.files if files is None else files
+        return os.path.join(self.path, files.get(name, name + ".col"))
+
+    def _dtype(self, name: str) -> str:
+        if name.startswith("matura."):
+            return self.matura_dtypes[name[len("matura."):]]
+        if name.startswith("practical."):
+            return "<f8"
+        return {**ROW_COLUMNS, **OLYMPIAD_COLUMNS, **CERTIFICATE_COLUMNS}[name]
+
+    def _length(self, name: str) -> int:
+        if name in OLYMPIAD_COLUMNS:
+            return self.olympiads
+        if name in CERTIFICATE_COLUMNS:
+            return self.certificates
+        return self.size
+
+    def column(self, name: str) -> np.ndarray:
+        """Read-only array over the mapped column file"""
+        values = self._maps.get(name)
+        if values is None:
+            dtype = np.dtype(self._dtype(name))
+            count = self._length(name)
+            if count == 0:
+                values = np.empty(0, dtype=dtype)
+            else:
+                with open(self._file(name), "rb") as f:
+                    data = mmap.mmap(f.fileno(), count * dtype.itemsize, access=mmap.ACCESS_READ)
+                values = np.frombuffer(data, dtype=dtype, count=count)
+            self._maps[name] = values
+        return values
+
+    def matura(self, name: str, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """One Matura column as float64, NaN where missing"""
+        values = self.column(f"matura.{name}")[start:stop]
+        if values.dtype == np.uint8:
+            return np.where(values == MISSING_SCORE, np.nan, values.astype(np.float64))
+        return values.astype(np.float64)
+
+    def missing(self, name: str, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Mask of candidates without a result in a Matura column"""
+        values = self.column(f"matura.{name}")[start:stop]
+        if values.dtype == np.uint8:
+            return values == MISSING_SCORE
+        return np.isnan(values)
+
+    # MARK: - Reading
+
+    def cohort(
+        self, start: int = 0, stop: Optional[int] = None, inputs: Optional[Set[InputKey]] = None
+    ) -> Cohort:
+        """Rows [start, stop) as a Cohort
+
+        With inputs (see formula_inputs), only those columns are read; the
+        rest are left empty, which BatchFormulaCalculator reads as missing.
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        size = max(stop - start, 0)
+
+        def wanted(key: InputKey) -> bool:
+            return inputs is None or key in inputs
+
+        matura = {
+            name: self.matura(name, start, stop)
+            for slot, name in enumerate(MATURA_SUBJECTS) if wanted(("matura", slot))
+        }
+        practical_exams = {
+            eid: self.column(f"practical.{i}")[start:stop]
+            for i, eid in enumerate(self.practical_exams) if wanted(("practical", eid))
+        }
+
+        def scalar(name: str) -> Optional[np.ndarray]:
+            return self.column(name)[start:stop] if wanted(name) else None
+
+        cohort = Cohort(
+            size=size,
+            matura=matura,
+            practical_exams=practical_exams,
+            interview_score=scalar("interview_score"),
+            portfolio_score=scalar("portfolio_score"),
+            previous_degree_gpa=scalar("previous_degree_gpa"),
+        )
+        if wanted(PRACTICAL_EXAMS):
+            cohort.has_practical_exams = self.column("has_practical_exams")[start:stop].astype(bool)
+        if wanted("is_bilingual"):
+            cohort.is_bilingual = self.column("is_bilingual")[start:stop].astype(bool)
+        if wanted("olympiad_results"):
+            first, last, counts = self._entries("olympiad_ends", start, stop)
+            levels = self.column("olympiad_level")[first:last].astype(np.int64)
+            rows = np.repeat(np.arange(size), counts)
+            cohort.olympiad_count = counts
+            cohort.olympiad_points = np.bincount(
+                rows, weights=OLYMPIAD_POINT_TABLE[levels], minlength=size
+            )
+            cohort.olympiads = Entries(np.cumsum(counts), {
+                "level": levels,
+                "subject": self._strings("olympiad_subject", first, last),
+                "name": self._strings("olympiad_name", first, last),
+            })
+        if wanted("certificates"):
+            first, last, counts = self._entries("certificate_ends", start, stop)
+            cohort.certificate_count = counts
+            cohort.certificates = Entries(np.cumsum(counts), {
+                "type": self._strings("certificate_type", first, last),
+                "level": self._strings("certificate_level", first, last),
+                "score": np.array(self.column("certificate_score")[first:last]),
+            })
+        return cohort
+
+    def _entries(self, ends_name: str, start: int, stop: int) -> Tuple[int, int, np.ndarray]:
+        """Entry range and per-candidate counts of a list column"""
+        ends = self.column(ends_name)
+        first = int(ends[start - 1]) if start > 0 else 0
+        bounds = np.concatenate(([first], ends[start:stop])).astype(np.int64)
+        return first, int(bounds[-1]), np.diff(bounds)
+
+    def _strings(self, name: str, first: int, last: int) -> np.ndarray:
+        """Entries of a string-id column as an object array, None where absent"""
+        ids = self.column(name)[first:last]
+        values = np.full(len(ids), None, dtype=object)
+        present = ids != NO_STRING
+        values[present] = np.array(self.strings, dtype=object)[ids[present]]
+        return values
+
+    def chunks(
+        self, chunk_size: int = DEFAULT_CHUNK_SIZE, inputs: Optional[Set[InputKey]] = None
+    ) -> Iterator[Tuple[int, Cohort]]:
+        """(first row, Cohort) for consecutive chunks of the store"""
+        for start in range(0, self.size, chunk_size):
+            yield start, self.cohort(start, start + chunk_size, inputs)
+
+    def calculate(
+        self,
+        formula: Formula,
+        batch: Optional[BatchFormulaCalculator] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> BatchResult:
+        """Score every stored candidate, reading only the formula's columns"""
+        batch = batch or BatchFormulaCalculator()
+        inputs = formula_inputs(formula, batch.calculator.subject_mappings)
+        results = [batch.calculate(formula, cohort) for _, cohort in self.chunks(chunk_size, inputs)]
+        if not results:
+            return batch.calculate(formula, Cohort(size=0))
+        return BatchResult(
+            total_scores=np.concatenate([r.total_scores for r in results]),
+            bonus_points=np.concatenate([r.bonus_points for r in results]),
+            meets_requirements=np.concatenate([r.meets_requirements for r in results]),
+            stage_scores=np.concatenate([r.stage_scores for r in results]),
+            stage_passed=np.concatenate([r.stage_passed for r in results]),
+            stage_ids=results[0].stage_ids
+        )
+
+    def scores(self, index: int) -> ExtendedScores:
+        """One stored candidate as ExtendedScores"""
+        if not 0 <= index < self.size:
+            raise IndexError(f"row {index} out of range")
+
+        def number(name: str) -> Optional[float]:
+            return self._number(self.column(name)[index])
+
+        matura = MaturaScores(*(
+            None if self.missing(name, index, index + 1)[0]
+            else self._whole(self.matura(name, index, index + 1)[0])
+            for name in MATURA_SUBJECTS
+        ))
+        practical = {
+            eid: float(self.column(f"practical.{i}")[index])
+            for i, eid in enumerate(self.practical_exams)
+            if not np.isnan(self.column(f"practical.{i}")[index])
+        }
+
+        first, last, _ = self._entries("olympiad_ends", index, index + 1)
+        olympiads = [
+            OlympiadResult(
+                name=self.strings[self.column("olympiad_name")[i]],
+                level=OLYMPIAD_LEVELS[self.column("olympiad_level")[i]],
+                subject=self.strings[self.column("olympiad_subject")[i]]
+            )
+            for i in range(first, last)
+        ]
+        first, last, _ = self._entries("certificate_ends", index, index + 1)
+        certificates = [
+            Certificate(
+                type=self.strings[self.column("certificate_type")[i]],
+                level=self._string(self.column("certificate_level")[i]),
+                score=self._number(self.column("certificate_score")[i])
+            )
+            for i in range(first, last)
+        ]
+        return ExtendedScores(
+            matura_scores=matura,
+            practical_exams=practical or None,
+            interview_score=number("interview_score"),
+            portfolio_score=number("portfolio_score"),
+            previous_degree_gpa=number("previous_degree_gpa"),
+            olympiad_results=olympiads or None,
+            certificates=certificates or None,
+            is_bilingual=bool(self.column("is_bilingual")[index]),
+            exam_system=EXAM_SYSTEMS[self.column("exam_system")[index]]
+        )
+
+    @staticmethod
+    def _number(value: float) -> Optional[float]:
+        return None if np.isnan(value) else float(value)
+
+    @staticmethod
+    def _whole(value: float) -> Union[int, float]:
+        return int(value) if value == int(value) else float(value)
+
+    def _string(self, index: int) -> Optional[str]:
+        return None if index == NO_STRING else self.strings[index]
+
+    # MARK: - Appending
+
+    def append(self, scores: Sequence[Union[ExtendedScores, CompactScores]]) -> None:
+        """Add candidates at the end of the store"""
+        if not scores:
+            return
+        count = len(scores)
+        columns: Dict[str, np.ndarray] = {}
+        dtypes = dict(self.matura_dtypes)
+        files = dict(self.files)
+        widened = []
+
+        matura = _matura_values(scores)
+        for slot, name in enumerate(MATURA_SUBJECTS):
+            values = matura[:, slot]
+            if dtypes[name] == "u1" and not _packable(values):
+                dtypes[name] = "<f8"
+                files[f"matura.{name}"] = f"matura.{name}.f8.col"
+                widened.append(name)
+            if dtypes[name] == "u1":
+                columns[f"matura.{name}"] = np.where(
+                    np.isnan(values), MISSING_SCORE, values
+                ).astype(np.uint8)
+            else:
+                columns[f"matura.{name}"] = values.astype("<f8")
+
+        practical_exams = list(self.practical_exams)
+        added = []
+        for s in scores:
+            for eid in s.practical_exams or {}:
+                if eid not in practical_exams:
+                    practical_exams.append(eid)
+                    added.append(eid)
+        for i, eid in enumerate(practical_exams):
+            columns[f"practical.{i}"] = _float_column(
+                (s.practical_exams or {}).get(eid) for s in scores
+            )
+
+        for name in ("interview_score", "portfolio_score", "previous_degree_gpa"):
+            columns[name] = _float_column(getattr(s, name) for s in scores)
+        columns["is_bilingual"] = np.array([s.is_bilingual for s in scores], dtype=np.uint8)
+        columns["exam_system"] = np.array(
+            [EXAM_SYSTEMS.index(s.exam_system) for s in scores], dtype=np.uint8
+        )
+        columns["has_practical_exams"] = np.array(
+            [bool(s.practical_exams) for s in scores], dtype=np.uint8
+        )
+
+        strings = list(self.strings)
+        string_ids = dict(self._string_ids)
+
+        def intern(value: Optional[str]) -> int:
+            if value is None:
+                return NO_STRING
+            if value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value)
+            return string_ids[value]
+
+        olympiads = [o for s in scores for o in s.olympiad_results or []]
+        columns["olympiad_ends"] = self.olympiads + np.cumsum(
+            [len(s.olympiad_results or []) for s in scores], dtype=np.int64
+        )
+        columns["olympiad_name"] = np.array([intern(o.name) for o in olympiads], dtype="<u4")
+        columns["olympiad_level"] = np.array(
+            [OLYMPIAD_LEVELS.index(o.level) for o in olympiads], dtype=np.uint8
+        )
+        columns["olympiad_subject"] = np.array([intern(o.subject) for o in olympiads], dtype="<u4")
+
+        certificates = [c for s in scores for c in s.certificates or []]
+        columns["certificate_ends"] = self.certificates + np.cumsum(
+            [len(s.certificates or []) for s in scores], dtype=np.int64
+        )
+        columns["certificate_type"] = np.array([intern(c.type) for c in certificates], dtype="<u4")
+        columns["certificate_level"] = np.array([intern(c.level) for c in certificates], dtype="<u4")
+        columns["certificate_score"] = _float_column(c.score for c in certificates)
+
+        for name in widened:
+            self._widen(name, self._file(f"matura.{name}", files))
+        for i in range(len(self.practical_exams), len(practical_exams)):
+            self._replace(self._file(f"practical.{i}", files), np.full(self.size, np.nan))
+        for name, values in columns.items():
+            self._append(name, values, self._file(name, files))
+
+        self._write_manifest(self.path, {
+            "format": FORMAT_VERSION,
+            "rows": self.size + count,
+            "olympiads": self.olympiads + len(olympiads),
+            "certificates": self.certificates + len(certificates),
+            "matura": dtypes,
+            "practical_exams": practical_exams,
+            "strings": strings,
+            "files": files
+        })
+        self._load()
+
+    def _append(self, name: str, values: np.ndarray, target: str) -> None:
+        """Write values after the committed rows, dropping any uncommitted tail"""
+        committed = self._length(name) * values.dtype.itemsize
+        with open(target, "ab") as f:
+            f.truncate(committed)
+            f.write(values.tobytes())
+
+    @staticmethod
+    def _replace(target: str, values: np.ndarray) -> None:
+        """Rewrite a column file; existing mappings keep the old file"""
+        temporary = f"{target}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(values.tobytes())
+        os.replace(temporary, target)
+
+    def _widen(self, name: str, target: str) -> None:
+        """Copy a byte Matura column into a new float64 file
+
+        The byte file stays in place: the committed manifest and readers
+        that opened it still point there until the new manifest replaces it.
+        """
+        self._replace(target, self.matura(name).astype("<f8"))
+
+
+# MARK: - Command Line
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Append ExtendedScores JSONL records to a columnar candidate store"
+    )
+    parser.add_argument("candidates", help="JSONL file, one ExtendedScores object per line")
+    parser.add_argument("store", help="Store directory, created if missing")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    calculator = AdvancedFormulaCalculator()
+    if os.path.exists(os.path.join(args.store, MANIFEST)):
+        store = CandidateStore(args.store)
+    else:
+        store = CandidateStore.create(args.store)
+    start = len(store)
+    chunk: List[ExtendedScores] = []
+    with open(args.candidates, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.pop("candidate_id", None)
+            record.pop("program_ids", None)
+            chunk.append(calculator._parse_scores(record))
+            if len(chunk) >= args.chunk_size:
+                store.append(chunk)
+                chunk = []
+    store.append(chunk)
+    print(f"{len(store) - start} candidates appended, {len(store)} stored", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
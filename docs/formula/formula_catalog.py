@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Catalog-wide scoring engine
+Reduces linear formulas to weight vectors over a fixed input axis and scores
+N candidates x M programs with one matrix product
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from formula_batch import BatchFormulaCalculator, Cohort
+from formula_bonus import BonusTable
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    ComponentType,
+    Formula,
+    FormulaComponent,
+    FormulaRequirements,
+    FormulaStage,
+    MATURA_FIELDS,
+    Operation,
+    OperationType,
+    has_alternatives,
+    resolve_level_coefficients,
+    resolve_matura_field,
+    threshold_cutoff,
+)
+
+
+# Matura fields plus the non-Matura inputs a linear formula may read
+INPUT_AXIS: List[str] = sorted(MATURA_FIELDS) + [
+    "interview_score", "portfolio_score", "previous_degree_gpa"
+]
+INPUT_INDEX: Dict[str, int] = {name: i for i, name in enumerate(INPUT_AXIS)}
+
+# Highest raw Matura result, used to prove a max_score cap never binds
+MATURA_MAX_SCORE = 100.0
+
+
+class NonLinearFormula(Exception):
+    """Raised when a formula cannot be reduced to a weight vector"""
+
+
+# An affine expression over the doubled input axis: regular inputs first,
+# then the same inputs for bilingual candidates.
+Affine = Tuple[np.ndarray, float]
+
+
+@dataclass
+class LinearFormula:
+    """Weight vector and constant term equivalent to a formula"""
+    weights: np.ndarray
+    bias: float
+
+
+@dataclass
+class CatalogScores:
+    """Scores of every candidate against every program in a catalog
+
+    linear marks programs scored through the matrix product; exact marks
+    programs whose column was evaluated at all (linear or per-formula
+    fallback). Columns that were not evaluated are NaN.
+    """
+    scores: np.ndarray
+    meets_requirements: np.ndarray
+    linear: np.ndarray
+    exact: np.ndarray
+    program_ids: List[str]
+
+
+# MARK: - Linear Reduction
+
+def reduce_formula(
+    formula: Formula, subject_mappings: Dict[str, str]
+) -> LinearFormula:
+    """Reduce a formula to a weight vector over the doubled input axis
+
+    Requirements and the max_possible_score cap are applied separately by the
+    engine. Raises NonLinearFormula for anything else that is not affine.
+    """
+    width = 2 * len(INPUT_AXIS)
+    weights = np.zeros(width)
+    bias = 0.0
+
+    for stage in formula.stages:
+        if threshold_cutoff(stage.threshold, stage.max_points) is not None:
+            raise NonLinearFormula(f"stage {stage.id} has a score threshold")
+        stage_weights, stage_bias = _reduce_stage(stage, subject_mappings, width)
+        coefficient = stage.coefficient or 1.0
+        weights += stage_weights * coefficient
+        bias += stage_bias * coefficient
+
+    if formula.bonuses:
+        bonus = BonusTable(formula.bonuses, subject_mappings).constant()
+        if bonus is None:
+            raise NonLinearFormula("bonuses depend on the candidate")
+        bias += bonus
+
+    return LinearFormula(weights=weights, bias=bias)
+
+
+def _reduce_stage(
+    stage: FormulaStage, subject_mappings: Dict[str, str], width: int
+) -> Affine:
+    slots: Dict[str, Affine] = {}
+    for component in stage.components:
+        slots[component.id] = _reduce_component(component, subject_mappings, width)
+
+    for operation in stage.operations or []:
+        if operation.result_id:
+            slots[operation.result_id] = _reduce_operation(operation, slots, width)
+
+    weights = np.zeros(width)
+    bias = 0.0
+    for slot_weights, slot_bias in slots.values():
+        weights += slot_weights
+        bias += slot_bias
+    return weights, bias
+
+
+def _reduce_component(
+    component: FormulaComponent, subject_mappings: Dict[str, str], width: int
+) -> Affine:
+    weights = np.zeros(width)
+    half = width // 2
+
+    if has_alternatives(component):
+        raise NonLinearFormula(f"component {component.id} chooses among alternatives")
+
+    if component.type == ComponentType.MATURA_EXAM:
+        level = component.level or "R"
+        coefficient, bilingual_coefficient = resolve_level_coefficients(
+            component.level_coefficients, level
+        )
+        if component.min_score:
+            raise NonLinearFormula(f"component {component.id} has a minimum score")
+        if component.max_score and (
+            component.weight < 0
+            or MATURA_MAX_SCORE * max(coefficient, bilingual_coefficient)
+            > component.max_score
+        ):
+            raise NonLinearFormula(f"component {component.id} cap can bind")
+
+        attr_name = resolve_matura_field(component.subject or "", level, subject_mappings)
+        if attr_name is not None:
+            index = INPUT_INDEX[attr_name]
+            weights[index] = coefficient * component.weight
+            weights[half + index] = bilingual_coefficient * component.weight
+        return weights, 0.0
+
+    if component.type in (
+        ComponentType.INTERVIEW, ComponentType.PORTFOLIO, ComponentType.PREVIOUS_DEGREE
+    ):
+        if component.min_score or component.max_score:
+            raise NonLinearFormula(f"component {component.id} is clamped")
+        name, scale = {
+            ComponentType.INTERVIEW: ("interview_score", 1.0),
+            ComponentType.PORTFOLIO: ("portfolio_score", 1.0),
+            ComponentType.PREVIOUS_DEGREE: ("previous_degree_gpa", 10.0),
+        }[component.type]
+        index = INPUT_INDEX[name]
+        weights[index] = weights[half + index] = scale * component.weight
+        return weights, 0.0
+
+    if component.type == ComponentType.PRACTICAL_EXAM:
+        raise NonLinearFormula(f"component {component.id} reads a practical exam")
+
+    return weights, 0.0
+
+
+def _reduce_operation(
+    operation: Operation, slots: Dict[str, Affine], width: int
+) -> Affine:
+    zero: Affine = (np.zeros(width), 0.0)
+    values = [slots.get(cid, zero) for cid in operation.component_ids]
+
+    def total() -> Affine:
+        return (
+            sum((v[0] for v in values), np.zeros(width)),
+            sum(v[1] for v in values),
+        )
+
+    if operation.type in (OperationType.MAX, OperationType.MIN):
+        if len(values) > 1:
+            raise NonLinearFormula(f"operation {operation.id} selects between inputs")
+        return values[0] if values else zero
+    if operation.type == OperationType.SUM:
+        return total()
+    if operation.type == OperationType.AVERAGE:
+        if not values:
+            return zero
+        weights, bias = total()
+        return weights / len(values), bias / len(values)
+    if operation.type == OperationType.DIVIDE:
+        divisor = operation.value or 1.0
+        weights, bias = total()
+        return weights / divisor, bias / divisor
+    if operation.type == OperationType.MULTIPLY:
+        factor = operation.value or 1.0
+        if len(values) > 1:
+            raise NonLinearFormula(f"operation {operation.id} multiplies inputs")
+        if not values:
+            return np.zeros(width), factor
+        return values[0][0] * factor, values[0][1] * factor
+    if operation.type == OperationType.THRESHOLD:
+        if values:
+            raise NonLinearFormula(f"operation {operation.id} is a threshold")
+        return zero
+    return zero
+
+
+@dataclass
+class CatalogReduction:
+    """Weight vectors of a catalog's linear formulas
+
+    weights has one column per linear formula (in catalog order) over the
+    doubled input axis; biases holds the matching constant terms.
+    """
+    linear: np.ndarray
+    weights: np.ndarray
+    biases: np.ndarray
+
+
+def reduce_catalog(
+    formulas: List[Formula], subject_mappings: Dict[str, str]
+) -> CatalogReduction:
+    """Reduce every formula that is linear, leaving the rest for fallback"""
+    linear_columns: List[np.ndarray] = []
+    biases: List[float] = []
+    linear = np.zeros(len(formulas), dtype=bool)
+    for index, formula in enumerate(formulas):
+        try:
+            reduced = reduce_formula(formula, subject_mappings)
+        except NonLinearFormula:
+            continue
+        linear[index] = True
+        linear_columns.append(reduced.weights)
+        biases.append(reduced.bias)
+
+    weights = (
+        np.column_stack(linear_columns) if linear_columns
+        else np.zeros((2 * len(INPUT_AXIS), 0))
+    )
+    return CatalogReduction(linear, weights, np.array(biases, dtype=np.float64))
+
+
+# MARK: - Catalog Engine
+
+class CatalogEngine:
+    """Scores candidates against a whole catalog of formulas
+
+    A precomputed reduction (from reduce_catalog over the same formulas and
+    subject mappings, e.g. out of a snapshot) skips reducing them again.
+    """
+
+    def __init__(
+        self,
+        formulas: List[Formula],
+        calculator: Optional[AdvancedFormulaCalculator] = None,
+        reduction: Optional[CatalogReduction] = None
+    ):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        self.batch = BatchFormulaCalculator(self.calculator)
+        self.formulas = formulas
+        self.program_ids = [f.program_id for f in formulas]
+        self.caps = np.array(
+            [f.metadata.max_possible_score for f in formulas], dtype=np.float64
+        )
+
+        if reduction is None:
+            reduction = reduce_catalog(formulas, self.calculator.subject_mappings)
+        self.linear = reduction.linear
+        self.weights = reduction.weights
+        self.biases = reduction.biases
+        self.linear_indices = np.flatnonzero(self.linear)
+        self.fallback_indices = np.flatnonzero(~self.linear)
+
+        self._build_requirement_terms()
+
+    def _build_requirement_terms(self) -> None:
+        """Deduplicate requirement checks into terms and a term x linear program incidence"""
+        terms: Dict[Tuple, int] = {}
+        rows: List[int] = []
+        columns: List[int] = []
+
+        for column, index in enumerate(self.linear_indices):
+            reqs = self.formulas[index].requirements
+            if not reqs:
+                continue
+            keys = [("mandatory", s) for s in reqs.mandatory_subjects or []]
+            keys += [("minimum", s, m) for s, m in (reqs.minimum_scores or {}).items()]
+            if reqs.practical_test_required:
+                keys.append(("practical",))
+            for key in keys:
+                rows.append(terms.setdefault(key, len(terms)))
+                columns.append(column)
+
+        self.requirement_terms = list(terms)
+        self.requirement_incidence = np.zeros(
+            (len(terms), self.linear_indices.size), dtype=np.float64
+        )
+        self.requirement_incidence[rows, columns] = 1.0
+
+    def _term_requirements(self, key: Tuple) -> FormulaRequirements:
+        if key[0] == "mandatory":
+            return FormulaRequirements(mandatory_subjects=[key[1]])
+        if key[0] == "minimum":
+            return FormulaRequirements(minimum_scores={key[1]: key[2]})
+        return FormulaRequirements(practical_test_required=True)
+
+    def features(self, cohort: Cohort) -> np.ndarray:
+        """Candidate x doubled-input-axis matrix, missing inputs read as 0"""
+        columns = []
+        for name in INPUT_AXIS:
+            source = cohort.matura.get(name) if name in MATURA_FIELDS else getattr(cohort, name)
+            columns.append(cohort.filled(source))
+        regular = np.column_stack(columns)
+
+        if cohort.is_bilingual is None:
+            bilingual = np.zeros(cohort.size, dtype=bool)
+        else:
+            bilingual = cohort.is_bilingual
+        regular_part = np.where(bilingual[:, None], 0.0, regular)
+        bilingual_part = np.where(bilingual[:, None], regular, 0.0)
+        return np.hstack([regular_part, bilingual_part])
+
+    def score(self, cohort: Cohort, fallback: bool = True) -> CatalogScores:
+        """Score every candidate in the cohort against every program
+
+        With fallback=False non-linear programs are left as NaN.
+        """
+        n = cohort.size
+        m = len(self.formulas)
+        scores = np.full((n, m), np.nan)
+        meets = np.zeros((n, m), dtype=bool)
+
+        if self.linear_indices.size:
+            totals = self.features(cohort) @ self.weights + self.biases
+            totals = np.minimum(totals, self.caps[self.linear_indices])
+
+            if self.requirement_terms:
+                failures = np.column_stack([
+                    ~self.batch._check_requirements(self._term_requirements(key), cohort)
+                    for key in self.requirement_terms
+                ]).astype(np.float64)
+                linear_meets = (failures @ self.requirement_incidence) == 0
+            else:
+                linear_meets = np.ones((n, self.linear_indices.size), dtype=bool)
+
+            scores[:, self.linear_indices] = np.where(linear_meets, totals, 0.0)
+            meets[:, self.linear_indices] = linear_meets
+
+        exact = self.linear.copy()
+        if fallback:
+            for index in self.fallback_indices:
+                result = self.batch.calculate(self.formulas[index], cohort)
+                scores[:, index] = result.total_scores
+                meets[:, index] = result.meets_requirements
+            exact[:] = True
+
+        return CatalogScores(
+            scores=scores,
+            meets_requirements=meets,
+            linear=self.linear.copy(),
+            exact=exact,
+            program_ids=self.program_ids
+        )
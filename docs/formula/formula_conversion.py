@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+IB / EB / foreign exam conversion into the Matura point scale
+Grades are converted through lookup tables precomputed per exam system, subject
+and level, once per candidate or as array lookups over a cohort, so scoring
+always reads plain Matura results
+"""
+
+import json
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from formula_batch import Cohort
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    ExamSystem,
+    ExtendedScores,
+    MATURA_SUBJECTS,
+    MaturaScores,
+    resolve_matura_field,
+)
+
+
+# Same schema as a tables file: per system, the grade grid, how foreign
+# levels map to Matura levels, and a table per subject ("*" for any subject)
+# and foreign level. A table is {"out_of": n} (grade * 100 / n),
+# {"scale": k} (grade * k) or {"points": {"grade": points, ...}}. Every
+# table is rounded half up to whole points, as Matura results are whole
+# percentages (IB 6 out of 7 gives 86, EB 7.25 gives 73), so converted
+# candidates pack into CompactScores like any other.
+DEFAULT_TABLES: Dict[str, Any] = {
+    "ib": {
+        "step": 1,
+        "max_grade": 7,
+        "levels": {"HL": "R", "SL": "P"},
+        "tables": {"*": {"HL": {"out_of": 7}, "SL": {"out_of": 7}}}
+    },
+    "eb": {
+        "step": 0.01,
+        "max_grade": 10,
+        "levels": {"advanced": "R", "standard": "P"},
+        "tables": {"*": {"advanced": {"scale": 10}, "standard": {"scale": 10}}}
+    }
+}
+
+
+@dataclass(frozen=True)
+class ForeignGrade:
+    """One exam result in a foreign system, e.g. IB mathematics HL 6"""
+    subject: str
+    level: str
+    grade: float
+
+
+@dataclass
+class ConversionTable:
+    """Matura points for every grade on a grid; points[round(grade / step)]
+
+    Grades without a conversion are NaN in points.
+    """
+    system: ExamSystem
+    subject: str
+    level: str
+    matura_level: str
+    step: float
+    points: np.ndarray
+
+    def index(self, grade: float) -> int:
+        position = int(round(grade / self.step))
+        if not 0 <= position < len(self.points) or np.isnan(self.points[position]):
+            subject = "" if self.subject == "*" else f"{self.subject} "
+            raise ValueError(
+                f"No {self.system.value} conversion for {subject}{self.level} grade {grade}"
+            )
+        return position
+
+
+def _build_points(spec: Dict[str, Any], step: float, max_grade: float) -> np.ndarray:
+    grades = np.arange(int(round(max_grade / step)) + 1) * step
+    if "out_of" in spec:
+        points = grades * 100 / spec["out_of"]
+    elif "scale" in spec:
+        points = grades * spec["scale"]
+    else:
+        points = np.full(len(grades), np.nan)
+        for grade, value in spec["points"].items():
+            points[int(round(float(grade) / step))] = value
+    # Half up; rounding to 9 places first keeps 72.49999999999999 at 73
+    return np.floor(np.round(points, 9) + 0.5)
+
+
+class ConversionTables:
+    """Tables keyed by (system, subject, foreign level), built once"""
+
+    def __init__(self, definitions: Optional[Dict[str, Any]] = None):
+        self.tables: Dict[Tuple[ExamSystem, str, str], ConversionTable] = {}
+        self.update(DEFAULT_TABLES if definitions is None else definitions)
+
+    @classmethod
+    def load(cls, *paths: str, defaults: bool = True) -> "ConversionTables":
+        """Tables from JSON files; later files override earlier ones and the defaults"""
+        tables = cls() if defaults else cls({})
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                tables.update(json.load(f))
+        return tables
+
+    def update(self, definitions: Dict[str, Any]) -> None:
+        for system_name, system in definitions.items():
+            exam_system = ExamSystem(system_name)
+            step = system["step"]
+            for subject, levels in system["tables"].items():
+                for level, spec in levels.items():
+                    self.tables[(exam_system, subject, level)] = ConversionTable(
+                        system=exam_system,
+                        subject=subject,
+                        level=level,
+                        matura_level=system["levels"][level],
+                        step=step,
+                        points=_build_points(spec, step, system["max_grade"])
+                    )
+
+    def get(self, system: ExamSystem, subject: str, level: str) -> ConversionTable:
+        table = self.tables.get((system, subject, level)) or self.tables.get((system, "*", level))
+        if table is None:
+            raise ValueError(f"No {system.value} conversion table for {subject} {level}")
+        return table
+
+
+class GradeConverter:
+    """Converts foreign grades into MaturaScores before scoring
+
+    Each (system, subject, level) is resolved once to a table and a Matura
+    field. Results are read at the table's Matura level, so basic-level
+    results land in the *_basic fields where those exist. When two grades
+    land in the same field the higher one counts.
+    """
+
+    def __init__(
+        self,
+        tables: Optional[ConversionTables] = None,
+        calculator: Optional[AdvancedFormulaCalculator] = None
+    ):
+        self.tables = tables or ConversionTables()
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        self._resolved: Dict[Tuple[ExamSystem, str, str], Tuple[ConversionTable, str]] = {}
+
+    def resolve(self, system: ExamSystem, subject: str, level: str) -> Tuple[ConversionTable, str]:
+        """Table and Matura field for a foreign subject/level"""
+        key = (system, subject, level)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            table = self.tables.get(system, subject, level)
+            field = resolve_matura_field(
+                subject, table.matura_level, self.calculator.subject_mappings
+            )
+            if field is None:
+                raise ValueError(f"Unknown subject: {subject}")
+            resolved = self._resolved[key] = (table, field)
+        return resolved
+
+    def matura_scores(self, system: ExamSystem, grades: Iterable[ForeignGrade]) -> MaturaScores:
+        """Matura results equivalent to one candidate's foreign grades"""
+        results: Dict[str, float] = {}
+        for grade in grades:
+            table, field = self.resolve(system, grade.subject, grade.level)
+            points = int(table.points[table.index(grade.grade)])
+            if field not in results or points > results[field]:
+                results[field] = points
+        return MaturaScores(**results)
+
+    def convert(self, scores: ExtendedScores, grades: Iterable[ForeignGrade]) -> ExtendedScores:
+        """Scores with Matura results replaced by the converted grades"""
+        return replace(scores, matura_scores=self.matura_scores(scores.exam_system, grades))
+
+    def columns(
+        self,
+        systems: Sequence[ExamSystem],
+        grades: Sequence[Optional[Sequence[ForeignGrade]]]
+    ) -> Dict[str, np.ndarray]:
+        """Converted Matura columns for many candidates, NaN where missing
+
+        Grades are grouped by table and converted with one array lookup per
+        table.
+        """
+        size = len(grades)
+        rows: List[int] = []
+        tables: List[int] = []
+        values: List[float] = []
+        table_ids: Dict[Tuple[ExamSystem, str, str], int] = {}
+        resolved: List[Tuple[ConversionTable, str]] = []
+        for row, (system, candidate) in enumerate(zip(systems, grades)):
+            for grade in candidate or ():
+                key = (system, grade.subject, grade.level)
+                table_id = table_ids.get(key)
+                if table_id is None:
+                    table_id = table_ids[key] = len(resolved)
+                    resolved.append(self.resolve(*key))
+                rows.append(row)
+                tables.append(table_id)
+                values.append(grade.grade)
+
+        columns = {name: np.full(size, np.nan) for name in MATURA_SUBJECTS}
+        row_array = np.array(rows, dtype=np.int64)
+        table_array = np.array(tables, dtype=np.int64)
+        grade_array = np.array(values, dtype=np.float64)
+        for table_id, (table, field) in enumerate(resolved):
+            mask = table_array == table_id
+            positions = np.rint(grade_array[mask] / table.step).astype(np.int64)
+            valid = (positions >= 0) & (positions < len(table.points))
+            points = np.full(len(positions), np.nan)
+            points[valid] = table.points[positions[valid]]
+            if np.isnan(points).any():
+                bad = grade_array[mask][np.isnan(points)][0]
+                table.index(bad)  # Raises with the offending grade
+            np.fmax.at(columns[field], row_array[mask], points)
+        return columns
+
+    def cohort(
+        self,
+        scores: List[ExtendedScores],
+        grades: Sequence[Optional[Sequence[ForeignGrade]]]
+    ) -> Cohort:
+        """Cohort for a mixed group; rows with grades take converted Matura columns"""
+        cohort = Cohort.from_scores(scores, self.calculator)
+        converted = np.array([g is not None for g in grades], dtype=bool)
+        if converted.any():
+            columns = self.columns([s.exam_system for s in scores], grades)
+            for name in MATURA_SUBJECTS:
+                cohort.matura[name] = np.where(converted, columns[name], cohort.matura[name])
+        return cohort
+
+
+_default_converter: Optional[GradeConverter] = None
+
+
+def default_converter() -> GradeConverter:
+    """Shared converter over DEFAULT_TABLES"""
+    global _default_converter
+    if _default_converter is None:
+        _default_converter = GradeConverter()
+    return _default_converter
+
+
+def parse_foreign_grades(data: List[Dict[str, Any]]) -> List[ForeignGrade]:
+    return [ForeignGrade(g["subject"], g["level"], g["grade"]) for g in data]
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Common-subexpression elimination across a formula catalog
+Canonicalizes components, operations, stage sums, requirement checks and bonus
+sets so that each distinct subexpression is evaluated once per candidate and
+shared by every formula that uses it
+"""
+
+import time
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, FrozenSet, Hashable, List, Optional, Sequence, Tuple, Union
+
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    AlternativeAssignment,
+    BonusRule,
+    CalculationResult,
+    CompactScores,
+    CompiledFormula,
+    ComponentType,
+    ExtendedScores,
+    Formula,
+    FormulaComponent,
+    FormulaRequirements,
+    Operation,
+    OperationType,
+    StageResult,
+    _compile_component,
+    _compile_operation,
+    alternative_subjects,
+    bonus_key,
+    fixed_subjects,
+    has_alternatives,
+    matura_vector,
+    resolve_level_coefficients,
+    resolve_matura_field,
+    subject_key,
+    threshold_cutoff,
+)
+
+
+# A reference to a node: ("c", index) for components and alternative
+# assignments, ("d", index) for picks from an assignment, operations and stage
+# sums, None for a missing component id (reads as 0).
+NodeRef = Optional[Tuple[str, int]]
+
+
+@dataclass
+class CSEStats:
+    """Node counts before and after deduplication"""
+    formulas: int
+    components: int
+    distinct_components: int
+    operations: int
+    distinct_operations: int
+    stages: int
+    distinct_stages: int
+    requirement_checks: int
+    distinct_requirement_checks: int
+
+    @property
+    def nodes(self) -> int:
+        return self.components + self.operations + self.stages
+
+    @property
+    def distinct_nodes(self) -> int:
+        return self.distinct_components + self.distinct_operations + self.distinct_stages
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Nodes referenced per node evaluated"""
+        return self.nodes / self.distinct_nodes if self.distinct_nodes else 1.0
+
+
+@dataclass
+class _StagePlan:
+    id: str
+    name: str
+    max_points: float
+    coefficient: float
+    cutoff: Optional[float]
+    node: int
+
+
+@dataclass
+class _FormulaPlan:
+    max_possible_score: float
+    checks: List[int]
+    stages: List[_StagePlan]
+    bonus: Optional[int]
+
+
+def _component_key(component: FormulaComponent, subject_mappings: Dict[str, str]) -> Hashable:
+    """Everything _compile_component's result depends on, and nothing else"""
+    min_score = component.min_score or None
+    cap = component.max_score * component.weight if component.max_score else None
+    if component.type == ComponentType.MATURA_EXAM:
+        level = component.level or "R"
+        return (
+            component.type,
+            resolve_matura_field(component.subject or "", level, subject_mappings),
+            resolve_level_coefficients(component.level_coefficients, level),
+            component.weight, min_score, cap
+        )
+    if component.type == ComponentType.PRACTICAL_EXAM:
+        return (component.type, component.id, component.weight, min_score, cap)
+    if component.type in (
+        ComponentType.INTERVIEW, ComponentType.PORTFOLIO, ComponentType.PREVIOUS_DEGREE
+    ):
+        return (component.type, component.weight, min_score, cap)
+    return ("constant", component.weight, min_score, cap)
+
+
+def _operation_value(operation: Operation) -> Optional[float]:
+    """The operation's value as _compile_operation reads it"""
+    if operation.type in (OperationType.MULTIPLY, OperationType.DIVIDE):
+        return operation.value or 1.0
+    if operation.type == OperationType.THRESHOLD:
+        return operation.value or 0
+    return None
+
+
+class CatalogPlan:
+    """Shared evaluation plan for a whole catalog
+
+    Results match CompiledFormula.evaluate(scores, breakdown=False) for every
+    formula. Every distinct node is evaluated for each candidate, so the plan
+    pays off when many formulas share subexpressions.
+    """
+
+    def __init__(
+        self,
+        formulas: List[Formula],
+        calculator: Optional[AdvancedFormulaCalculator] = None
+    ):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        self.formulas = formulas
+        mappings = self.calculator.subject_mappings
+
+        self._component_ids: Dict[Hashable, int] = {}
+        # A component, or the components of one stage that have alternatives
+        # with the subjects its fixed components take
+        self._component_specs: List[
+            Union[FormulaComponent, Tuple[List[FormulaComponent], FrozenSet[str]]]
+        ] = []
+        self._derived_ids: Dict[Hashable, int] = {}
+        self._derived_specs: List[Tuple] = []
+        self._check_ids: Dict[Hashable, int] = {}
+        self._checks: List[Callable[[ExtendedScores, Sequence[Optional[int]]], Optional[str]]] = []
+        self._bonus_ids: Dict[Hashable, int] = {}
+        self._bonuses: List[List[BonusRule]] = []
+        counts = {"components": 0, "operations": 0, "stages": 0, "requirement_checks": 0}
+
+        self.plans: List[_FormulaPlan] = []
+        for formula in formulas:
+            stages = []
+            for stage in formula.stages:
+                refs: Dict[str, NodeRef] = {}
+                last: Dict[str, FormulaComponent] = {}
+                for component in stage.components:
+                    counts["components"] += 1
+                    refs[component.id] = None
+                    last[component.id] = component
+                choosers = [c for c in last.values() if has_alternatives(c)]
+                for component in last.values():
+                    if not has_alternatives(component):
+                        refs[component.id] = self._intern_component(component, mappings)
+                if choosers:
+                    taken = fixed_subjects(last.values(), mappings)
+                    group = self._intern_alternatives(choosers, taken, mappings)
+                    for i, component in enumerate(choosers):
+                        key = ("pick", group, i)
+                        refs[component.id] = self._intern_derived(key, key)
+                for operation in stage.operations or []:
+                    if not operation.result_id:
+                        continue
+                    counts["operations"] += 1
+                    inputs = tuple(refs.get(cid) for cid in operation.component_ids)
+                    key = ("operation", operation.type, _operation_value(operation), inputs)
+                    refs[operation.result_id] = self._intern_derived(
+                        key, ("operation", operation, inputs)
+                    )
+                counts["stages"] += 1
+                inputs = tuple(refs.values())
+                node = self._intern_derived(("sum", inputs), ("sum", inputs))
+                stages.append(_StagePlan(
+                    id=stage.id,
+                    name=stage.name,
+                    max_points=stage.max_points,
+                    coefficient=stage.coefficient or 1.0,
+                    cutoff=threshold_cutoff(stage.threshold, stage.max_points),
+                    node=node[1]
+                ))
+
+            checks = self._intern_requirements(formula.requirements, mappings)
+            counts["requirement_checks"] += len(checks)
+            bonus = None
+            if formula.bonuses:
+                key = bonus_key(formula.bonuses)
+                bonus = self._bonus_ids.setdefault(key, len(self._bonuses))
+                if bonus == len(self._bonuses):
+                    self._bonuses.append(formula.bonuses)
+            self.plans.append(_FormulaPlan(
+                formula.metadata.max_possible_score, checks, stages, bonus
+            ))
+
+        self.stats = CSEStats(
+            formulas=len(formulas),
+            components=counts["components"],
+            distinct_components=len(self._component_specs),
+            operations=counts["operations"],
+            distinct_operations=sum(1 for spec in self._derived_specs if spec[0] == "operation"),
+            stages=counts["stages"],
+            distinct_stages=sum(1 for spec in self._derived_specs if spec[0] == "sum"),
+            requirement_checks=counts["requirement_checks"],
+            distinct_requirement_checks=len(self._checks)
+        )
+        self._finalize(mappings)
+
+    # MARK: - Interning
+
+    def _intern_component(
+        self, component: FormulaComponent, mappings: Dict[str, str]
+    ) -> NodeRef:
+        key = _component_key(component, mappings)
+        index = self._component_ids.setdefault(key, len(self._component_specs))
+        if index == len(self._component_specs):
+            self._component_specs.append(component)
+        return ("c", index)
+
+    def _intern_alternatives(
+        self, choosers: List[FormulaComponent], taken: FrozenSet[str], mappings: Dict[str, str]
+    ) -> NodeRef:
+        """One node for the assignment, valued as the list of chooser values
+
+        The key lists only the subjects left once taken is removed, so stages
+        that differ only in subjects nobody could pick still share the node.
+        """
+        key = ("alternatives",) + tuple(
+            (
+                _component_key(replace(c, subject="", alternatives=None), mappings),
+                tuple(
+                    (subject_key(field), _component_key(
+                        replace(c, subject=subject, alternatives=None), mappings
+                    ))
+                    for subject, field in alternative_subjects(c, mappings, taken)
+                )
+            )
+            for c in choosers
+        )
+        index = self._component_ids.setdefault(key, len(self._component_specs))
+        if index == len(self._component_specs):
+            self._component_specs.append((choosers, taken))
+        return ("c", index)
+
+    def _intern_derived(self, key: Hashable, spec: Tuple) -> NodeRef:
+        index = self._derived_ids.setdefault(key, len(self._derived_specs))
+        if index == len(self._derived_specs):
+            self._derived_specs.append(spec)
+        return ("d", index)
+
+    def _intern_requirements(
+        self, reqs: Optional[FormulaRequirements], mappings: Dict[str, str]
+    ) -> List[int]:
+        """Indices of the formula's checks, in the order CompiledFormula runs them"""
+        if not reqs:
+            return []
+        keys: List[Tuple[Hashable, FormulaRequirements]] = []
+        for subject in reqs.mandatory_subjects or []:
+            keys.append((("mandatory", subject), FormulaRequirements(mandatory_subjects=[subject])))
+        for subject, minimum in (reqs.minimum_scores or {}).items():
+            keys.append((
+                ("minimum", subject, minimum),
+                FormulaRequirements(minimum_scores={subject: minimum})
+            ))
+        if reqs.practical_test_required:
+            keys.append((("practical",), FormulaRequirements(practical_test_required=True)))
+
+        indices = []
+        for key, single in keys:
+            index = self._check_ids.setdefault(key, len(self._checks))
+            if index == len(self._checks):
+                self._checks.extend(CompiledFormula._compile_requirements(single, mappings))
+            indices.append(index)
+        return indices
+
+    def _finalize(self, mappings: Dict[str, str]) -> None:
+        """Compile node functions; values are laid out components first"""
+        offset = len(self._component_specs)
+
+        def index(ref: NodeRef) -> Optional[int]:
+            if ref is None:
+                return None
+            kind, position = ref
+            return position if kind == "c" else offset + position
+
+        self._component_functions = [
+            AlternativeAssignment(spec[0], mappings, spec[1]) if isinstance(spec, tuple)
+            else _compile_component(spec, mappings)
+            for spec in self._component_specs
+        ]
+        self._derived_functions: List[Callable[[List[float]], float]] = []
+        for spec in self._derived_specs:
+            if spec[0] == "pick":
+                _, group, i = spec
+                self._derived_functions.append(self._pick(index(group), i))
+                continue
+            operation, inputs = spec[-2:] if spec[0] == "operation" else (None, spec[1])
+            positions = [index(ref) for ref in inputs]
+            if operation is None:
+                self._derived_functions.append(self._sum(positions))
+            else:
+                # Give each input a synthetic id so _compile_operation reads
+                # node values; missing ids stay missing and read as 0.
+                ids = [str(i) for i in range(len(positions))]
+                slots = {cid: p for cid, p in zip(ids, positions) if p is not None}
+                renamed = Operation(operation.id, operation.type, ids, operation.value, operation.result_id)
+                self._derived_functions.append(_compile_operation(renamed, slots))
+
+        for plan in self.plans:
+            for stage in plan.stages:
+                stage.node += offset
+
+    @staticmethod
+    def _pick(group: int, i: int) -> Callable[[List[float]], float]:
+        return lambda values: values[group][i]
+
+    @staticmethod
+    def _sum(positions: List[Optional[int]]) -> Callable[[List[float]], float]:
+        # Slots of a stage always hold a node, so positions has no None
+        return lambda values: sum([values[i] for i in positions])
+
+    # MARK: - Evaluation
+
+    def node_values(
+        self, scores: ExtendedScores, matura: Sequence[Optional[int]]
+    ) -> List[float]:
+        """Every distinct node, evaluated once"""
+        values = [function(scores, matura) for function in self._component_functions]
+        append = values.append
+        for function in self._derived_functions:
+            append(function(values))
+        return values
+
+    def _matura(self, scores: ExtendedScores) -> Sequence[Optional[int]]:
+        if isinstance(scores, CompactScores):
+            return scores.matura
+        return matura_vector(scores.matura_scores)
+
+    def totals(self, scores: ExtendedScores) -> List[float]:
+        """Total score for every formula, 0 where requirements are not met"""
+        matura = self._matura(scores)
+        values = self.node_values(scores, matura)
+        reasons = [check(scores, matura) for check in self._checks]
+        bonuses = [self.calculator._calculate_bonuses(b, scores) for b in self._bonuses]
+
+        totals = []
+        for plan in self.plans:
+            if any(reasons[i] for i in plan.checks):
+                totals.append(0)
+                continue
+            total = 0
+            for stage in plan.stages:
+                score = values[stage.node]
+                if stage.cutoff is not None and score < stage.cutoff:
+                    break
+                total += score * stage.coefficient
+            if plan.bonus is not None:
+                total += bonuses[plan.bonus]
+            totals.append(min(total, plan.max_possible_score))
+        return totals
+
+    def evaluate(self, scores: ExtendedScores) -> List[CalculationResult]:
+        """Results for every formula, as CompiledFormula.evaluate(scores, breakdown=False)"""
+        matura = self._matura(scores)
+        values = self.node_values(scores, matura)
+        reasons = [check(scores, matura) for check in self._checks]
+        bonuses = [self.calculator._calculate_bonuses(b, scores) for b in self._bonuses]
+
+        results = []
+        for plan in self.plans:
+            reason = next((reasons[i] for i in plan.checks if reasons[i]), None)
+            if reason:
+                results.append(CalculationResult(
+                    total_score=0,
+                    stage_results=[],
+                    bonus_points=0,
+                    meets_requirements=False,
+                    disqualification_reason=reason
+                ))
+                continue
+
+            stage_results = []
+            total = 0
+            for stage in plan.stages:
+                score = values[stage.node]
+                passed = stage.cutoff is None or score >= stage.cutoff
+                stage_results.append(StageResult(
+                    stage_id=stage.id,
+                    stage_name=stage.name,
+                    score=score,
+                    max_score=stage.max_points,
+                    passed=passed,
+                    component_scores={}
+                ))
+                if not passed:
+                    break
+                total += score * stage.coefficient
+
+            bonus_points = 0
+            if plan.bonus is not None:
+                bonus_points = bonuses[plan.bonus]
+                total += bonus_points
+            results.append(CalculationResult(
+                total_score=min(total, plan.max_possible_score),
+                stage_results=stage_results,
+                bonus_points=bonus_points,
+                meets_requirements=True
+            ))
+        return results
+
+
+def measure_speedup(
+    formulas: List[Formula],
+    candidates: List[ExtendedScores],
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> Dict[str, float]:
+    """Time one candidate against the whole catalog, per-formula plans vs shared plan"""
+    calculator = calculator or AdvancedFormulaCalculator()
+    compiled = [calculator.compile(f) for f in formulas]
+    plan = CatalogPlan(formulas, calculator)
+
+    start = time.perf_counter()
+    for scores in candidates:
+        for formula_plan in compiled:
+            formula_plan.evaluate(scores, breakdown=False)
+    separate = (time.perf_counter() - start) / len(candidates)
+
+    start = time.perf_counter()
+    for scores in candidates:
+        plan.evaluate(scores)
+    shared = (time.perf_counter() - start) / len(candidates)
+
+    start = time.perf_counter()
+    for scores in candidates:
+        plan.totals(scores)
+    totals = (time.perf_counter() - start) / len(candidates)
+
+    return {
+        "dedup_ratio": plan.stats.dedup_ratio,
+        "compiled_ms": 1000 * separate,
+        "shared_ms": 1000 * shared,
+        "shared_totals_ms": 1000 * totals,
+        "speedup": separate / shared if shared else 0.0,
+        "totals_speedup": separate / totals if totals else 0.0
+    }
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Upper-bound index for "best programs for this student" queries
+Each formula gets a weight vector that bounds its total from above; programs
+whose bound cannot beat the current k-th best margin over the threshold, or
+whose requirements already fail, are never evaluated
+"""
+
+import heapq
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from formula_bonus import BonusTable
+from formula_candidates import formula_inputs
+from formula_catalog import INPUT_AXIS, INPUT_INDEX, Affine, LinearFormula
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    CalculationResult,
+    CompiledFormula,
+    ComponentType,
+    ExtendedScores,
+    Formula,
+    FormulaComponent,
+    FormulaStage,
+    InputKey,
+    MATURA_SUBJECTS,
+    Operation,
+    OperationType,
+    alternative_subjects,
+    matura_vector,
+    resolve_level_coefficients,
+    resolve_matura_field,
+)
+
+
+# MARK: - Upper Bounds
+#
+# Every bound is affine over the doubled input axis (see formula_catalog) with
+# non-negative weights and bias, so it is also an upper bound of 0. A bias of
+# inf means no affine bound exists and the program is bounded by its cap.
+
+UNBOUNDED = float("inf")
+
+# Bounds of linear formulas equal their totals up to summation order, so
+# they are widened by this relative margin before pruning.
+BOUND_TOLERANCE = 1e-9
+
+
+def bound_formula(formula: Formula, subject_mappings: Dict[str, str]) -> LinearFormula:
+    """Weights and bias with total <= min(cap, weights . features + bias)
+
+    Holds for every candidate, with missing inputs read as 0 as everywhere else.
+    """
+    width = 2 * len(INPUT_AXIS)
+    weights = np.zeros(width)
+    bias = 0.0
+    for stage in formula.stages:
+        coefficient = stage.coefficient or 1.0
+        if coefficient < 0:
+            return LinearFormula(weights, UNBOUNDED)
+        # A failed threshold drops the stage, and every bound is >= 0
+        stage_weights, stage_bias = _bound_stage(stage, subject_mappings, width)
+        weights += stage_weights * coefficient
+        bias += stage_bias * coefficient
+
+    if formula.bonuses:
+        bonus = BonusTable(formula.bonuses, subject_mappings).upper_bound()
+        if bonus is None:
+            return LinearFormula(weights, UNBOUNDED)
+        bias += bonus
+    return LinearFormula(weights, bias)
+
+
+def _bound_stage(
+    stage: FormulaStage, subject_mappings: Dict[str, str], width: int
+) -> Affine:
+    slots: Dict[str, Affine] = {}
+    for component in stage.components:
+        slots[component.id] = _bound_component(component, subject_mappings, width)
+    for operation in stage.operations or []:
+        if operation.result_id:
+            slots[operation.result_id] = _bound_operation(operation, slots, width)
+    return (
+        sum((w for w, _ in slots.values()), np.zeros(width)),
+        sum(b for _, b in slots.values())
+    )
+
+
+def _bound_component(
+    component: FormulaComponent, subject_mappings: Dict[str, str], width: int
+) -> Affine:
+    """Clamps only lower a component; a negative weight bounds it by 0"""
+    weights = np.zeros(width)
+    half = width // 2
+    weight = component.weight
+
+    if component.type == ComponentType.MATURA_EXAM:
+        coefficient, bilingual_coefficient = resolve_level_coefficients(
+            component.level_coefficients, component.level or "R"
+        )
+        # Alternatives pick one subject; the sum over the options bounds it
+        for _, attr_name in alternative_subjects(component, subject_mappings):
+            index = INPUT_INDEX[attr_name]
+            weights[index] = max(coefficient * weight, 0.0)
+            weights[half + index] = max(bilingual_coefficient * weight, 0.0)
+        return weights, 0.0
+
+    if component.type in (
+        ComponentType.INTERVIEW, ComponentType.PORTFOLIO, ComponentType.PREVIOUS_DEGREE
+    ):
+        name, scale = {
+            ComponentType.INTERVIEW: ("interview_score", 1.0),
+            ComponentType.PORTFOLIO: ("portfolio_score", 1.0),
+            ComponentType.PREVIOUS_DEGREE: ("previous_degree_gpa", 10.0),
+        }[component.type]
+        index = INPUT_INDEX[name]
+        weights[index] = weights[half + index] = max(scale * weight, 0.0)
+        return weights, 0.0
+
+    if component.type == ComponentType.PRACTICAL_EXAM:
+        if weight <= 0:
+            return weights, 0.0
+        if component.max_score:
+            return weights, max(component.max_score * weight, 0.0)
+        return weights, UNBOUNDED
+
+    return weights, 0.0
+
+
+def _bound_operation(
+    operation: Operation, slots: Dict[str, Affine], width: int
+) -> Affine:
+    zero: Affine = (np.zeros(width), 0.0)
+    values = [slots.get(cid, zero) for cid in operation.component_ids]
+
+    def scaled(factor: float) -> Affine:
+        return (
+            sum((w for w, _ in values), np.zeros(width)) * factor,
+            sum(b for _, b in values) * factor
+        )
+
+    # MAX <= sum of the bounds, MIN <= their mean, since all are >= 0
+    if operation.type in (OperationType.MAX, OperationType.SUM):
+        return scaled(1.0)
+    if operation.type in (OperationType.MIN, OperationType.AVERAGE):
+        return scaled(1.0 / len(values)) if values else zero
+    if operation.type == OperationType.DIVIDE:
+        divisor = operation.value or 1.0
+        return scaled(1.0 / divisor) if divisor > 0 else (np.zeros(width), UNBOUNDED)
+    if operation.type == OperationType.MULTIPLY:
+        factor = operation.value or 1.0
+        if not values:
+            return np.zeros(width), max(factor, 0.0)
+        if len(values) > 1 or factor < 0:
+            return np.zeros(width), UNBOUNDED
+        return scaled(factor)
+    if operation.type == OperationType.THRESHOLD:
+        return values[0] if values else zero
+    return zero
+
+
+# MARK: - Index
+
+@dataclass
+class ProgramMatch:
+    """One program in a top-k answer; margin is total minus the target"""
+    program_id: str
+    index: int
+    total_score: float
+    target: float
+    margin: float
+    result: CalculationResult
+
+
+@dataclass
+class TopPrograms:
+    """Exact top-k programs by margin, with how much of the catalog was read
+
+    Only programs whose requirements are met and whose stages are all passed
+    are ranked; ties keep catalog order.
+    """
+    matches: List[ProgramMatch]
+    evaluated: int
+    pruned_by_requirements: int
+    pruned_by_bound: int
+    without_target: int
+
+
+class ProgramIndex:
+    """Per-program inputs, requirement terms and upper-bound weights
+
+    Requirement terms are deduplicated across the catalog like the catalog
+    engine's: a program is skipped when any of its terms fails, which is
+    exactly when calculate would disqualify it.
+    """
+
+    def __init__(
+        self,
+        formulas: List[Formula],
+        calculator: Optional[AdvancedFormulaCalculator] = None
+    ):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        mappings = self.calculator.subject_mappings
+        self.formulas = formulas
+        self.program_ids = [f.program_id for f in formulas]
+        self.plans: List[Optional[CompiledFormula]] = [None] * len(formulas)
+        self.inputs: List[Set[InputKey]] = [formula_inputs(f, mappings) for f in formulas]
+        self.caps = np.array([f.metadata.max_possible_score for f in formulas], dtype=np.float64)
+        self.targets = np.array([
+            np.nan if f.metadata.last_year_threshold is None else f.metadata.last_year_threshold
+            for f in formulas
+        ], dtype=np.float64)
+
+        bounds = [bound_formula(f, mappings) for f in formulas]
+        self.weights = (
+            np.column_stack([b.weights for b in bounds]) if bounds
+            else np.zeros((2 * len(INPUT_AXIS), 0))
+        )
+        self.biases = np.array([b.bias for b in bounds], dtype=np.float64)
+        self._build_requirement_terms()
+
+    def _build_requirement_terms(self) -> None:
+        """Requirement terms as (field indices, minimum) over the input axis
+
+        A mandatory subject passes with a non-zero result at either level, a
+        minimum score with the extended result at or above it; a term
+        without fields always fails, as calculate has nothing to read.
+        """
+        mappings = self.calculator.subject_mappings
+        terms: Dict[Tuple, int] = {}
+        rows: List[int] = []
+        columns: List[int] = []
+        for column, formula in enumerate(self.formulas):
+            reqs = formula.requirements
+            if not reqs:
+                continue
+            keys: List[Tuple] = []
+            for subject in reqs.mandatory_subjects or []:
+                fields = {resolve_matura_field(subject, level, mappings) for level in ("R", "P")}
+                keys.append(("mandatory", tuple(sorted(
+                    INPUT_INDEX[f] for f in fields if f is not None
+                ))))
+            for subject, minimum in (reqs.minimum_scores or {}).items():
+                field = resolve_matura_field(subject, "R", mappings)
+                keys.append(("minimum", () if field is None else (INPUT_INDEX[field],), minimum))
+            if reqs.practical_test_required:
+                keys.append(("practical",))
+            for key in keys:
+                rows.append(terms.setdefault(key, len(terms)))
+                columns.append(column)
+
+        self.requirement_terms = list(terms)
+        self.requirement_incidence = np.zeros((len(terms), len(self.formulas)))
+        self.requirement_incidence[rows, columns] = 1.0
+
+    def plan(self, index: int) -> CompiledFormula:
+        plan = self.plans[index]
+        if plan is None:
+            plan = self.plans[index] = self.calculator.compile(self.formulas[index])
+        return plan
+
+    # MARK: - Queries
+
+    def features(self, scores: ExtendedScores) -> np.ndarray:
+        """One candidate on the doubled input axis, missing inputs read as 0"""
+        regular = np.zeros(len(INPUT_AXIS))
+        for name, value in zip(MATURA_SUBJECTS, matura_vector(scores.matura_scores)):
+            if value:
+                regular[INPUT_INDEX[name]] = value
+        for name in ("interview_score", "portfolio_score", "previous_degree_gpa"):
+            regular[INPUT_INDEX[name]] = getattr(scores, name) or 0.0
+        if scores.is_bilingual:
+            return np.concatenate([np.zeros(len(INPUT_AXIS)), regular])
+        return np.concatenate([regular, np.zeros(len(INPUT_AXIS))])
+
+    def upper_bounds(self, scores: ExtendedScores) -> np.ndarray:
+        """Upper bound on every program's total for this candidate"""
+        return np.minimum(self.caps, self.features(scores) @ self.weights + self.biases)
+
+    def failed_requirements(self, scores: ExtendedScores) -> np.ndarray:
+        """Mask of programs whose requirements this candidate fails"""
+        if not self.requirement_terms:
+            return np.zeros(len(self.formulas), dtype=bool)
+        x = self.features(scores)
+        x = x[:len(INPUT_AXIS)] + x[len(INPUT_AXIS):]
+        failures = np.zeros(len(self.requirement_terms))
+        for row, key in enumerate(self.requirement_terms):
+            if key[0] == "mandatory":
+                failed = not any(x[i] != 0 for i in key[1])
+            elif key[0] == "minimum":
+                failed = (x[key[1][0]] if key[1] else 0.0) < key[2]
+            else:
+                failed = not scores.practical_exams
+            failures[row] = failed
+        return (failures @ self.requirement_incidence) > 0
+
+    def top(
+        self,
+        scores: ExtendedScores,
+        k: int = 20,
+        targets: Optional[Sequence[Optional[float]]] = None
+    ) -> TopPrograms:
+        """The k programs where the candidate's total most exceeds the target
+
+        targets defaults to each program's metadata.last_year_threshold;
+        programs without a target are not ranked. Programs are evaluated in
+        order of their bound's margin until no remaining bound can beat the
+        k-th best exact margin.
+        """
+        target_array = self.targets if targets is None else np.array(
+            [np.nan if t is None else t for t in targets], dtype=np.float64
+        )
+        has_target = ~np.isnan(target_array)
+        failed = self.failed_requirements(scores) & has_target
+        open_programs = np.flatnonzero(has_target & ~failed)
+
+        bounds = self.upper_bounds(scores)[open_programs]
+        bounds = bounds + BOUND_TOLERANCE * (1.0 + np.abs(bounds))
+        bound_margins = bounds - target_array[open_programs]
+        order = open_programs[np.lexsort((open_programs, -bound_margins))]
+        bound_margins = np.sort(bound_margins)[::-1]
+
+        # Min-heap of the best k as (margin, -index), so the root is the
+        # match that the next candidate has to beat
+        best: List[Tuple[float, int, ProgramMatch]] = []
+        evaluated = 0
+        for position, index in enumerate(order):
+            if len(best) == k and bound_margins[position] < best[0][0]:
+                break
+            evaluated += 1
+            result = self.plan(index).evaluate(scores, breakdown=False)
+            if not result.meets_requirements or len(result.stage_results) != len(
+                self.formulas[index].stages
+            ) or not all(stage.passed for stage in result.stage_results):
+                continue
+            target = float(target_array[index])
+            match = ProgramMatch(
+                program_id=self.program_ids[index],
+                index=int(index),
+                total_score=result.total_score,
+                target=target,
+                margin=result.total_score - target,
+                result=result
+            )
+            entry = (match.margin, -int(index), match)
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif entry[:2] > best[0][:2]:
+                heapq.heapreplace(best, entry)
+
+        matches = [entry[2] for entry in sorted(best, key=lambda e: e[:2], reverse=True)]
+        return TopPrograms(
+            matches=matches,
+            evaluated=evaluated,
+            pruned_by_requirements=int(failed.sum()),
+            pruned_by_bound=len(order) - evaluated,
+            without_target=int((~has_target).sum())
+        )
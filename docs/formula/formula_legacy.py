@@ -0,0 +1,607 @@
+#!/usr/bin/env python3
+"""
+Compiler for legacy string formulas
+Tokenizes and parses expressions such as "0.5*MAT_R + 0.3*max(INF_R,FIZ_R)" or
+"0.6 × matematyka (R) + 0.4 × max(fizyka, chemia) (R)" into structured Formula
+documents, so legacy programs share the compiled evaluation paths
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    CompiledFormula,
+    ExtendedScores,
+    Formula,
+    MaturaScores,
+    OperationType,
+    resolve_matura_field,
+)
+
+
+class LegacyFormulaError(ValueError):
+    """Raised for expressions the compiler cannot parse or represent"""
+
+    def __init__(self, message: str, expression: str, position: Optional[int] = None):
+        self.expression = expression
+        self.position = position
+        where = f" at column {position + 1}" if position is not None else ""
+        super().__init__(f"{message}{where}: {expression!r}")
+
+
+# Normalized subject names, abbreviations and MaturaScores fields -> subject code
+SUBJECT_NAMES: Dict[str, str] = {
+    "mat": "MAT", "matematyka": "MAT", "mathematics": "MAT",
+    "pol": "POL", "j.pol": "POL", "polski": "POL", "język polski": "POL",
+    "jezyk polski": "POL", "j. polski": "POL", "polish": "POL",
+    "ang": "ANG", "angielski": "ANG", "język angielski": "ANG",
+    "jezyk angielski": "ANG", "j. angielski": "ANG",
+    "j.obc": "J.OBC", "obcy": "J.OBC", "język obcy": "J.OBC", "jezyk obcy": "J.OBC",
+    "j. obcy": "J.OBC", "język obcy nowożytny": "J.OBC", "foreign_language": "J.OBC",
+    "fiz": "FIZ", "fizyka": "FIZ", "physics": "FIZ",
+    "chem": "CHEM", "che": "CHEM", "chemia": "CHEM", "chemistry": "CHEM",
+    "bio": "BIO", "biologia": "BIO", "biology": "BIO",
+    "inf": "INF", "informatyka": "INF", "computer_science": "INF",
+    "geo": "GEO", "geografia": "GEO", "geography": "GEO",
+    "his": "HIS", "hist": "HIS", "historia": "HIS", "history": "HIS",
+    "wos": "WOS", "wiedza o społeczeństwie": "WOS", "social_studies": "WOS",
+}
+
+FUNCTIONS: Dict[str, OperationType] = {
+    "max": OperationType.MAX,
+    "min": OperationType.MIN,
+    "sum": OperationType.SUM,
+    "suma": OperationType.SUM,
+    "avg": OperationType.AVERAGE,
+    "average": OperationType.AVERAGE,
+    "mean": OperationType.AVERAGE,
+    "średnia": OperationType.AVERAGE,
+    "srednia": OperationType.AVERAGE,
+}
+
+# Upper end of a Matura result, used for max_possible_score
+MATURA_MAX = 100
+
+
+# MARK: - Tokenizer
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<number>\d+(?:\.\d*)?|\.\d+)
+  | (?P<level>\(\s*[RrPp]\s*\))
+  | (?P<name>[^\W\d][\w.]*(?:[ \t]+[^\W\d][\w.]*)*)
+  | (?P<op>[-+*/×·−=(),])
+""", re.VERBOSE)
+
+_OPERATORS = {"×": "*", "·": "*", "−": "-"}
+
+
+@dataclass(frozen=True)
+class Token:
+    kind: str
+    text: str
+    position: int
+
+
+def tokenize(expression: str) -> List[Token]:
+    tokens = []
+    position = 0
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match:
+            raise LegacyFormulaError(
+                f"Unexpected character {expression[position]!r}", expression, position
+            )
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "op":
+            text = _OPERATORS.get(text, text)
+        elif kind == "level":
+            text = text.strip("() \t").upper()
+        if kind != "space":
+            tokens.append(Token(kind, text, position))
+        position = match.end()
+    tokens.append(Token("end", "", len(expression)))
+    return tokens
+
+
+# MARK: - Expression Tree
+
+@dataclass(frozen=True)
+class Subject:
+    """A Matura result; level None reads as R, as in FormulaComponent"""
+    code: str
+    level: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Call:
+    operation: OperationType
+    arguments: Tuple["Linear", ...]
+
+
+Atom = Union[Subject, Call]
+
+
+@dataclass(frozen=True)
+class Linear:
+    """sum(coefficient * atom) + constant"""
+    terms: Tuple[Tuple[float, Atom], ...] = ()
+    constant: float = 0.0
+
+    def __add__(self, other: "Linear") -> "Linear":
+        return Linear(self.terms + other.terms, self.constant + other.constant)
+
+    def scale(self, factor: float) -> "Linear":
+        return Linear(
+            tuple((factor * c, atom) for c, atom in self.terms), factor * self.constant
+        )
+
+    def with_level(self, level: str) -> "Linear":
+        """Apply a trailing (R)/(P) to every subject that has no level yet"""
+        return Linear(tuple((c, _with_level(atom, level)) for c, atom in self.terms), self.constant)
+
+
+def _with_level(atom: Atom, level: str) -> Atom:
+    if isinstance(atom, Subject):
+        return atom if atom.level else replace(atom, level=level)
+    return replace(atom, arguments=tuple(a.with_level(level) for a in atom.arguments))
+
+
+class _Parser:
+    """Recursive descent over the token list
+
+    formula := [W =] expr
+    expr    := term (("+" | "-") term)*
+    term    := unary (("*" | "/") unary)*
+    unary   := ("+" | "-") unary | primary [level]
+    primary := number | function "(" expr ("," expr)* ")" | subject | "(" expr ")"
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.index = 0
+
+    def parse(self) -> Linear:
+        if (
+            self.peek.kind == "name" and self.peek.text.upper() == "W"
+            and self.tokens[self.index + 1].text == "="
+        ):
+            self.index += 2
+        result = self.expr()
+        if self.peek.kind != "end":
+            self.fail(f"Unexpected {self.peek.text!r}")
+        return result
+
+    @property
+    def peek(self) -> Token:
+        return self.tokens[self.index]
+
+    def take(self, text: Optional[str] = None) -> Token:
+        token = self.peek
+        if text is not None and token.text != text:
+            self.fail(f"Expected {text!r}")
+        self.index += 1
+        return token
+
+    def fail(self, message: str, token: Optional[Token] = None) -> None:
+        token = token or self.peek
+        raise LegacyFormulaError(message, self.expression, token.position)
+
+    def expr(self) -> Linear:
+        result = self.term()
+        while self.peek.text in ("+", "-"):
+            sign = 1.0 if self.take().text == "+" else -1.0
+            result = result + self.term().scale(sign)
+        return result
+
+    def term(self) -> Linear:
+        result = self.unary()
+        while self.peek.text in ("*", "/"):
+            operator = self.take()
+            right = self.unary()
+            if operator.text == "/":
+                if right.terms:
+                    self.fail("Division by a subject is not linear", operator)
+                if right.constant == 0:
+                    self.fail("Division by zero", operator)
+                result = result.scale(1.0 / right.constant)
+            elif not right.terms:
+                result = result.scale(right.constant)
+            elif not result.terms:
+                result = right.scale(result.constant)
+            else:
+                self.fail("Product of two subjects is not linear", operator)
+        return result
+
+    def unary(self) -> Linear:
+        if self.peek.text in ("+", "-"):
+            sign = 1.0 if self.take().text == "+" else -1.0
+            return self.unary().scale(sign)
+        result = self.primary()
+        if self.peek.kind == "level":
+            result = result.with_level(self.take().text)
+        return result
+
+    def primary(self) -> Linear:
+        token = self.peek
+        if token.kind == "number":
+            self.take()
+            return Linear(constant=float(token.text))
+        if token.text == "(":
+            self.take()
+            result = self.expr()
+            self.take(")")
+            return result
+        if token.kind != "name":
+            self.fail("Expected a number, subject or function")
+        self.take()
+
+        name = " ".join(token.text.lower().split())
+        if self.peek.text == "(":
+            if name not in FUNCTIONS:
+                self.fail(f"Unknown function {token.text!r}", token)
+            self.take()
+            arguments = [self.expr()]
+            while self.peek.text == ",":
+                self.take()
+                arguments.append(self.expr())
+            self.take(")")
+            for argument in arguments:
+                if argument.constant:
+                    self.fail("Constants inside functions are not supported", token)
+            return Linear(((1.0, Call(FUNCTIONS[name], tuple(arguments))),))
+        return Linear(((1.0, self.subject(name, token)),))
+
+    def subject(self, name: str, token: Token) -> Subject:
+        level = None
+        if name[-2:] in ("_r", "_p"):
+            name, level = name[:-2], name[-1].upper()
+        code = SUBJECT_NAMES.get(name)
+        if code is None:
+            self.fail(f"Unknown subject {token.text!r}", token)
+        return Subject(code, level)
+
+
+# MARK: - Parsed Expressions
+
+@dataclass(frozen=True)
+class LegacyExpression:
+    """A parsed legacy formula; immutable and shared through the parse cache"""
+    source: str
+    linear: Linear
+
+    def bounds(self) -> Tuple[float, float]:
+        """Lowest and highest value with every result in 0..100"""
+        return _linear_bounds(self.linear)
+
+    def evaluate(
+        self, scores: ExtendedScores, subject_mappings: Optional[Dict[str, str]] = None
+    ) -> float:
+        """Interpret the expression directly; the reference for validation"""
+        mappings = subject_mappings if subject_mappings is not None else _MAPPINGS
+        return _evaluate_linear(self.linear, scores.matura_scores, mappings)
+
+
+def _linear_bounds(linear: Linear) -> Tuple[float, float]:
+    low = high = linear.constant
+    for coefficient, atom in linear.terms:
+        atom_low, atom_high = _atom_bounds(atom)
+        a, b = coefficient * atom_low, coefficient * atom_high
+        low += min(a, b)
+        high += max(a, b)
+    return low, high
+
+
+def _atom_bounds(atom: Atom) -> Tuple[float, float]:
+    if isinstance(atom, Subject):
+        return 0.0, float(MATURA_MAX)
+    lows, highs = zip(*(_linear_bounds(a) for a in atom.arguments))
+    if atom.operation == OperationType.MAX:
+        return max(lows), max(highs)
+    if atom.operation == OperationType.MIN:
+        return min(lows), min(highs)
+    if atom.operation == OperationType.SUM:
+        return sum(lows), sum(highs)
+    return sum(lows) / len(lows), sum(highs) / len(highs)
+
+
+def _evaluate_linear(linear: Linear, matura: MaturaScores, mappings: Dict[str, str]) -> float:
+    total = linear.constant
+    for coefficient, atom in linear.terms:
+        if isinstance(atom, Subject):
+            field = resolve_matura_field(atom.code, atom.level or "R", mappings)
+            score = getattr(matura, field) if field else None
+            value = float(score) if score is not None else 0.0
+        else:
+            values = [_evaluate_linear(a, matura, mappings) for a in atom.arguments]
+            if atom.operation == OperationType.MAX:
+                value = max(values)
+            elif atom.operation == OperationType.MIN:
+                value = min(values)
+            elif atom.operation == OperationType.SUM:
+                value = sum(values)
+            else:
+                value = sum(values) / len(values)
+        total += coefficient * value
+    return total
+
+
+_MAPPINGS = AdvancedFormulaCalculator().subject_mappings
+
+
+@lru_cache(maxsize=4096)
+def parse_legacy(expression: str) -> LegacyExpression:
+    """Parse a legacy formula string, cached by string"""
+    return LegacyExpression(expression, _Parser(expression).parse())
+
+
+# MARK: - Formula Documents
+
+class _StageBuilder:
+    """Lowers a Linear into components and operations of one stage
+
+    The stage score sums every slot, so subjects and sub-results that only
+    feed a function are cleared (an empty SUM written over their slot) once
+    all operations that read them have run.
+    """
+
+    def __init__(self):
+        self.components: List[Dict[str, Any]] = []
+        self.operations: List[Dict[str, Any]] = []
+        self.internal: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def new_id(self, base: str) -> str:
+        count = self.ids.get(base, 0)
+        self.ids[base] = count + 1
+        return base if count == 0 else f"{base}_{count + 1}"
+
+    def build(self, linear: Linear) -> None:
+        for coefficient, atom in linear.terms:
+            if coefficient:
+                self.emit(coefficient, atom, internal=False)
+        for slot in self.internal:
+            self.operations.append({
+                "id": f"clear_{slot}", "type": OperationType.SUM.value,
+                "component_ids": [], "result_id": slot
+            })
+
+    def emit(self, coefficient: float, atom: Atom, internal: bool) -> str:
+        """Add the slot holding coefficient * atom and return its id"""
+        if isinstance(atom, Subject):
+            level = atom.level or "R"
+            slot = self.new_id(f"{atom.code.lower().replace('.', '')}_{level.lower()}")
+            component = {
+                "id": slot, "type": "matura_exam", "weight": coefficient,
+                "required": True, "subject": atom.code
+            }
+            if atom.level:
+                component["level"] = atom.level
+            self.components.append(component)
+        else:
+            # Positive factors distribute over max/min/sum/average
+            scale = coefficient if coefficient > 0 else 1.0
+            inputs = [self.emit_argument(argument, scale) for argument in atom.arguments]
+            slot = self.new_id(atom.operation.value)
+            self.operations.append({
+                "id": slot, "type": atom.operation.value,
+                "component_ids": inputs, "result_id": slot
+            })
+            if scale != coefficient:
+                self.internal.append(slot)
+                slot = self.new_id("scaled")
+                self.operations.append({
+                    "id": slot, "type": OperationType.MULTIPLY.value,
+                    "component_ids": [self.operations[-1]["result_id"]],
+                    "value": coefficient, "result_id": slot
+                })
+        if internal:
+            self.internal.append(slot)
+        return slot
+
+    def emit_argument(self, argument: Linear, scale: float) -> str:
+        terms = [(c, atom) for c, atom in argument.terms if c]
+        if len(terms) == 1:
+            return self.emit(scale * terms[0][0], terms[0][1], internal=True)
+        inputs = [self.emit(scale * c, atom, internal=True) for c, atom in terms]
+        slot = self.new_id("sum")
+        self.operations.append({
+            "id": slot, "type": OperationType.SUM.value,
+            "component_ids": inputs, "result_id": slot
+        })
+        self.internal.append(slot)
+        return slot
+
+
+def _number(value: float) -> float:
+    """Integral floats as ints, so documents read like hand-written ones"""
+    return int(value) if float(value).is_integer() else value
+
+
+def legacy_document(
+    expression: str,
+    program_id: str,
+    university_id: str = "",
+    description: Optional[str] = None,
+    max_possible_score: Optional[float] = None,
+    **metadata: Any
+) -> Dict[str, Any]:
+    """Formula JSON document for a legacy expression
+
+    max_possible_score defaults to the expression's upper bound with every
+    result at 100. Extra keyword arguments are added to the metadata.
+    """
+    parsed = parse_legacy(expression)
+    builder = _StageBuilder()
+    builder.build(parsed.linear)
+
+    stage_high = _linear_bounds(replace(parsed.linear, constant=0.0))[1]
+    stage: Dict[str, Any] = {
+        "id": "main",
+        "name": "Legacy formula",
+        "components": builder.components,
+        "max_points": _number(stage_high)
+    }
+    if builder.operations:
+        stage["operations"] = builder.operations
+
+    if max_possible_score is None:
+        max_possible_score = parsed.bounds()[1]
+    document: Dict[str, Any] = {
+        "version": "2.0",
+        "university_id": university_id,
+        "program_id": program_id,
+        "type": "simple",
+        "stages": [stage],
+        "metadata": {
+            "description": description or expression,
+            "max_possible_score": _number(max_possible_score),
+            "scoring_unit": "points",
+            "notes": f"Migrated from legacy formula: {expression}",
+            **metadata
+        }
+    }
+    if parsed.linear.constant:
+        document["bonuses"] = [{
+            "id": "legacy_constant", "type": "other", "condition": "always",
+            "points": _number(parsed.linear.constant)
+        }]
+    return document
+
+
+class LegacyFormulaCompiler:
+    """Compiles legacy strings to Formula objects and cached evaluation plans"""
+
+    def __init__(self, calculator: Optional[AdvancedFormulaCalculator] = None, max_plans: int = 4096):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        self.max_plans = max_plans
+        self._plans: Dict[str, CompiledFormula] = {}
+
+    def formula(self, expression: str, program_id: str, **kwargs: Any) -> Formula:
+        return self.calculator._parse_formula(legacy_document(expression, program_id, **kwargs))
+
+    def plan(self, expression: str) -> CompiledFormula:
+        """Compiled plan for an expression, cached by string"""
+        plan = self._plans.get(expression)
+        if plan is None:
+            if len(self._plans) >= self.max_plans:
+                self._plans.pop(next(iter(self._plans)))
+            plan = self.calculator.compile(self.formula(expression, "legacy"))
+            self._plans[expression] = plan
+        return plan
+
+    def score(self, expression: str, scores: ExtendedScores) -> float:
+        return self.plan(expression).evaluate(scores, breakdown=False).total_score
+
+    def validate(
+        self, expression: str, candidates: Iterable[ExtendedScores], tolerance: float = 1e-9
+    ) -> List[Tuple[ExtendedScores, float, float]]:
+        """Candidates where the compiled plan and the interpreter disagree"""
+        parsed = parse_legacy(expression)
+        plan = self.plan(expression)
+        mismatches = []
+        for scores in candidates:
+            expected = min(
+                parsed.evaluate(scores, self.calculator.subject_mappings),
+                plan.formula.metadata.max_possible_score
+            )
+            actual = plan.evaluate(scores, breakdown=False).total_score
+            if abs(actual - expected) > tolerance * max(1.0, abs(expected)):
+                mismatches.append((scores, expected, actual))
+        return mismatches
+
+
+# MARK: - Batch Migration
+
+@dataclass
+class MigrationError:
+    record: int
+    program_id: Optional[str]
+    message: str
+
+
+def migrate(
+    records: Iterable[Dict[str, Any]],
+    compiler: Optional[LegacyFormulaCompiler] = None,
+    validate: int = 0,
+    seed: int = 0
+) -> Iterator[Union[Dict[str, Any], MigrationError]]:
+    """Convert legacy records into formula documents
+
+    Each record has "formula" and "program_id", and optionally
+    "university_id", "description" and "max_possible_score". With validate,
+    each converted formula is checked against the interpreter on that many
+    random candidates.
+    """
+    compiler = compiler or LegacyFormulaCompiler()
+    rng = random.Random(seed)
+    for index, record in enumerate(records, 1):
+        program_id = record.get("program_id")
+        try:
+            document = legacy_document(
+                record["formula"], program_id,
+                university_id=record.get("university_id", ""),
+                description=record.get("description"),
+                max_possible_score=record.get("max_possible_score")
+            )
+            if validate:
+                candidates = [_random_scores(rng) for _ in range(validate)]
+                mismatches = compiler.validate(record["formula"], candidates)
+                if mismatches:
+                    _, expected, actual = mismatches[0]
+                    yield MigrationError(index, program_id, f"validation failed: {expected} != {actual}")
+                    continue
+            yield document
+        except (LegacyFormulaError, KeyError) as e:
+            message = f"missing field {e}" if isinstance(e, KeyError) else str(e)
+            yield MigrationError(index, program_id, message)
+
+
+def _random_scores(rng: random.Random) -> ExtendedScores:
+    matura = MaturaScores(**{
+        name: rng.choice([None, rng.randint(0, MATURA_MAX)])
+        for name in MaturaScores.__dataclass_fields__
+    })
+    return ExtendedScores(matura_scores=matura)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Convert legacy string formulas (JSONL) into a formula catalog (JSONL)"
+    )
+    parser.add_argument("legacy", help='JSONL with {"program_id", "formula", ...} per line')
+    parser.add_argument("-o", "--output", help="Output catalog (default: stdout)")
+    parser.add_argument(
+        "--validate", type=int, default=0, metavar="N",
+        help="Check each formula against the interpreter on N random candidates"
+    )
+    args = parser.parse_args(argv)
+
+    failures = 0
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        with open(args.legacy, encoding="utf-8") as f:
+            records = (json.loads(line) for line in f if line.strip())
+            for item in migrate(records, validate=args.validate):
+                if isinstance(item, MigrationError):
+                    failures += 1
+                    print(f"record {item.record} ({item.program_id}): {item.message}", file=sys.stderr)
+                else:
+                    output.write(json.dumps(item, ensure_ascii=False) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
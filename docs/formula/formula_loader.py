@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Lazy loader for large JSONL formula catalogs
+Indexes program_id/university_id to byte offsets and materializes formulas on demand
+"""
+
+import json
+import mmap
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from formula_parser import AdvancedFormulaCalculator, Formula
+
+
+# Top-level keys are read without decoding the whole record. Quotes inside JSON
+# string values are always escaped, so these cannot match inside a value.
+PROGRAM_ID_PATTERN = re.compile(rb'"program_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+UNIVERSITY_ID_PATTERN = re.compile(rb'"university_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+@dataclass
+class CacheInfo:
+    """Formula cache counters"""
+    hits: int
+    misses: int
+    size: int
+    max_size: int
+
+
+def _decode_key(raw: bytes) -> str:
+    return json.loads(b'"' + raw + b'"')
+
+
+class FormulaCatalog:
+    """Read-only view of a JSONL formula catalog (one formula per line)
+
+    The file is scanned only as far as needed to find a requested program, so
+    startup is instant and the index grows with the programs actually used.
+    Materialized formulas are kept in a bounded LRU cache. When a program id
+    appears more than once, the first record wins.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        cache_size: int = 256,
+        calculator: Optional[AdvancedFormulaCalculator] = None
+    ):
+        self.path = path
+        self.cache_size = cache_size
+        self.calculator = calculator or AdvancedFormulaCalculator()
+
+        self._file = open(path, "rb")
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files cannot be mapped
+            self._data = b""
+        self._scan_position = 0
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        self._universities: Dict[str, List[str]] = {}
+        self._cache: "OrderedDict[str, Formula]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def __enter__(self) -> "FormulaCatalog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    # MARK: - Index
+
+    @property
+    def fully_indexed(self) -> bool:
+        return self._scan_position >= len(self._data)
+
+    def _scan(self, until: Optional[str] = None) -> None:
+        """Index records from the scan position, stopping after `until` is found"""
+        data = self._data
+        end = len(data)
+        position = self._scan_position
+
+        while position < end:
+            newline = data.find(b"\n", position)
+            if newline == -1:
+                newline = end
+            start, length = position, newline - position
+            position = newline + 1
+
+            match = PROGRAM_ID_PATTERN.search(data, start, newline)
+            if match is None:
+                continue  # Blank line or not a formula
+
+            program_id = _decode_key(match.group(1))
+            if program_id in self._offsets:
+                continue
+            self._offsets[program_id] = (start, length)
+
+            university = UNIVERSITY_ID_PATTERN.search(data, start, newline)
+            if university is not None:
+                self._universities.setdefault(
+                    _decode_key(university.group(1)), []
+                ).append(program_id)
+
+            if program_id == until:
+                break
+
+        self._scan_position = min(position, end)
+
+    def offset(self, program_id: str) -> Optional[Tuple[int, int]]:
+        """Byte offset and length of a program's record, scanning as needed"""
+        if program_id not in self._offsets and not self.fully_indexed:
+            self._scan(until=program_id)
+        return self._offsets.get(program_id)
+
+    def program_ids(self) -> List[str]:
+        """All program ids in file order; requires a full scan"""
+        self._scan()
+        return list(self._offsets)
+
+    def program_ids_for_university(self, university_id: str) -> List[str]:
+        """Program ids offered by a university; requires a full scan"""
+        self._scan()
+        return list(self._universities.get(university_id, []))
+
+    # MARK: - Formulas
+
+    def get(self, program_id: str) -> Formula:
+        """Formula for a program, parsed on first use and cached"""
+        formula = self._cache.get(program_id)
+        if formula is not None:
+            self._hits += 1
+            self._cache.move_to_end(program_id)
+            return formula
+
+        location = self.offset(program_id)
+        if location is None:
+            raise KeyError(program_id)
+
+        self._misses += 1
+        start, length = location
+        formula = self.calculator._parse_formula(json.loads(self._data[start:start + length]))
+
+        self._cache[program_id] = formula
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return formula
+
+    def __getitem__(self, program_id: str) -> Formula:
+        return self.get(program_id)
+
+    def __contains__(self, program_id: object) -> bool:
+        return isinstance(program_id, str) and self.offset(program_id) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.program_ids())
+
+    def __len__(self) -> int:
+        return len(self.program_ids())
+
+    def formulas_for_university(self, university_id: str) -> List[Formula]:
+        return [self.get(pid) for pid in self.program_ids_for_university(university_id)]
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(
+            hits=self._hits,
+            misses=self._misses,
+            size=len(self._cache),
+            max_size=self.cache_size
+        )
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo admission-probability estimator
+Samples uncertainty in predicted Matura results and in next year's threshold,
+and scores the samples in fixed-size vectorized blocks
+"""
+
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from formula_batch import Cohort
+from formula_catalog import CatalogEngine
+from formula_parser import AdvancedFormulaCalculator, ExtendedScores, Formula
+
+
+# Largest samples x programs block scored at once, bounding memory use
+DEFAULT_CELL_BUDGET = 4_000_000
+
+
+@dataclass
+class AdmissionEstimate:
+    """Estimated admission probability with a Wilson confidence interval
+
+    probability is None for programs without a threshold to compare against.
+    """
+    program_id: str
+    probability: Optional[float]
+    low: Optional[float]
+    high: Optional[float]
+    samples: int
+    threshold_mean: Optional[float]
+    threshold_sd: Optional[float]
+
+
+def wilson_interval(
+    successes: int, trials: int, confidence: float
+) -> Tuple[float, float]:
+    """Wilson score interval for a binomial proportion"""
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denominator
+    margin = z * np.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+class AdmissionEstimator:
+    """Estimates one student's admission probability for every program
+
+    Each sample perturbs the student's Matura results with Gaussian noise
+    (rounded to whole percentages and clipped to 0-100; missing results stay
+    missing) and draws a threshold around last_year_threshold. The threshold
+    spread is threshold_sd when given, else the gap between the last-year and
+    average thresholds, else threshold_sd_fraction of the threshold.
+    """
+
+    def __init__(
+        self,
+        formulas: List[Formula],
+        calculator: Optional[AdvancedFormulaCalculator] = None,
+        score_sd: Union[float, Dict[str, float]] = 5.0,
+        threshold_sd: Optional[float] = None,
+        threshold_sd_fraction: float = 0.03,
+        cell_budget: int = DEFAULT_CELL_BUDGET
+    ):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        self.formulas = formulas
+        self.engine = CatalogEngine(formulas, self.calculator)
+        self.score_sd = score_sd
+        self.block_size = max(1, cell_budget // max(1, len(formulas)))
+
+        means = []
+        spreads = []
+        for formula in formulas:
+            metadata = formula.metadata
+            mean = metadata.last_year_threshold
+            if mean is None:
+                mean = metadata.average_threshold
+            if mean is None:
+                means.append(np.nan)
+                spreads.append(np.nan)
+                continue
+            if threshold_sd is not None:
+                spread = threshold_sd
+            elif (
+                metadata.last_year_threshold is not None
+                and metadata.average_threshold is not None
+                and metadata.last_year_threshold != metadata.average_threshold
+            ):
+                spread = abs(metadata.last_year_threshold - metadata.average_threshold)
+            else:
+                spread = threshold_sd_fraction * mean
+            means.append(mean)
+            spreads.append(spread)
+        self.threshold_means = np.array(means, dtype=np.float64)
+        self.threshold_sds = np.array(spreads, dtype=np.float64)
+
+    def _subject_sd(self, name: str) -> float:
+        if isinstance(self.score_sd, dict):
+            return self.score_sd.get(name, 0.0)
+        return self.score_sd
+
+    def _sample_block(
+        self, base: Cohort, size: int, rng: np.random.Generator
+    ) -> Cohort:
+        """size perturbed copies of a one-row cohort"""
+        block = base.take(np.zeros(size, dtype=np.int64))
+        for name, values in block.matura.items():
+            sd = self._subject_sd(name)
+            if sd <= 0 or np.isnan(values[0]):
+                continue
+            noisy = np.rint(values + rng.normal(0.0, sd, size))
+            block.matura[name] = np.clip(noisy, 0.0, 100.0)
+        return block
+
+    def estimate(
+        self,
+        scores: ExtendedScores,
+        samples: int = 100_000,
+        seed: Optional[int] = None,
+        confidence: float = 0.95
+    ) -> List[AdmissionEstimate]:
+        """Admission probability for every program; seeded runs are reproducible"""
+        if samples <= 0:
+            raise ValueError(f"samples must be positive, got {samples}")
+        rng = np.random.default_rng(seed)
+        base = Cohort.from_scores([scores], self.calculator)
+        has_threshold = ~np.isnan(self.threshold_means)
+        successes = np.zeros(len(self.formulas), dtype=np.int64)
+
+        drawn = 0
+        while drawn < samples:
+            size = min(self.block_size, samples - drawn)
+            block = self._sample_block(base, size, rng)
+            scored = self.engine.score(block)
+            thresholds = rng.normal(
+                np.where(has_threshold, self.threshold_means, 0.0),
+                np.where(has_threshold, self.threshold_sds, 0.0),
+                size=(size, len(self.formulas))
+            )
+            admitted = scored.meets_requirements & (scored.scores >= thresholds)
+            successes += admitted.sum(axis=0)
+            drawn += size
+
+        estimates = []
+        for index, formula in enumerate(self.formulas):
+            if not has_threshold[index]:
+                estimates.append(AdmissionEstimate(
+                    formula.program_id, None, None, None, samples, None, None
+                ))
+                continue
+            low, high = wilson_interval(int(successes[index]), samples, confidence)
+            estimates.append(AdmissionEstimate(
+                program_id=formula.program_id,
+                probability=float(successes[index] / samples),
+                low=low,
+                high=high,
+                samples=samples,
+                threshold_mean=float(self.threshold_means[index]),
+                threshold_sd=float(self.threshold_sds[index])
+            ))
+        return estimates
+
+
+def estimate_admission(
+    formulas: List[Formula],
+    scores: ExtendedScores,
+    samples: int = 100_000,
+    seed: Optional[int] = None,
+    **options
+) -> List[AdmissionEstimate]:
+    """Admission probability estimates for one student across programs"""
+    return AdmissionEstimator(formulas, **options).estimate(scores, samples, seed)
@@ -4,9 +4,18 @@ Advanced Formula Parser for Complex Polish University Admissions
 Compatible with Formula Swift model
 """
 
+import argparse
 import json
-from typing import Dict, List, Optional, Any, Tuple
-from dataclasses import dataclass
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
+from operator import attrgetter
+from typing import Callable, Deque, Dict, FrozenSet, Iterable, Iterator, List, Optional, Any, Sequence, TextIO, Tuple, Union
+from dataclasses import asdict, dataclass, fields, replace
 from enum import Enum
 from datetime import datetime
 
@@ -74,6 +83,18 @@ class OlympiadLevel(Enum):
     REGIONAL_FINALIST = "regional_finalist"
 
 
+# Bonus points per olympiad result, by level
+OLYMPIAD_POINTS: Dict[OlympiadLevel, float] = {
+    OlympiadLevel.CENTRAL_WINNER: 200,
+    OlympiadLevel.CENTRAL_FINALIST: 100,
+    OlympiadLevel.REGIONAL_WINNER: 50,
+    OlympiadLevel.REGIONAL_FINALIST: 25
+}
+
+# Distinct bonus rule lists an AdvancedFormulaCalculator keeps compiled
+BONUS_CACHE_SIZE = 1024
+
+
 class ExamSystem(Enum):
     POLISH = "polish"
     IB = "ib"
@@ -83,7 +104,7 @@ class ExamSystem(Enum):
 
 # MARK: - Data Classes
 
-@dataclass
+@dataclass(slots=True)
 class LevelCoefficients:
     basic: Optional[float] = None
     extended: Optional[float] = None
@@ -91,7 +112,7 @@ class LevelCoefficients:
     international: Optional[float] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class FormulaComponent:
     id: str
     type: ComponentType
@@ -105,14 +126,14 @@ class FormulaComponent:
     max_score: Optional[float] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ExamTask:
     name: str
     points: float
     duration: Optional[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class PracticalExam:
     id: str
     name: str
@@ -124,7 +145,7 @@ class PracticalExam:
     description: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Operation:
     id: str
     type: OperationType
@@ -133,14 +154,14 @@ class Operation:
     result_id: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Threshold:
     type: ThresholdType
     value: float
     description: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class BonusRule:
     id: str
     type: BonusType
@@ -150,7 +171,7 @@ class BonusRule:
     max_bonus: Optional[float] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class FormulaRequirements:
     mandatory_subjects: Optional[List[str]] = None
     minimum_scores: Optional[Dict[str, float]] = None
@@ -160,7 +181,7 @@ class FormulaRequirements:
     previous_degree_required: bool = False
 
 
-@dataclass
+@dataclass(slots=True)
 class FormulaMetadata:
     description: str
     max_possible_score: float
@@ -172,7 +193,7 @@ class FormulaMetadata:
     last_updated: Optional[datetime] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class FormulaStage:
     id: str
     name: str
@@ -184,7 +205,7 @@ class FormulaStage:
     coefficient: Optional[float] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Formula:
     version: str
     university_id: str
@@ -198,7 +219,7 @@ class Formula:
 
 # MARK: - Extended Scores
 
-@dataclass
+@dataclass(slots=True)
 class MaturaScores:
     """Polish Matura exam scores"""
     mathematics: Optional[int] = None
@@ -216,21 +237,21 @@ class MaturaScores:
     social_studies: Optional[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class OlympiadResult:
     name: str
     level: OlympiadLevel
     subject: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Certificate:
     type: str
     level: Optional[str] = None
     score: Optional[float] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ExtendedScores:
     matura_scores: MaturaScores
     practical_exams: Optional[Dict[str, float]] = None
@@ -243,7 +264,7 @@ class ExtendedScores:
     exam_system: ExamSystem = ExamSystem.POLISH
 
 
-@dataclass
+@dataclass(slots=True)
 class StageResult:
     stage_id: str
     stage_name: str
@@ -253,7 +274,7 @@ class StageResult:
     component_scores: Dict[str, float]
 
 
-@dataclass
+@dataclass(slots=True)
 class CalculationResult:
     total_score: float
     stage_results: List[StageResult]
@@ -263,12 +284,26 @@ class CalculationResult:
     breakdown: Optional[Dict[str, float]] = None
 
 
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO 8601 date or timestamp, accepting a trailing Z"""
+    if value is None:
+        return None
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def bonus_key(bonuses: List[BonusRule]) -> Tuple:
+    """Hashable key of everything in a bonus rule list that affects points"""
+    return tuple((b.type, b.condition, b.points, b.multiplier, b.max_bonus) for b in bonuses)
+
+
 # MARK: - Advanced Calculator
 
 class AdvancedFormulaCalculator:
     """Calculator for complex Polish university admission formulas"""
     
-    def __init__(self):
+    def __init__(self, bonus_cache_size: int = BONUS_CACHE_SIZE):
         self.subject_mappings = {
             "MAT": "mathematics",
             "POL": "polish",
@@ -285,6 +320,13 @@ class AdvancedFormulaCalculator:
             "HIST": "history",
             "WOS": "social_studies",
         }
+        # formula_conversion.GradeConverter, created on first use
+        self.grade_converter = None
+        # formula_bonus.BonusTable per distinct list of bonus rules, kept in a
+        # bounded LRU cache; the lock guards it for calculators shared by threads
+        self.bonus_cache_size = bonus_cache_size
+        self.bonus_tables: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self.bonus_lock = threading.Lock()
     
     def calculate(self, formula: Formula, scores: ExtendedScores) -> CalculationResult:
         """Calculate admission points using advanced formula"""
@@ -351,6 +393,13 @@ class AdvancedFormulaCalculator:
             score = self._calculate_component(component, scores, stage)
             component_scores[component.id] = score
         
+        # Assign subjects to components with alternatives
+        # A repeated id keeps its last component, as component_scores does
+        last = {c.id: c for c in stage.components}
+        choosers = [c for c in last.values() if has_alternatives(c)]
+        if choosers:
+            component_scores.update(self._assign_alternatives(choosers, scores, stage))
+        
         # Apply operations
         if stage.operations:
             for operation in stage.operations:
@@ -375,6 +424,32 @@ class AdvancedFormulaCalculator:
             component_scores=component_scores
         )
     
+    def _assign_alternatives(
+        self, choosers: List[FormulaComponent], scores: ExtendedScores, stage: FormulaStage
+    ) -> Dict[str, float]:
+        """Best component scores when each subject fills at most one component
+        and subjects of the stage's fixed components are already taken"""
+        taken = fixed_subjects(stage.components, self.subject_mappings)
+        options = []
+        empty = []
+        for component in choosers:
+            options.append([
+                (subject_key(field), self._calculate_component(
+                    replace(component, subject=subject, alternatives=None), scores, stage
+                ))
+                for subject, field in alternative_subjects(component, self.subject_mappings, taken)
+            ])
+            empty.append(self._calculate_component(
+                replace(component, subject="", alternatives=None), scores, stage
+            ))
+        
+        assigned = {}
+        for group in group_alternatives([[key for key, _ in slot] for slot in options]):
+            values = best_assignment([options[i] for i in group], [empty[i] for i in group])
+            for i, value in zip(group, values):
+                assigned[choosers[i].id] = value
+        return assigned
+    
     def _calculate_component(
         self, component: FormulaComponent, scores: ExtendedScores, stage: FormulaStage
     ) -> float:
@@ -486,37 +561,30 @@ class AdvancedFormulaCalculator:
         self, bonuses: List[BonusRule], scores: ExtendedScores
     ) -> float:
         """Calculate total bonus points"""
-        total_bonus = 0
-        
-        for bonus in bonuses:
-            bonus_points = 0
-            
-            if bonus.type == BonusType.OLYMPIAD and scores.olympiad_results:
-                for olympiad in scores.olympiad_results:
-                    bonus_points += self._get_olympiad_bonus(olympiad)
-            elif bonus.type == BonusType.CERTIFICATE and scores.certificates:
-                for cert in scores.certificates:
-                    bonus_points += bonus.points
-            else:
-                bonus_points = bonus.points
-            
-            # Apply cap
-            if bonus.max_bonus:
-                bonus_points = min(bonus_points, bonus.max_bonus)
-            
-            total_bonus += bonus_points
+        return self.bonus_table(bonuses).points(scores)
+    
+    def bonus_table(self, bonuses: List[BonusRule]) -> Any:
+        """Compiled bonus rules and conditions, cached per distinct rule list"""
+        key = bonus_key(bonuses)
+        with self.bonus_lock:
+            table = self.bonus_tables.get(key)
+            if table is not None:
+                self.bonus_tables.move_to_end(key)
+                return table
         
-        return total_bonus
+        from formula_bonus import BonusTable  # Imports this module
+        table = BonusTable(bonuses, self.subject_mappings)
+        with self.bonus_lock:
+            # Another thread may have built the same table meanwhile
+            table = self.bonus_tables.setdefault(key, table)
+            self.bonus_tables.move_to_end(key)
+            if len(self.bonus_tables) > self.bonus_cache_size:
+                self.bonus_tables.popitem(last=False)
+        return table
     
     def _get_olympiad_bonus(self, olympiad: OlympiadResult) -> float:
         """Get bonus points for olympiad result"""
-        bonuses = {
-            OlympiadLevel.CENTRAL_WINNER: 200,
-            OlympiadLevel.CENTRAL_FINALIST: 100,
-            OlympiadLevel.REGIONAL_WINNER: 50,
-            OlympiadLevel.REGIONAL_FINALIST: 25
-        }
-        return bonuses.get(olympiad.level, 0)
+        return OLYMPIAD_POINTS.get(olympiad.level, 0)
     
     def _check_requirements(
         self, formula: Formula, scores: ExtendedScores
@@ -549,6 +617,10 @@ class AdvancedFormulaCalculator:
         
         return True, None
     
+    def compile(self, formula: Formula) -> "CompiledFormula":
+        """Compile formula into a reusable evaluation plan"""
+        return CompiledFormula(formula, self)
+    
     def _check_threshold(
         self, score: float, threshold: Threshold, max_score: float
     ) -> bool:
@@ -557,13 +629,16 @@ class AdvancedFormulaCalculator:
             return score >= threshold.value
         elif threshold.type == ThresholdType.PERCENTAGE:
             return score >= (max_score * threshold.value / 100)
-        # For ranking/multiplier, assume passed
+        # Ranking/multiplier need the whole cohort (see formula_ranking.py);
+        # a single candidate is assumed to pass
         return True
     
     def parse_formula_json(self, json_str: str) -> Formula:
         """Parse FormulaV2 from JSON"""
-        data = json.loads(json_str)
-        
+        return self._parse_formula(json.loads(json_str))
+    
+    def _parse_formula(self, data: Dict[str, Any]) -> Formula:
+        """Build a Formula from a decoded JSON object"""
         # Parse stages
         stages = []
         for stage_data in data['stages']:
@@ -617,16 +692,73 @@ class AdvancedFormulaCalculator:
                     description=t.get('description')
                 )
             
+            # Parse practical exams
+            practical_exams = None
+            if 'practical_exams' in stage_data:
+                practical_exams = []
+                for exam_data in stage_data['practical_exams']:
+                    tasks = None
+                    if 'tasks' in exam_data:
+                        tasks = [
+                            ExamTask(
+                                name=task['name'],
+                                points=task['points'],
+                                duration=task.get('duration')
+                            )
+                            for task in exam_data['tasks']
+                        ]
+                    practical_exams.append(PracticalExam(
+                        id=exam_data['id'],
+                        name=exam_data['name'],
+                        type=ExamType(exam_data['type']),
+                        weight=exam_data['weight'],
+                        max_points=exam_data['max_points'],
+                        tasks=tasks,
+                        min_score=exam_data.get('min_score'),
+                        description=exam_data.get('description')
+                    ))
+            
             stages.append(FormulaStage(
                 id=stage_data['id'],
                 name=stage_data['name'],
                 components=components,
                 max_points=stage_data['max_points'],
                 operations=operations,
+                practical_exams=practical_exams,
                 threshold=threshold,
                 coefficient=stage_data.get('coefficient')
             ))
         
+        # Parse bonuses
+        bonuses = None
+        if 'bonuses' in data:
+            bonuses = [
+                BonusRule(
+                    id=bonus_data['id'],
+                    type=BonusType(bonus_data['type']),
+                    condition=bonus_data['condition'],
+                    points=bonus_data['points'],
+                    multiplier=bonus_data.get('multiplier'),
+                    max_bonus=bonus_data.get('max_bonus')
+                )
+                for bonus_data in data['bonuses']
+            ]
+            # Compile now so a malformed expression fails when the catalog loads
+            self.bonus_table(bonuses)
+        
+        # Parse requirements
+        requirements = None
+        if 'requirements' in data:
+            r = data['requirements']
+            requirements = FormulaRequirements(
+                mandatory_subjects=r.get('mandatory_subjects'),
+                minimum_scores=r.get('minimum_scores'),
+                practical_test_required=r.get('practical_test_required', False),
+                interview_required=r.get('interview_required', False),
+                portfolio_required=r.get('portfolio_required', False),
+                previous_degree_required=r.get('previous_degree_required', False)
+            )
+        
         # Parse metadata
         meta_data = data['metadata']
         metadata = FormulaMetadata(
@@ -636,7 +768,8 @@ class AdvancedFormulaCalculator:
             last_year_threshold=meta_data.get('last_year_threshold'),
             average_threshold=meta_data.get('average_threshold'),
             official_calculator_url=meta_data.get('official_calculator_url'),
-            notes=meta_data.get('notes')
+            notes=meta_data.get('notes'),
+            last_updated=_parse_datetime(meta_data.get('last_updated'))
         )
         
         return Formula(
@@ -645,28 +778,941 @@ class AdvancedFormulaCalculator:
             program_id=data['program_id'],
             type=FormulaType(data['type']),
             stages=stages,
-            metadata=metadata
+            metadata=metadata,
+            bonuses=bonuses,
+            requirements=requirements
+        )
+    
+    def parse_scores_json(self, json_str: str) -> ExtendedScores:
+        """Parse ExtendedScores from JSON"""
+        return self._parse_scores(json.loads(json_str))
+    
+    def _parse_scores(self, data: Dict[str, Any]) -> ExtendedScores:
+        """Build ExtendedScores from a decoded JSON object"""
+        olympiad_results = None
+        if data.get('olympiad_results') is not None:
+            olympiad_results = [
+                OlympiadResult(
+                    name=o['name'],
+                    level=OlympiadLevel(o['level']),
+                    subject=o['subject']
+                )
+                for o in data['olympiad_results']
+            ]
+        
+        certificates = None
+        if data.get('certificates') is not None:
+            certificates = [
+                Certificate(
+                    type=c['type'],
+                    level=c.get('level'),
+                    score=c.get('score')
+                )
+                for c in data['certificates']
+            ]
+        
+        # IB/EB/foreign grades are converted once, here, into Matura results
+        exam_system = ExamSystem(data.get('exam_system', ExamSystem.POLISH.value))
+        if data.get('foreign_grades') is not None:
+            matura_scores = self._convert_foreign_grades(exam_system, data['foreign_grades'])
+        else:
+            matura_scores = MaturaScores(**data.get('matura_scores', {}))
+        
+        return ExtendedScores(
+            matura_scores=matura_scores,
+            practical_exams=data.get('practical_exams'),
+            interview_score=data.get('interview_score'),
+            portfolio_score=data.get('portfolio_score'),
+            previous_degree_gpa=data.get('previous_degree_gpa'),
+            olympiad_results=olympiad_results,
+            certificates=certificates,
+            is_bilingual=data.get('is_bilingual', False),
+            exam_system=exam_system
         )
+    
+    def _convert_foreign_grades(
+        self, exam_system: ExamSystem, grades: List[Dict[str, Any]]
+    ) -> MaturaScores:
+        """Matura results for [{"subject", "level", "grade"}, ...]"""
+        from formula_conversion import GradeConverter, parse_foreign_grades  # Imports this module
+        if self.grade_converter is None:
+            self.grade_converter = GradeConverter(calculator=self)
+        return self.grade_converter.matura_scores(exam_system, parse_foreign_grades(grades))
 
 
-# Example usage
-if __name__ == "__main__":
-    # Example: Warsaw Tech Architecture
-    calculator = AdvancedFormulaCalculator()
-    
-    # Student scores
-    scores = ExtendedScores(
-        matura_scores=MaturaScores(
-            mathematics=85,
-            foreign_language=75,
-            physics=80,
-            history=70
-        ),
-        practical_exams={
-            "psp": 140  # 70% of 200 points
-        },
-        is_bilingual=False
+# MARK: - Compact Scores
+
+# Interned subject/level slots: every MaturaScores field (basic-level results
+# have their own fields) gets a fixed integer index.
+MATURA_SUBJECTS: Tuple[str, ...] = tuple(f.name for f in fields(MaturaScores))
+MATURA_FIELDS = frozenset(MATURA_SUBJECTS)
+SUBJECT_SLOTS: Dict[str, int] = {name: i for i, name in enumerate(MATURA_SUBJECTS)}
+
+# Scoring input keys for dependency tracking: ("matura", slot),
+# ("practical", exam_id), "practical_exams" for the presence of any practical
+# exam, or a scalar ExtendedScores field name.
+InputKey = Union[str, Tuple[str, Any]]
+
+# Byte value marking a missing result in compact Matura scores
+MISSING_SCORE = 255
+
+# MaturaScores as a tuple indexed by subject slot, None for missing results
+matura_vector: Callable[[MaturaScores], Tuple[Optional[int], ...]] = attrgetter(*MATURA_SUBJECTS)
+
+
+def pack_matura(matura: MaturaScores) -> bytes:
+    """Pack Matura results into one byte per subject slot"""
+    packed = bytearray(len(MATURA_SUBJECTS))
+    for slot, score in enumerate(matura_vector(matura)):
+        if score is None:
+            packed[slot] = MISSING_SCORE
+        elif 0 <= score < MISSING_SCORE and score == int(score):
+            packed[slot] = int(score)
+        else:
+            raise ValueError(f"Cannot pack {MATURA_SUBJECTS[slot]} score {score}")
+    return bytes(packed)
+
+
+def unpack_matura(packed: bytes) -> MaturaScores:
+    """Inverse of pack_matura"""
+    return MaturaScores(*(None if v == MISSING_SCORE else v for v in packed))
+
+
+@dataclass(slots=True)
+class CompactScores:
+    """Memory-compact ExtendedScores
+    
+    Matura results are packed one byte per subject slot with MISSING_SCORE for
+    absent results; the remaining fields match ExtendedScores.
+    """
+    matura: bytes
+    practical_exams: Optional[Dict[str, float]] = None
+    interview_score: Optional[float] = None
+    portfolio_score: Optional[float] = None
+    previous_degree_gpa: Optional[float] = None
+    olympiad_results: Optional[List[OlympiadResult]] = None
+    certificates: Optional[List[Certificate]] = None
+    is_bilingual: bool = False
+    exam_system: ExamSystem = ExamSystem.POLISH
+    
+    @classmethod
+    def from_extended(cls, scores: ExtendedScores) -> "CompactScores":
+        return cls(
+            matura=pack_matura(scores.matura_scores),
+            practical_exams=scores.practical_exams,
+            interview_score=scores.interview_score,
+            portfolio_score=scores.portfolio_score,
+            previous_degree_gpa=scores.previous_degree_gpa,
+            olympiad_results=scores.olympiad_results,
+            certificates=scores.certificates,
+            is_bilingual=scores.is_bilingual,
+            exam_system=scores.exam_system
+        )
+    
+    def to_extended(self) -> ExtendedScores:
+        return ExtendedScores(
+            matura_scores=unpack_matura(self.matura),
+            practical_exams=self.practical_exams,
+            interview_score=self.interview_score,
+            portfolio_score=self.portfolio_score,
+            previous_degree_gpa=self.previous_degree_gpa,
+            olympiad_results=self.olympiad_results,
+            certificates=self.certificates,
+            is_bilingual=self.is_bilingual,
+            exam_system=self.exam_system
+        )
+    
+    @property
+    def matura_scores(self) -> MaturaScores:
+        """Unpacked Matura results, for code written against ExtendedScores"""
+        return unpack_matura(self.matura)
+
+
+# MARK: - Compiled Formulas
+
+
+def resolve_matura_field(
+    subject: str, level: str, subject_mappings: Dict[str, str]
+) -> Optional[str]:
+    """MaturaScores field read for a subject/level pair, None if there is none"""
+    attr_name = subject_mappings.get(subject, subject.lower())
+    if level == "P" and f"{attr_name}_basic" in MATURA_FIELDS:
+        attr_name = f"{attr_name}_basic"
+    return attr_name if attr_name in MATURA_FIELDS else None
+
+
+def resolve_level_coefficients(
+    level_coefficients: Optional[LevelCoefficients], level: str
+) -> Tuple[float, float]:
+    """Coefficients applied to regular and bilingual candidates at a level"""
+    if not level_coefficients:
+        return 1.0, 1.0
+    
+    coefficient = 1.0
+    if level == "R" and level_coefficients.extended:
+        coefficient = level_coefficients.extended
+    elif level == "P" and level_coefficients.basic:
+        coefficient = level_coefficients.basic
+    return coefficient, level_coefficients.bilingual or coefficient
+
+
+# MARK: - Component Alternatives
+
+def has_alternatives(component: FormulaComponent) -> bool:
+    """Whether the component picks its subject from a list of alternatives"""
+    return bool(component.alternatives) and component.type == ComponentType.MATURA_EXAM
+
+
+def alternative_subjects(
+    component: FormulaComponent,
+    subject_mappings: Dict[str, str],
+    taken: FrozenSet[str] = frozenset()
+) -> List[Tuple[str, str]]:
+    """(subject, Matura field) pairs a component may read, its own subject first
+    
+    Subjects without a Matura field (placeholders such as "GROUP1") are skipped,
+    and so are subjects whose key is in taken (see fixed_subjects).
+    """
+    level = component.level or "R"
+    pairs: List[Tuple[str, str]] = []
+    for subject in [component.subject or ""] + list(component.alternatives or []):
+        field = resolve_matura_field(subject, level, subject_mappings)
+        if field is None or subject_key(field) in taken:
+            continue
+        if all(field != f for _, f in pairs):
+            pairs.append((subject, field))
+    return pairs
+
+
+def fixed_subjects(
+    components: Iterable[FormulaComponent], subject_mappings: Dict[str, str]
+) -> FrozenSet[str]:
+    """Subject keys read by a stage's Matura components without alternatives
+    
+    A component with alternatives cannot count these a second time. A
+    repeated id keeps its last component.
+    """
+    taken = set()
+    for component in {c.id: c for c in components}.values():
+        if component.type == ComponentType.MATURA_EXAM and not has_alternatives(component):
+            field = resolve_matura_field(
+                component.subject or "", component.level or "R", subject_mappings
+            )
+            if field is not None:
+                taken.add(subject_key(field))
+    return frozenset(taken)
+
+
+def subject_key(field: str) -> str:
+    """A subject counts once whatever the level it is read at"""
+    return field[:-len("_basic")] if field.endswith("_basic") else field
+
+
+def group_alternatives(keys: List[List[str]]) -> List[List[int]]:
+    """Split slots into groups that share no subject, each solvable alone"""
+    groups: List[Tuple[set, List[int]]] = []
+    for index, slot_keys in enumerate(keys):
+        subjects = set(slot_keys)
+        merged = (subjects, [index])
+        for group in [g for g in groups if not g[0].isdisjoint(subjects)]:
+            groups.remove(group)
+            merged = (merged[0] | group[0], sorted(merged[1] + group[1]))
+        groups.append(merged)
+    return sorted((members for _, members in groups), key=lambda m: m[0])
+
+
+def best_assignment(
+    options: Sequence[Sequence[Tuple[str, float]]], empty: Sequence[float]
+) -> List[float]:
+    """Slot values maximizing their sum with each subject used at most once
+    
+    options[i] lists (subject, value) pairs for slot i and empty[i] is its
+    value when no subject is left for it. Only a slot's best len(options)
+    options can appear in an optimal assignment, and branches that cannot
+    beat the best total so far are pruned.
+    """
+    count = len(options)
+    ranked = [
+        sorted((o for o in slot if o[1] > none), key=lambda o: -o[1])[:count]
+        for slot, none in zip(options, empty)
+    ]
+    best = [r[0][1] if r else none for r, none in zip(ranked, empty)]
+    chosen = [r[0][0] for r in ranked if r]
+    if len(set(chosen)) == len(chosen):
+        return best  # Every slot gets its best subject
+    
+    order = sorted(range(count), key=lambda i: empty[i] - best[i])
+    bound = [0.0] * (count + 1)
+    for depth in range(count - 1, -1, -1):
+        bound[depth] = bound[depth + 1] + best[order[depth]]
+    
+    result = list(empty)
+    result_total = sum(empty)
+    current = list(empty)
+    taken: set = set()
+    
+    def search(depth: int, total: float) -> None:
+        nonlocal result, result_total
+        if depth == count:
+            if total > result_total:
+                result, result_total = list(current), total
+            return
+        if total + bound[depth] <= result_total:
+            return
+        i = order[depth]
+        for subject, value in ranked[i]:
+            if subject not in taken:
+                taken.add(subject)
+                current[i] = value
+                search(depth + 1, total + value)
+                taken.discard(subject)
+        current[i] = empty[i]
+        search(depth + 1, total + empty[i])
+    
+    search(0, 0.0)
+    return result
+
+
+def _matura_reader(
+    subject: str, level: str, subject_mappings: Dict[str, str]
+) -> Callable[[Sequence[Optional[int]]], float]:
+    """Resolve a subject/level pair to a reader over slot-indexed Matura results"""
+    attr_name = resolve_matura_field(subject, level, subject_mappings)
+    if attr_name is None:
+        return lambda matura: 0
+    
+    slot = SUBJECT_SLOTS[attr_name]
+    
+    def read(matura: Sequence[Optional[int]]) -> float:
+        score = matura[slot]
+        return float(score) if score is not None and score != MISSING_SCORE else 0
+    
+    return read
+
+
+def _compile_component(
+    component: FormulaComponent, subject_mappings: Dict[str, str]
+) -> Callable[[ExtendedScores, Sequence[Optional[int]]], float]:
+    """Compile a component into a function of scores and slot-indexed Matura results"""
+    weight = component.weight
+    min_score = component.min_score
+    cap = component.max_score * weight if component.max_score else None
+    
+    if component.type == ComponentType.MATURA_EXAM:
+        level = component.level or "R"
+        read = _matura_reader(component.subject or "", level, subject_mappings)
+        coefficient, bilingual_coefficient = resolve_level_coefficients(
+            component.level_coefficients, level
+        )
+        
+        def matura_component(scores: ExtendedScores, matura: Sequence[Optional[int]]) -> float:
+            base = read(matura)
+            if scores.is_bilingual:
+                weighted = base * bilingual_coefficient * weight
+            else:
+                weighted = base * coefficient * weight
+            if min_score and weighted < min_score:
+                return 0
+            if cap is not None:
+                return min(weighted, cap)
+            return weighted
+        
+        return matura_component
+    
+    if component.type == ComponentType.PRACTICAL_EXAM:
+        exam_id = component.id
+        
+        def base_score(scores: ExtendedScores) -> float:
+            exams = scores.practical_exams
+            return exams[exam_id] if exams and exam_id in exams else 0
+    elif component.type == ComponentType.INTERVIEW:
+        def base_score(scores: ExtendedScores) -> float:
+            return scores.interview_score or 0
+    elif component.type == ComponentType.PORTFOLIO:
+        def base_score(scores: ExtendedScores) -> float:
+            return scores.portfolio_score or 0
+    elif component.type == ComponentType.PREVIOUS_DEGREE:
+        def base_score(scores: ExtendedScores) -> float:
+            gpa = scores.previous_degree_gpa
+            return gpa * 10 if gpa else 0
+    else:
+        def base_score(scores: ExtendedScores) -> float:
+            return 0
+    
+    def other_component(scores: ExtendedScores, matura: Sequence[Optional[int]]) -> float:
+        weighted = base_score(scores) * weight
+        if min_score and weighted < min_score:
+            return 0
+        if cap is not None:
+            return min(weighted, cap)
+        return weighted
+    
+    return other_component
+
+
+class AlternativeAssignment:
+    """Compiled best assignment for the components of one stage that have
+    alternatives, evaluated by _compile_component for each subject option not
+    in taken"""
+    
+    def __init__(
+        self,
+        components: List[FormulaComponent],
+        subject_mappings: Dict[str, str],
+        taken: FrozenSet[str] = frozenset()
+    ):
+        self.empty = [
+            _compile_component(replace(c, subject="", alternatives=None), subject_mappings)
+            for c in components
+        ]
+        self.options = [
+            [
+                (subject_key(field), _compile_component(
+                    replace(c, subject=subject, alternatives=None), subject_mappings
+                ))
+                for subject, field in alternative_subjects(c, subject_mappings, taken)
+            ]
+            for c in components
+        ]
+        self.groups = group_alternatives([[key for key, _ in o] for o in self.options])
+    
+    def __call__(
+        self, scores: ExtendedScores, matura: Sequence[Optional[int]]
+    ) -> List[float]:
+        """Values of the components, in the order given"""
+        values = [empty(scores, matura) for empty in self.empty]
+        for group in self.groups:
+            options = [
+                [(key, read(scores, matura)) for key, read in self.options[i]] for i in group
+            ]
+            if len(group) == 1:
+                i = group[0]
+                values[i] = max([values[i]] + [value for _, value in options[0]])
+                continue
+            for i, value in zip(group, best_assignment(options, [values[i] for i in group])):
+                values[i] = value
+        return values
+
+
+def _compile_operation(
+    operation: Operation, slots: Dict[str, int]
+) -> Callable[[List[float]], float]:
+    """Compile an operation into a function over stage slot values"""
+    indices = [slots.get(cid) for cid in operation.component_ids]
+    if None in indices:
+        def gather(values: List[float]) -> List[float]:
+            return [values[i] if i is not None else 0 for i in indices]
+    else:
+        def gather(values: List[float]) -> List[float]:
+            return [values[i] for i in indices]
+    
+    op_type = operation.type
+    if op_type == OperationType.MAX:
+        return lambda values: max(gather(values)) if indices else 0
+    if op_type == OperationType.MIN:
+        return lambda values: min(gather(values)) if indices else 0
+    if op_type == OperationType.SUM:
+        return lambda values: sum(gather(values))
+    if op_type == OperationType.AVERAGE:
+        count = len(indices)
+        return lambda values: sum(gather(values)) / count if count else 0
+    if op_type == OperationType.MULTIPLY:
+        factor = operation.value or 1.0
+        
+        def multiply(values: List[float]) -> float:
+            product = 1
+            for v in gather(values):
+                product *= v
+            return product * factor
+        
+        return multiply
+    if op_type == OperationType.DIVIDE:
+        divisor = operation.value or 1.0
+        return lambda values: sum(gather(values)) / divisor
+    if op_type == OperationType.THRESHOLD:
+        cutoff = operation.value or 0
+        
+        def threshold(values: List[float]) -> float:
+            value = gather(values)[0] if indices else 0
+            return value if value >= cutoff else 0
+        
+        return threshold
+    return lambda values: 0
+
+
+def threshold_cutoff(threshold: Optional[Threshold], max_points: float) -> Optional[float]:
+    """Score a stage must reach, or None when it cannot be judged per candidate"""
+    if threshold is None:
+        return None
+    if threshold.type == ThresholdType.MINIMUM:
+        return threshold.value
+    if threshold.type == ThresholdType.PERCENTAGE:
+        return max_points * threshold.value / 100
+    return None
+
+
+class CompiledStage:
+    """Evaluation plan for a single stage"""
+    
+    def __init__(self, stage: FormulaStage, subject_mappings: Dict[str, str]):
+        self.id = stage.id
+        self.name = stage.name
+        self.max_points = stage.max_points
+        self.coefficient = stage.coefficient or 1.0
+        self.cutoff = threshold_cutoff(stage.threshold, stage.max_points)
+        
+        # Slots follow the insertion order of the interpreter's component_scores
+        # dict; a repeated id keeps its first position and its last value.
+        slots: Dict[str, int] = {}
+        last_component: Dict[str, FormulaComponent] = {}
+        for component in stage.components:
+            slots.setdefault(component.id, len(slots))
+            last_component[component.id] = component
+        self.sources = [last_component[cid] for cid in slots]
+        self.components = [
+            _compile_component(component, subject_mappings) for component in self.sources
+        ]
+        
+        # Components with alternatives are filled in by one assignment
+        self.alternative_slots = [
+            slot for slot, component in enumerate(self.sources) if has_alternatives(component)
+        ]
+        self.alternatives = AlternativeAssignment(
+            [self.sources[slot] for slot in self.alternative_slots], subject_mappings,
+            fixed_subjects(self.sources, subject_mappings)
+        ) if self.alternative_slots else None
+        
+        self.operations: List[Tuple[int, bool, Callable[[List[float]], float]]] = []
+        self.operation_inputs: List[frozenset] = []
+        for operation in stage.operations or []:
+            if not operation.result_id:
+                continue  # Result is discarded, nothing to evaluate
+            function = _compile_operation(operation, slots)
+            self.operation_inputs.append(
+                frozenset(slots[cid] for cid in operation.component_ids if cid in slots)
+            )
+            is_new = operation.result_id not in slots
+            slot = slots.setdefault(operation.result_id, len(slots))
+            self.operations.append((slot, is_new, function))
+        
+        self.keys = list(slots)
+        self.breakdown_keys = [f"{stage.id}_{key}" for key in self.keys]
+    
+    def values(
+        self, scores: ExtendedScores, matura: Sequence[Optional[int]]
+    ) -> List[float]:
+        """Component and operation results in slot order"""
+        values = [component(scores, matura) for component in self.components]
+        if self.alternatives is not None:
+            for slot, value in zip(self.alternative_slots, self.alternatives(scores, matura)):
+                values[slot] = value
+        for slot, is_new, function in self.operations:
+            result = function(values)
+            if is_new:
+                values.append(result)
+            else:
+                values[slot] = result
+        return values
+
+
+class CompiledFormula:
+    """Formula with subject mappings, coefficients, operation order and
+    thresholds resolved once, evaluated many times"""
+    
+    def __init__(self, formula: Formula, calculator: AdvancedFormulaCalculator):
+        self.formula = formula
+        self.max_possible_score = formula.metadata.max_possible_score
+        self.stages = [
+            CompiledStage(stage, calculator.subject_mappings) for stage in formula.stages
+        ]
+        self.requirement_checks = self._compile_requirements(
+            formula.requirements, calculator.subject_mappings
+        )
+        # Resolved here so evaluation never touches the calculator's shared cache
+        self.bonus_table = calculator.bonus_table(formula.bonuses) if formula.bonuses else None
+    
+    @staticmethod
+    def _compile_requirements(
+        reqs: Optional[FormulaRequirements], subject_mappings: Dict[str, str]
+    ) -> List[Callable[[ExtendedScores, Sequence[Optional[int]]], Optional[str]]]:
+        """Compile requirements into checks returning a disqualification reason"""
+        checks: List[Callable[[ExtendedScores, Sequence[Optional[int]]], Optional[str]]] = []
+        if not reqs:
+            return checks
+        
+        for subject in reqs.mandatory_subjects or []:
+            def mandatory(
+                scores: ExtendedScores,
+                matura: Sequence[Optional[int]],
+                subject: str = subject,
+                extended: Callable = _matura_reader(subject, "R", subject_mappings),
+                basic: Callable = _matura_reader(subject, "P", subject_mappings),
+            ) -> Optional[str]:
+                if extended(matura) == 0 and basic(matura) == 0:
+                    return f"Missing required subject: {subject}"
+                return None
+            checks.append(mandatory)
+        
+        for subject, min_score in (reqs.minimum_scores or {}).items():
+            def minimum(
+                scores: ExtendedScores,
+                matura: Sequence[Optional[int]],
+                subject: str = subject,
+                min_score: float = min_score,
+                read: Callable = _matura_reader(subject, "R", subject_mappings),
+            ) -> Optional[str]:
+                score = read(matura)
+                if score < min_score:
+                    return f"Score too low for {subject}: {score} < {min_score}"
+                return None
+            checks.append(minimum)
+        
+        if reqs.practical_test_required:
+            checks.append(
+                lambda scores, matura: None if scores.practical_exams else "Practical exam required"
+            )
+        
+        return checks
+    
+    def evaluate(self, scores: ExtendedScores, breakdown: bool = True) -> CalculationResult:
+        """Evaluate the plan for one candidate
+        
+        Accepts ExtendedScores or CompactScores. With breakdown=False the result
+        carries no breakdown and stage results carry empty component_scores;
+        totals and pass flags are unchanged.
+        """
+        if isinstance(scores, CompactScores):
+            matura = scores.matura
+        else:
+            matura = matura_vector(scores.matura_scores)
+        return self.evaluate_with_matura(scores, matura, breakdown)
+    
+    def evaluate_with_matura(
+        self,
+        scores: ExtendedScores,
+        matura: Sequence[Optional[int]],
+        breakdown: bool = True
+    ) -> CalculationResult:
+        """Evaluate with Matura results given as a slot-indexed sequence, which
+        takes precedence over scores.matura_scores"""
+        for check in self.requirement_checks:
+            reason = check(scores, matura)
+            if reason:
+                return CalculationResult(
+                    total_score=0,
+                    stage_results=[],
+                    bonus_points=0,
+                    meets_requirements=False,
+                    disqualification_reason=reason
+                )
+        
+        stage_results = []
+        total_score = 0
+        merged = {} if breakdown else None
+        
+        for stage in self.stages:
+            values = stage.values(scores, matura)
+            stage_score = sum(values)
+            passed = stage.cutoff is None or stage_score >= stage.cutoff
+            stage_results.append(StageResult(
+                stage_id=stage.id,
+                stage_name=stage.name,
+                score=stage_score,
+                max_score=stage.max_points,
+                passed=passed,
+                component_scores=dict(zip(stage.keys, values)) if breakdown else {}
+            ))
+            
+            if not passed:
+                break
+            
+            total_score += stage_score * stage.coefficient
+            if breakdown:
+                merged.update(zip(stage.breakdown_keys, values))
+        
+        bonus_points = 0
+        if self.bonus_table is not None:
+            if isinstance(matura, (bytes, bytearray)):
+                # Packed CompactScores results; bonus conditions read None as missing
+                matura = tuple(None if v == MISSING_SCORE else v for v in matura)
+            bonus_points = self.bonus_table.points(scores, matura)
+            total_score += bonus_points
+        
+        return CalculationResult(
+            total_score=min(total_score, self.max_possible_score),
+            stage_results=stage_results,
+            bonus_points=bonus_points,
+            meets_requirements=True,
+            breakdown=merged
+        )
+
+
+# MARK: - Bulk Scoring CLI
+
+# Per-process state, set up once by _init_worker
+_worker_calculator: Optional[AdvancedFormulaCalculator] = None
+_worker_catalog: Dict[str, CompiledFormula] = {}
+_worker_snapshot = None  # FormulaSnapshot kept mapped when scoring from a snapshot
+
+
+def load_compiled_catalog(
+    formulas_path: str, calculator: AdvancedFormulaCalculator
+) -> Dict[str, CompiledFormula]:
+    """Parse and compile a JSONL formula catalog, keyed by program_id"""
+    catalog = {}
+    with open(formulas_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                formula = calculator.parse_formula_json(line)
+                catalog[formula.program_id] = calculator.compile(formula)
+    return catalog
+
+
+def _init_worker(formulas_path: str, snapshot_path: Optional[str] = None) -> None:
+    """Load the formula catalog once per worker process
+    
+    A snapshot stays mapped for the life of the worker; its formulas are
+    decoded and compiled on first use, so startup only reads the index.
+    """
+    global _worker_calculator, _worker_catalog, _worker_snapshot
+    _worker_calculator = AdvancedFormulaCalculator()
+    if _worker_snapshot is not None:
+        _worker_snapshot.close()
+        _worker_snapshot = None
+    if snapshot_path is None:
+        _worker_catalog = load_compiled_catalog(formulas_path, _worker_calculator)
+        return
+    
+    from formula_snapshot import FormulaSnapshot  # Imports this module
+    _worker_catalog = {}
+    _worker_snapshot = FormulaSnapshot(snapshot_path, verify=False)
+
+
+def _worker_program_ids() -> List[str]:
+    if _worker_snapshot is not None:
+        return _worker_snapshot.program_ids()
+    return list(_worker_catalog)
+
+
+def _worker_plan(program_id: str) -> Optional[CompiledFormula]:
+    """Compiled plan for a program, decoded from the snapshot on first use"""
+    plan = _worker_catalog.get(program_id)
+    if plan is None and _worker_snapshot is not None and program_id in _worker_snapshot:
+        plan = _worker_catalog[program_id] = _worker_calculator.compile(
+            _worker_snapshot.get(program_id)
+        )
+    return plan
+
+
+def _score_chunk(lines: List[str], breakdown: bool) -> Tuple[List[str], int]:
+    """Score a chunk of candidate JSONL lines against the worker catalog
+    
+    Each candidate may carry a candidate_id and a list of program_ids; without
+    program_ids it is scored against every formula in the catalog. A line that
+    cannot be parsed yields one {"candidate_id", "error"} entry instead of
+    results, and the rest of the chunk is still scored. A catalog formula that
+    cannot be compiled or evaluated is reported per program as an invalid
+    formula, not against the candidate.
+    """
+    from formula_bonus import ConditionError  # Imports this module
+    output = []
+    candidates = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        candidates += 1
+        candidate_id = None
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise TypeError("expected a JSON object")
+            candidate_id = record.pop('candidate_id', None)
+            program_ids = record.pop('program_ids', None) or _worker_program_ids()
+            scores = _worker_calculator._parse_scores(record)
+        except (KeyError, TypeError, ValueError) as error:
+            output.append(json.dumps(
+                {'candidate_id': candidate_id, 'error': _invalid_candidate(error)},
+                ensure_ascii=False
+            ))
+            continue
+        
+        for program_id in program_ids:
+            entry: Dict[str, Any] = {
+                'candidate_id': candidate_id,
+                'program_id': program_id,
+            }
+            try:
+                plan = _worker_plan(program_id)
+            except (KeyError, TypeError, ValueError) as error:
+                entry['error'] = f"Invalid formula: {error}"
+                output.append(json.dumps(entry, ensure_ascii=False))
+                continue
+            if plan is None:
+                entry['error'] = f"Unknown program: {program_id}"
+            else:
+                try:
+                    entry['result'] = asdict(plan.evaluate(scores, breakdown))
+                except ConditionError as error:
+                    entry['error'] = f"Invalid formula: {error}"
+                except (TypeError, ValueError) as error:
+                    entry['error'] = _invalid_candidate(error)
+            output.append(json.dumps(entry, ensure_ascii=False))
+    
+    return output, candidates
+
+
+def _invalid_candidate(error: Exception) -> str:
+    if isinstance(error, KeyError):
+        return f"Invalid candidate: missing field {error}"
+    return f"Invalid candidate: {error}"
+
+
+def _chunks(lines: Iterable[str], size: int) -> Iterator[List[str]]:
+    iterator = iter(lines)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@dataclass
+class ScoringStats:
+    """Throughput counters for a bulk scoring run"""
+    candidates: int
+    results: int
+    seconds: float
+    
+    def summary(self) -> str:
+        rate = self.candidates / self.seconds if self.seconds else 0.0
+        return (
+            f"Scored {self.candidates} candidates ({self.results} results) "
+            f"in {self.seconds:.2f}s, {rate:.0f} candidates/s"
+        )
+
+
+def score_jsonl(
+    formulas_path: str,
+    candidates: Iterable[str],
+    output: TextIO,
+    workers: int,
+    chunk_size: int,
+    ordered: bool = True,
+    breakdown: bool = True,
+    snapshot_path: Optional[str] = None
+) -> ScoringStats:
+    """Stream candidate JSONL through a process pool and write result JSONL
+    
+    At most two chunks per worker are in flight, so memory stays bounded
+    regardless of input size. With snapshot_path, workers load the catalog
+    from a binary snapshot, rebuilt first if it is missing or stale.
+    """
+    start = time.perf_counter()
+    if snapshot_path is not None:
+        from formula_snapshot import load_snapshot  # Imports this module
+        load_snapshot(formulas_path, snapshot_path).close()
+    stats = ScoringStats(candidates=0, results=0, seconds=0.0)
+    max_pending = 2 * workers
+    
+    def write(future: Future) -> None:
+        lines, count = future.result()
+        stats.candidates += count
+        stats.results += len(lines)
+        for line in lines:
+            output.write(line)
+            output.write("\n")
+    
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker,
+        initargs=(formulas_path, snapshot_path)
+    ) as pool:
+        pending: Deque[Future] = deque()
+        
+        def drain(limit: int) -> None:
+            nonlocal pending
+            while len(pending) > limit:
+                if ordered:
+                    write(pending.popleft())
+                else:
+                    done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(future)
+                    pending = deque(not_done)
+        
+        for chunk in _chunks(candidates, chunk_size):
+            pending.append(pool.submit(_score_chunk, chunk, breakdown))
+            drain(max_pending - 1)
+        drain(0)
+    
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Score candidate JSONL against a JSONL formula catalog"
+    )
+    parser.add_argument("formulas", help="JSONL file with one formula per line")
+    parser.add_argument(
+        "candidates", nargs="?", default="-",
+        help="JSONL file with one ExtendedScores record per line (default: stdin)"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="result JSONL file (default: stdout)"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count() or 1,
+        help="number of worker processes"
+    )
+    parser.add_argument(
+        "-c", "--chunk-size", type=int, default=1000,
+        help="candidates per work unit"
+    )
+    parser.add_argument(
+        "--unordered", action="store_true",
+        help="write results as chunks finish instead of in input order"
+    )
+    parser.add_argument(
+        "--no-breakdown", action="store_true",
+        help="omit per-component breakdowns from results"
+    )
+    parser.add_argument(
+        "--snapshot", nargs="?", const="", metavar="PATH",
+        help="load formulas from a binary snapshot (default: FORMULAS.snap), "
+             "rebuilding it when stale"
     )
+    args = parser.parse_args(argv)
     
-    # This would normally be loaded from JSON
-    print("Advanced Formula Calculator ready for complex Polish university admissions")
\ No newline at end of file
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size must be positive")
+    
+    candidates = sys.stdin if args.candidates == "-" else open(args.candidates, encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        stats = score_jsonl(
+            args.formulas,
+            candidates,
+            output,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            ordered=not args.unordered,
+            breakdown=not args.no_breakdown,
+            snapshot_path=(
+                None if args.snapshot is None else args.snapshot or args.formulas + ".snap"
+            )
+        )
+    finally:
+        if candidates is not sys.stdin:
+            candidates.close()
+        if output is not sys.stdout:
+            output.close()
+    
+    print(stats.summary(), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    # Run from the importable module so worker processes and helper modules
+    # such as formula_snapshot share one copy of its classes and enums
+    import formula_parser
+    sys.exit(formula_parser.main())
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Stage-by-stage streaming pipeline for cohort runs
+Chunks of candidates flow through requirement filtering and then each stage
+in turn; disqualified candidates are dropped at the step that eliminates
+them, so later stages and bonuses only ever see survivors
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from formula_batch import BatchFormulaCalculator, Cohort
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    ExtendedScores,
+    Formula,
+    FormulaStage,
+    threshold_cutoff,
+)
+from formula_ranking import CohortRanker, select_top
+
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+@dataclass
+class SurvivorBatch:
+    """Candidates still in the running from one input chunk
+
+    rows are positions in the whole input stream; cohort holds only these
+    candidates, and stage_scores one column per stage passed so far.
+    """
+    rows: np.ndarray
+    cohort: Cohort
+    total_scores: np.ndarray
+    stage_scores: List[np.ndarray] = field(default_factory=list)
+
+    def keep(self, mask: np.ndarray) -> "SurvivorBatch":
+        """Batch of the candidates where mask is set; the rest are released"""
+        if mask.all():
+            return self
+        indices = np.flatnonzero(mask)
+        return SurvivorBatch(
+            rows=self.rows[indices],
+            cohort=self.cohort.take(indices),
+            total_scores=self.total_scores[indices],
+            stage_scores=[scores[indices] for scores in self.stage_scores]
+        )
+
+
+@dataclass
+class StepStats:
+    """Candidates entering and leaving one pipeline step, and time spent in it"""
+    name: str
+    candidates: int = 0
+    survivors: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class PipelineResult:
+    """Everyone who passed the requirements and every stage, in stream order"""
+    rows: np.ndarray
+    total_scores: np.ndarray
+    stage_scores: np.ndarray
+    steps: List[StepStats]
+
+
+def cohort_chunks(
+    scores: Iterable[ExtendedScores],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> Iterator[Tuple[int, Cohort]]:
+    """(first row, Cohort) chunks built lazily from a stream of scores"""
+    start = 0
+    chunk: List[ExtendedScores] = []
+    for record in scores:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield start, Cohort.from_scores(chunk, calculator)
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield start, Cohort.from_scores(chunk, calculator)
+
+
+class StagePipeline:
+    """Streams cohort chunks through requirements, stages and bonuses
+
+    Stages with a MINIMUM or PERCENTAGE threshold filter each chunk as it
+    arrives. RANKING and MULTIPLIER stages compare candidates across the whole
+    cohort, so they hold their survivors until the stream ends; by then only
+    candidates who passed every earlier step are held. Totals and survivors
+    match CohortRanker.rank. chunks may come from CandidateStore.chunks with
+    the formula's inputs, or from cohort_chunks.
+    """
+
+    def __init__(
+        self,
+        formula: Formula,
+        calculator: Optional[AdvancedFormulaCalculator] = None,
+        seats: Optional[int] = None,
+        include_ties: bool = False,
+        tie_breaker: Optional[np.ndarray] = None
+    ):
+        self.formula = formula
+        self.ranker = CohortRanker(calculator)
+        self.batch: BatchFormulaCalculator = self.ranker.batch
+        self.seats = seats
+        self.include_ties = include_ties
+        self.tie_breaker = tie_breaker
+        self.steps: List[StepStats] = []
+
+    def run(self, chunks: Iterable[Tuple[int, Cohort]]) -> Iterator[SurvivorBatch]:
+        """Survivors of the whole formula, chunk by chunk, with final totals
+
+        steps is reset and filled in as the stream is consumed.
+        """
+        self.steps = [StepStats("requirements")]
+        batches = self._requirements(chunks, self.steps[0])
+        for stage in self.formula.stages:
+            stats = StepStats(stage.id)
+            self.steps.append(stats)
+            if self.ranker.advance_count(stage, self.seats) is None:
+                batches = self._filter_stage(stage, batches, stats)
+            else:
+                batches = self._rank_stage(stage, batches, stats)
+        self.steps.append(StepStats("bonuses"))
+        return self._finish(batches, self.steps[-1])
+
+    def collect(self, chunks: Iterable[Tuple[int, Cohort]]) -> PipelineResult:
+        """Run the pipeline and gather its survivors"""
+        rows: List[np.ndarray] = []
+        totals: List[np.ndarray] = []
+        stage_scores: List[np.ndarray] = []
+        width = len(self.formula.stages)
+        for batch in self.run(chunks):
+            rows.append(batch.rows)
+            totals.append(batch.total_scores)
+            stage_scores.append(
+                np.column_stack(batch.stage_scores) if width else np.zeros((len(batch.rows), 0))
+            )
+        return PipelineResult(
+            rows=np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64),
+            total_scores=np.concatenate(totals) if totals else np.zeros(0),
+            stage_scores=np.vstack(stage_scores) if stage_scores else np.zeros((0, width)),
+            steps=self.steps
+        )
+
+    # MARK: - Steps
+
+    def _requirements(
+        self, chunks: Iterable[Tuple[int, Cohort]], stats: StepStats
+    ) -> Iterator[SurvivorBatch]:
+        for start, cohort in chunks:
+            began = time.perf_counter()
+            meets = self.batch._check_requirements(self.formula.requirements, cohort)
+            batch = SurvivorBatch(
+                rows=np.arange(start, start + cohort.size),
+                cohort=cohort,
+                total_scores=np.zeros(cohort.size)
+            ).keep(meets)
+            self._count(stats, cohort.size, batch, began)
+            if batch.rows.size:
+                yield batch
+
+    def _filter_stage(
+        self, stage: FormulaStage, batches: Iterator[SurvivorBatch], stats: StepStats
+    ) -> Iterator[SurvivorBatch]:
+        cutoff = threshold_cutoff(stage.threshold, stage.max_points)
+        for batch in batches:
+            began = time.perf_counter()
+            size = batch.rows.size
+            score = self.batch._calculate_stage(stage, batch.cohort)
+            batch = self._scored(stage, batch, score)
+            if cutoff is not None:
+                batch = batch.keep(score >= cutoff)
+            self._count(stats, size, batch, began)
+            if batch.rows.size:
+                yield batch
+
+    def _rank_stage(
+        self, stage: FormulaStage, batches: Iterator[SurvivorBatch], stats: StepStats
+    ) -> Iterator[SurvivorBatch]:
+        held: List[SurvivorBatch] = []
+        scores: List[np.ndarray] = []
+        for batch in batches:
+            began = time.perf_counter()
+            score = self.batch._calculate_stage(stage, batch.cohort)
+            held.append(self._scored(stage, batch, score))
+            scores.append(score)
+            stats.candidates += batch.rows.size
+            stats.seconds += time.perf_counter() - began
+        if not held:
+            return
+
+        began = time.perf_counter()
+        rows = np.concatenate([batch.rows for batch in held])
+        tie_breaker = None if self.tie_breaker is None else self.tie_breaker[rows]
+        keep = select_top(
+            np.concatenate(scores), self.ranker.advance_count(stage, self.seats),
+            self.include_ties, tie_breaker
+        )
+        offsets = np.cumsum([0] + [batch.rows.size for batch in held])
+        survivors = [
+            batch.keep(keep[first:last]) for batch, first, last in zip(held, offsets, offsets[1:])
+        ]
+        held.clear()
+        stats.survivors += int(keep.sum())
+        stats.seconds += time.perf_counter() - began
+        for batch in survivors:
+            if batch.rows.size:
+                yield batch
+
+    def _finish(
+        self, batches: Iterator[SurvivorBatch], stats: StepStats
+    ) -> Iterator[SurvivorBatch]:
+        formula = self.formula
+        for batch in batches:
+            began = time.perf_counter()
+            total = batch.total_scores
+            if formula.bonuses:
+                total = total + self.batch._calculate_bonuses(formula.bonuses, batch.cohort)
+            batch.total_scores = np.minimum(total, formula.metadata.max_possible_score)
+            self._count(stats, batch.rows.size, batch, began)
+            yield batch
+
+    def _scored(self, stage: FormulaStage, batch: SurvivorBatch, score: np.ndarray) -> SurvivorBatch:
+        """Batch with the stage score added to the totals; the caller filters it"""
+        return SurvivorBatch(
+            rows=batch.rows,
+            cohort=batch.cohort,
+            total_scores=batch.total_scores + score * (stage.coefficient or 1.0),
+            stage_scores=batch.stage_scores + [score]
+        )
+
+    @staticmethod
+    def _count(stats: StepStats, candidates: int, batch: SurvivorBatch, began: float) -> None:
+        stats.candidates += candidates
+        stats.survivors += batch.rows.size
+        stats.seconds += time.perf_counter() - began
+
+
+def run_pipeline(
+    formula: Formula,
+    scores: Sequence[ExtendedScores],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    seats: Optional[int] = None,
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> PipelineResult:
+    """Stream scores through a formula in chunks and collect the survivors"""
+    pipeline = StagePipeline(formula, calculator, seats)
+    return pipeline.collect(cohort_chunks(scores, chunk_size, pipeline.batch.calculator))
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Profiling and tracing for the formula calculator
+ProfilingCalculator wraps the calculation pipeline with timers, counters and
+optional trace events; the plain AdvancedFormulaCalculator carries no hooks
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    BonusRule,
+    CalculationResult,
+    CompiledFormula,
+    ExtendedScores,
+    Formula,
+    FormulaStage,
+    Operation,
+    StageResult,
+)
+
+
+# Counter names
+CALCULATIONS = "calculations"
+DISQUALIFIED_REQUIREMENTS = "disqualified_requirements"
+DISQUALIFIED_THRESHOLD = "disqualified_threshold"
+CAPPED = "capped_at_max_score"
+
+
+@dataclass
+class TimerStats:
+    """Call count and wall time of one instrumented step, in nanoseconds"""
+    count: int = 0
+    total_ns: int = 0
+    min_ns: Optional[int] = None
+    max_ns: int = 0
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count if self.count else 0.0
+
+    def add(self, elapsed_ns: int) -> None:
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if self.min_ns is None or elapsed_ns < self.min_ns:
+            self.min_ns = elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+
+class Profiler:
+    """Collects timers, counters and, with trace=True, trace events
+
+    Timer names are calculate:<program>, stage:<program>/<stage>,
+    operation:<program>/<stage>/<operation> and bonuses:<program>. Trace events
+    are kept up to max_events and carry the current candidate label. A
+    Profiler is not thread-safe; give each thread its own.
+    """
+
+    def __init__(self, trace: bool = False, max_events: int = 1_000_000):
+        self.enabled = True
+        self.trace = trace
+        self.max_events = max_events
+        self.timers: Dict[str, TimerStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.dropped_events = 0
+        self.candidate_id: Optional[str] = None
+
+    def reset(self) -> None:
+        self.timers.clear()
+        self.counters.clear()
+        self.events.clear()
+        self.dropped_events = 0
+
+    @contextmanager
+    def candidate(self, candidate_id: str) -> Iterator[None]:
+        """Label trace events recorded inside the block with a candidate"""
+        previous = self.candidate_id
+        self.candidate_id = candidate_id
+        try:
+            yield
+        finally:
+            self.candidate_id = previous
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(
+        self,
+        name: str,
+        category: str,
+        start_ns: int,
+        end_ns: int,
+        args: Optional[Dict[str, Any]] = None
+    ) -> None:
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = TimerStats()
+        timer.add(end_ns - start_ns)
+
+        if not self.trace:
+            return
+        if len(self.events) >= self.max_events:
+            self.dropped_events += 1
+            return
+        event_args = dict(args or {})
+        if self.candidate_id is not None:
+            event_args["candidate_id"] = self.candidate_id
+        self.events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": event_args
+        })
+
+    # MARK: - Exporters
+
+    def stats(self) -> Dict[str, Any]:
+        """Timers and counters as plain JSON-serializable data"""
+        return {
+            "timers": {
+                name: dict(asdict(timer), mean_ns=timer.mean_ns)
+                for name, timer in sorted(self.timers.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "dropped_events": self.dropped_events
+        }
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Trace in the Chrome trace event format (chrome://tracing, Perfetto)"""
+        return {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"counters": self.counters}
+        }
+
+    def write_chrome_trace(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def write_stats(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.stats(), f, indent=2)
+
+
+class ProfilingCalculator(AdvancedFormulaCalculator):
+    """AdvancedFormulaCalculator reporting to a Profiler
+
+    Each hook checks profiler.enabled once and otherwise defers straight to
+    the base implementation, so profiling can be switched off at run time.
+    Only the scalar calculate() path is instrumented: compile() returns a
+    plain plan, which records nothing.
+    """
+
+    def __init__(self, profiler: Optional[Profiler] = None):
+        super().__init__()
+        self.profiler = profiler or Profiler()
+        self._program_id = ""
+        self._stage_id = ""
+        # Compiles plans without hooks, sharing mappings and bonus tables
+        self._plain = AdvancedFormulaCalculator()
+        self._plain.subject_mappings = self.subject_mappings
+        self._plain.bonus_tables = self.bonus_tables
+        self._plain.bonus_lock = self.bonus_lock
+        self._plain.bonus_cache_size = self.bonus_cache_size
+
+    def compile(self, formula: Formula) -> CompiledFormula:
+        """Uninstrumented plan; the hooks would report under a stale program"""
+        return self._plain.compile(formula)
+
+    def calculate(self, formula: Formula, scores: ExtendedScores) -> CalculationResult:
+        profiler = self.profiler
+        if not profiler.enabled:
+            return super().calculate(formula, scores)
+
+        self._program_id = formula.program_id
+        start = time.perf_counter_ns()
+        result = super().calculate(formula, scores)
+        end = time.perf_counter_ns()
+
+        profiler.count(CALCULATIONS)
+        if not result.meets_requirements:
+            profiler.count(DISQUALIFIED_REQUIREMENTS)
+        else:
+            uncapped = result.bonus_points
+            for stage, stage_result in zip(formula.stages, result.stage_results):
+                if not stage_result.passed:
+                    profiler.count(DISQUALIFIED_THRESHOLD)
+                    break
+                uncapped += stage_result.score * (stage.coefficient or 1.0)
+            if uncapped > formula.metadata.max_possible_score:
+                profiler.count(CAPPED)
+
+        profiler.record(
+            f"calculate:{formula.program_id}", "calculate", start, end,
+            {"total_score": result.total_score, "meets_requirements": result.meets_requirements}
+        )
+        return result
+
+    def _calculate_stage(
+        self, stage: FormulaStage, scores: ExtendedScores, formula: Formula
+    ) -> StageResult:
+        profiler = self.profiler
+        if not profiler.enabled:
+            return super()._calculate_stage(stage, scores, formula)
+
+        self._stage_id = stage.id
+        start = time.perf_counter_ns()
+        result = super()._calculate_stage(stage, scores, formula)
+        end = time.perf_counter_ns()
+        profiler.record(
+            f"stage:{formula.program_id}/{stage.id}", "stage", start, end,
+            {"score": result.score, "passed": result.passed}
+        )
+        return result
+
+    def _apply_operation(
+        self, operation: Operation, component_scores: Dict[str, float]
+    ) -> float:
+        profiler = self.profiler
+        if not profiler.enabled:
+            return super()._apply_operation(operation, component_scores)
+
+        start = time.perf_counter_ns()
+        result = super()._apply_operation(operation, component_scores)
+        end = time.perf_counter_ns()
+        name = operation.id or operation.type.value
+        profiler.record(
+            f"operation:{self._program_id}/{self._stage_id}/{name}", "operation",
+            start, end, {"result": result}
+        )
+        return result
+
+    def _calculate_bonuses(
+        self, bonuses: List[BonusRule], scores: ExtendedScores
+    ) -> float:
+        profiler = self.profiler
+        if not profiler.enabled:
+            return super()._calculate_bonuses(bonuses, scores)
+
+        start = time.perf_counter_ns()
+        result = super()._calculate_bonuses(bonuses, scores)
+        end = time.perf_counter_ns()
+        profiler.record(
+            f"bonuses:{self._program_id}", "bonuses", start, end, {"points": result}
+        )
+        return result
+
+
+# MARK: - Overhead
+
+def measure_overhead(
+    formulas: List[Formula], candidates: List[ExtendedScores], repeat: int = 5
+) -> Dict[str, float]:
+    """Mean microseconds per calculate call without hooks, with hooks
+    disabled, with timers and counters, and with trace events"""
+
+    def per_call(calculator: AdvancedFormulaCalculator) -> float:
+        best = None
+        for _ in range(repeat):
+            if isinstance(calculator, ProfilingCalculator):
+                calculator.profiler.reset()
+            start = time.perf_counter()
+            for formula in formulas:
+                for scores in candidates:
+                    calculator.calculate(formula, scores)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return 1e6 * best / (len(formulas) * len(candidates))
+
+    disabled = ProfilingCalculator(Profiler())
+    disabled.profiler.enabled = False
+    return {
+        "plain_us": per_call(AdvancedFormulaCalculator()),
+        "disabled_us": per_call(disabled),
+        "timers_us": per_call(ProfilingCalculator(Profiler())),
+        "trace_us": per_call(ProfilingCalculator(Profiler(trace=True)))
+    }
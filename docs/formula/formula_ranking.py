@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Cohort ranking for multi-stage admissions
+Implements RANKING and MULTIPLIER stage thresholds, which can only be judged
+against the whole applicant pool
+"""
+
+import math
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from formula_batch import BatchFormulaCalculator, Cohort
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    Formula,
+    FormulaStage,
+    ThresholdType,
+    threshold_cutoff,
+)
+
+
+@dataclass
+class RankingResult:
+    """Outcome of running a formula over a cohort with stage selection
+
+    stage_scores is NaN and stage_passed False for stages a candidate never
+    reached. ranking lists candidates who passed every stage, best first.
+    """
+    total_scores: np.ndarray
+    meets_requirements: np.ndarray
+    stage_scores: np.ndarray
+    stage_passed: np.ndarray
+    stage_ids: List[str]
+    survivors: List[int]
+    ranking: np.ndarray
+
+
+def select_top(
+    scores: np.ndarray,
+    k: int,
+    include_ties: bool = False,
+    tie_breaker: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Mask of the k best scores, found by partial selection in O(n)
+
+    Ties at the boundary are broken by higher tie_breaker, then by lower
+    position. With include_ties=True everyone tied with the k-th score is kept.
+    """
+    n = len(scores)
+    if k >= n:
+        return np.ones(n, dtype=bool)
+    if k <= 0:
+        return np.zeros(n, dtype=bool)
+
+    kth = np.partition(scores, n - k)[n - k]
+    selected = scores > kth
+    tied = np.flatnonzero(scores == kth)
+
+    if include_ties:
+        selected[tied] = True
+        return selected
+
+    remaining = k - int(selected.sum())
+    if tie_breaker is not None:
+        tied = tied[np.lexsort((tied, -tie_breaker[tied]))]
+    selected[tied[:remaining]] = True
+    return selected
+
+
+def rank_order(
+    scores: np.ndarray, tie_breaker: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Positions sorted best first with the same tie-breaking as select_top"""
+    positions = np.arange(len(scores))
+    if tie_breaker is None:
+        return np.lexsort((positions, -scores))
+    return np.lexsort((positions, -tie_breaker, -scores))
+
+
+class CohortRanker:
+    """Runs formulas stage by stage over a cohort, selecting who advances"""
+
+    def __init__(self, calculator: Optional[AdvancedFormulaCalculator] = None):
+        self.batch = BatchFormulaCalculator(calculator)
+
+    def advance_count(self, stage: FormulaStage, seats: Optional[int]) -> Optional[int]:
+        """How many candidates a ranking stage lets through, None if not ranked"""
+        threshold = stage.threshold
+        if threshold is None:
+            return None
+        if threshold.type == ThresholdType.RANKING:
+            return int(threshold.value)
+        if threshold.type == ThresholdType.MULTIPLIER:
+            if seats is None:
+                raise ValueError(
+                    f"Stage {stage.id} has a multiplier threshold; seats are required"
+                )
+            return math.ceil(threshold.value * seats)
+        return None
+
+    def rank(
+        self,
+        formula: Formula,
+        cohort: Cohort,
+        seats: Optional[int] = None,
+        include_ties: bool = False,
+        tie_breaker: Optional[np.ndarray] = None
+    ) -> RankingResult:
+        """Score each stage for the candidates still in the running
+
+        Later stages are evaluated only for survivors of earlier ones.
+        """
+        n = cohort.size
+        meets = self.batch._check_requirements(formula.requirements, cohort)
+        alive = np.flatnonzero(meets)
+        total = np.zeros(n)
+        stage_scores = np.full((n, len(formula.stages)), np.nan)
+        stage_passed = np.zeros((n, len(formula.stages)), dtype=bool)
+        survivors = []
+
+        for index, stage in enumerate(formula.stages):
+            score = self.batch._calculate_stage(stage, cohort.take(alive))
+            stage_scores[alive, index] = score
+
+            keep = self._advance(
+                stage, score, seats, include_ties,
+                None if tie_breaker is None else tie_breaker[alive]
+            )
+            alive = alive[keep]
+            stage_passed[alive, index] = True
+            total[alive] += score[keep] * (stage.coefficient or 1.0)
+            survivors.append(len(alive))
+
+        if formula.bonuses:
+            bonus = self.batch._calculate_bonuses(formula.bonuses, cohort)
+            total = total + bonus
+
+        total = np.where(meets, np.minimum(total, formula.metadata.max_possible_score), 0.0)
+
+        order = rank_order(
+            total[alive], None if tie_breaker is None else tie_breaker[alive]
+        )
+
+        return RankingResult(
+            total_scores=total,
+            meets_requirements=meets,
+            stage_scores=stage_scores,
+            stage_passed=stage_passed,
+            stage_ids=[stage.id for stage in formula.stages],
+            survivors=survivors,
+            ranking=alive[order]
+        )
+
+    def _advance(
+        self,
+        stage: FormulaStage,
+        score: np.ndarray,
+        seats: Optional[int],
+        include_ties: bool,
+        tie_breaker: Optional[np.ndarray]
+    ) -> np.ndarray:
+        """Mask of stage candidates who advance"""
+        count = self.advance_count(stage, seats)
+        if count is not None:
+            return select_top(score, count, include_ties, tie_breaker)
+
+        cutoff = threshold_cutoff(stage.threshold, stage.max_points)
+        if cutoff is None:
+            return np.ones(len(score), dtype=bool)
+        return score >= cutoff
+
+
+def rank_cohort(
+    formula: Formula,
+    cohort: Cohort,
+    seats: Optional[int] = None,
+    include_ties: bool = False,
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> RankingResult:
+    """Run a formula over a cohort, applying RANKING and MULTIPLIER thresholds"""
+    return CohortRanker(calculator).rank(formula, cohort, seats, include_ties)
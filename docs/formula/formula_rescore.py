@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+Incremental rescoring when a formula changes
+Persists per-component contributions for a cohort, diffs two versions of a
+formula, and recomputes only the components, operations and totals the edit
+touches, reporting candidates whose pass/fail or rank changed
+"""
+
+import json
+from dataclasses import dataclass, field, fields
+from enum import Enum
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from formula_batch import BatchFormulaCalculator, Cohort, sum_slots
+from formula_cache import formula_fingerprint
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    Formula,
+    FormulaComponent,
+    FormulaStage,
+    fixed_subjects,
+    has_alternatives,
+    threshold_cutoff,
+)
+from formula_ranking import rank_order
+
+
+# MARK: - Formula Diff
+
+@dataclass
+class StageDiff:
+    """What changed in one stage; components lists ids changed or added"""
+    stage_id: str
+    added: bool = False
+    components: List[str] = field(default_factory=list)
+    removed_components: List[str] = field(default_factory=list)
+    component_order: bool = False
+    operations: bool = False
+    threshold: bool = False
+    coefficient: bool = False
+    max_points: bool = False
+    changes: List[str] = field(default_factory=list)
+
+
+@dataclass
+class FormulaDiff:
+    """Structural difference between two versions of a formula"""
+    stages: List[StageDiff]
+    removed_stages: List[str]
+    stage_order: bool
+    requirements: bool
+    bonuses: bool
+    max_possible_score: bool
+    changes: List[str]
+
+    @property
+    def empty(self) -> bool:
+        return not self.changes
+
+
+def _show(value: Any) -> str:
+    if isinstance(value, Enum):
+        return str(value.value)
+    return str(value)
+
+
+def _field_changes(label: str, old: Any, new: Any) -> List[str]:
+    changes = []
+    for f in fields(old):
+        before, after = getattr(old, f.name), getattr(new, f.name)
+        if before != after:
+            changes.append(f"{label} {f.name} from {_show(before)} to {_show(after)}")
+    return changes
+
+
+def _diff_stage(old: FormulaStage, new: FormulaStage) -> StageDiff:
+    diff = StageDiff(new.id)
+    label = f"stage {new.id}:"
+
+    # A repeated id keeps its last component, as component_scores does
+    before = {c.id: c for c in old.components}
+    after = {c.id: c for c in new.components}
+    for cid, component in after.items():
+        if cid not in before:
+            diff.components.append(cid)
+            diff.changes.append(f"{label} added component {cid}")
+        elif before[cid] != component:
+            diff.components.append(cid)
+            diff.changes.extend(_field_changes(f"{label} {cid}", before[cid], component))
+    for cid in before:
+        if cid not in after:
+            diff.removed_components.append(cid)
+            diff.changes.append(f"{label} removed component {cid}")
+    if [c for c in before if c in after] != [c for c in after if c in before]:
+        diff.component_order = True
+        diff.changes.append(f"{label} reordered components")
+
+    if (old.operations or []) != (new.operations or []):
+        diff.operations = True
+        diff.changes.append(f"{label} updated operations")
+    if old.threshold != new.threshold:
+        diff.threshold = True
+        diff.changes.append(
+            f"{label} threshold from {_show(old.threshold)} to {_show(new.threshold)}"
+        )
+    if old.coefficient != new.coefficient:
+        diff.coefficient = True
+        diff.changes.append(f"{label} coefficient from {old.coefficient} to {new.coefficient}")
+    if old.max_points != new.max_points:
+        diff.max_points = True
+        diff.changes.append(f"{label} max_points from {old.max_points} to {new.max_points}")
+    return diff
+
+
+def diff_formulas(old: Formula, new: Formula) -> FormulaDiff:
+    """Compare two versions of a formula stage by stage, matching stages by id"""
+    old_stages = {stage.id: stage for stage in old.stages}
+    new_ids = [stage.id for stage in new.stages]
+    stages = []
+    changes = []
+    for stage in new.stages:
+        if stage.id not in old_stages:
+            stages.append(StageDiff(stage.id, added=True, changes=[f"added stage {stage.id}"]))
+        else:
+            diff = _diff_stage(old_stages[stage.id], stage)
+            if diff.changes:
+                stages.append(diff)
+    for stage in stages:
+        changes.extend(stage.changes)
+
+    removed = [stage.id for stage in old.stages if stage.id not in new_ids]
+    changes.extend(f"removed stage {sid}" for sid in removed)
+    stage_order = [sid for sid in old_stages if sid in new_ids] != [
+        sid for sid in new_ids if sid in old_stages
+    ]
+    if stage_order:
+        changes.append("reordered stages")
+
+    requirements = old.requirements != new.requirements
+    if requirements:
+        changes.append("updated requirements")
+    bonuses = old.bonuses != new.bonuses
+    if bonuses:
+        changes.append("updated bonuses")
+    cap = old.metadata.max_possible_score != new.metadata.max_possible_score
+    if cap:
+        changes.append(
+            f"max_possible_score from {old.metadata.max_possible_score} "
+            f"to {new.metadata.max_possible_score}"
+        )
+    return FormulaDiff(stages, removed, stage_order, requirements, bonuses, cap, changes)
+
+
+# MARK: - Contributions
+
+@dataclass
+class StageContributions:
+    """Per-candidate columns for one stage
+
+    components holds component values before operations run; slots holds the
+    values StageResult.component_scores reports (the same dict when the stage
+    has no operations); score is the stage score.
+    """
+    stage_id: str
+    components: Dict[str, np.ndarray]
+    slots: Dict[str, np.ndarray]
+    score: np.ndarray
+
+
+@dataclass
+class ContributionStore:
+    """Contributions of every candidate in a cohort under one formula version
+
+    Stages are evaluated for every candidate, reached or not, so any later
+    edit can be folded without going back to the scores.
+    """
+    formula: Formula
+    stages: Dict[str, StageContributions]
+    meets_requirements: np.ndarray
+    bonus_points: np.ndarray
+
+    @property
+    def size(self) -> int:
+        return len(self.meets_requirements)
+
+    @classmethod
+    def build(
+        cls, formula: Formula, cohort: Cohort, batch: Optional[BatchFormulaCalculator] = None
+    ) -> "ContributionStore":
+        batch = batch or BatchFormulaCalculator()
+        stages = {}
+        for stage in formula.stages:
+            components = batch.component_slots(stage, cohort)
+            slots = batch.operation_slots(stage, components, cohort.size)
+            stages[stage.id] = StageContributions(
+                stage.id, components, slots, sum_slots(slots, cohort.size)
+            )
+        bonus = np.zeros(cohort.size)
+        if formula.bonuses:
+            bonus = batch._calculate_bonuses(formula.bonuses, cohort)
+        return cls(
+            formula=formula,
+            stages=stages,
+            meets_requirements=batch._check_requirements(formula.requirements, cohort),
+            bonus_points=bonus
+        )
+
+    def component_scores(self, stage_id: str, candidate: int) -> Dict[str, float]:
+        """One candidate's StageResult.component_scores for a stage"""
+        return {key: float(v[candidate]) for key, v in self.stages[stage_id].slots.items()}
+
+    def save(self, path: str) -> None:
+        """Write an .npz tagged with the formula fingerprint"""
+        arrays: Dict[str, np.ndarray] = {
+            "meets_requirements": self.meets_requirements,
+            "bonus_points": self.bonus_points,
+        }
+        layout: Dict[str, Any] = {
+            "fingerprint": formula_fingerprint(self.formula), "stages": []
+        }
+        for i, stage in enumerate(self.stages.values()):
+            shared = stage.slots is stage.components
+            layout["stages"].append({
+                "id": stage.stage_id,
+                "components": list(stage.components),
+                "slots": None if shared else list(stage.slots)
+            })
+            for j, values in enumerate(stage.components.values()):
+                arrays[f"s{i}_c{j}"] = values
+            if not shared:
+                for j, values in enumerate(stage.slots.values()):
+                    arrays[f"s{i}_o{j}"] = values
+            arrays[f"s{i}_score"] = stage.score
+        arrays["layout"] = np.frombuffer(json.dumps(layout).encode("utf-8"), dtype=np.uint8)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str, formula: Formula) -> "ContributionStore":
+        """Read a store written by save; formula must be the version it was built for"""
+        with np.load(path) as data:
+            layout = json.loads(data["layout"].tobytes().decode("utf-8"))
+            if layout["fingerprint"] != formula_fingerprint(formula):
+                raise ValueError(f"{path} was built for a different version of {formula.program_id}")
+            stages = {}
+            for i, entry in enumerate(layout["stages"]):
+                components = {key: data[f"s{i}_c{j}"] for j, key in enumerate(entry["components"])}
+                slots = components if entry["slots"] is None else {
+                    key: data[f"s{i}_o{j}"] for j, key in enumerate(entry["slots"])
+                }
+                stages[entry["id"]] = StageContributions(
+                    entry["id"], components, slots, data[f"s{i}_score"]
+                )
+            return cls(formula, stages, data["meets_requirements"], data["bonus_points"])
+
+
+# MARK: - Rescoring
+
+@dataclass
+class Standing:
+    """Totals and outcome of a formula over a cohort
+
+    passed marks candidates who meet the requirements and pass every stage;
+    rank is their 0-based position, best first, and -1 for everyone else.
+    """
+    total_scores: np.ndarray
+    passed: np.ndarray
+    rank: np.ndarray
+
+
+@dataclass
+class RescoreReport:
+    """Outcome of applying a formula edit to a stored cohort
+
+    admitted_changed is only filled when seats are given: candidates who
+    moved in or out of the top seats.
+    """
+    diff: FormulaDiff
+    before: Standing
+    after: Standing
+    passed_changed: np.ndarray
+    rank_changed: np.ndarray
+    total_changed: np.ndarray
+    admitted_changed: Optional[np.ndarray]
+    recomputed_columns: int
+    reused_columns: int
+
+
+def standing(
+    store: ContributionStore, tie_breaker: Optional[np.ndarray] = None
+) -> Standing:
+    """Fold stored contributions into totals, as BatchFormulaCalculator.calculate does"""
+    formula = store.formula
+    meets = store.meets_requirements
+    alive = meets.copy()
+    total = np.zeros(store.size)
+    for stage in formula.stages:
+        score = store.stages[stage.id].score
+        cutoff = threshold_cutoff(stage.threshold, stage.max_points)
+        passed = alive if cutoff is None else alive & (score >= cutoff)
+        total = np.where(passed, total + score * (stage.coefficient or 1.0), total)
+        alive = passed
+    if formula.bonuses:
+        total = total + np.where(meets, store.bonus_points, 0.0)
+    total = np.where(meets, np.minimum(total, formula.metadata.max_possible_score), 0.0)
+
+    ranked = np.flatnonzero(alive)
+    order = rank_order(total[ranked], None if tie_breaker is None else tie_breaker[ranked])
+    rank = np.full(store.size, -1, dtype=np.int64)
+    rank[ranked[order]] = np.arange(len(ranked))
+    return Standing(total, alive, rank)
+
+
+class IncrementalRescorer:
+    """Applies formula edits to a cohort, recomputing only what changed
+
+    Unchanged component columns are reused. A stage's operations run again
+    only when the operations or any of its components changed. Requirements
+    and bonuses are recomputed only when they changed, and totals and ranks
+    are refolded from the stage scores. Stage thresholds are applied per
+    candidate, as in BatchFormulaCalculator; cohort-wide RANKING and
+    MULTIPLIER selection is formula_ranking's job.
+    """
+
+    def __init__(
+        self,
+        store: ContributionStore,
+        cohort: Cohort,
+        calculator: Optional[AdvancedFormulaCalculator] = None,
+        tie_breaker: Optional[np.ndarray] = None
+    ):
+        if store.size != cohort.size:
+            raise ValueError("Store and cohort sizes differ")
+        self.store = store
+        self.cohort = cohort
+        self.batch = BatchFormulaCalculator(calculator)
+        self.tie_breaker = tie_breaker
+        self.standing = standing(store, tie_breaker)
+
+    def apply(self, formula: Formula, seats: Optional[int] = None) -> RescoreReport:
+        """Rescore the cohort under a new version of the formula"""
+        old = self.store
+        diff = diff_formulas(old.formula, formula)
+        changed = {stage.stage_id: stage for stage in diff.stages}
+        recomputed = reused = 0
+
+        stages: Dict[str, StageContributions] = {}
+        for stage in formula.stages:
+            stage_diff = changed.get(stage.id)
+            if stage_diff is None:
+                stages[stage.id] = old.stages[stage.id]
+                continue
+            if stage_diff.added:
+                contributions = self._full_stage(stage)
+                recomputed += len(contributions.components)
+            else:
+                previous = next(s for s in old.formula.stages if s.id == stage.id)
+                contributions, count = self._patch_stage(
+                    stage, old.stages[stage.id], previous, stage_diff
+                )
+                recomputed += count
+                reused += len(contributions.components) - count
+            stages[stage.id] = contributions
+
+        meets = old.meets_requirements
+        if diff.requirements:
+            meets = self.batch._check_requirements(formula.requirements, self.cohort)
+        bonus = old.bonus_points
+        if diff.bonuses:
+            bonus = np.zeros(self.cohort.size)
+            if formula.bonuses:
+                bonus = self.batch._calculate_bonuses(formula.bonuses, self.cohort)
+
+        new = ContributionStore(formula, stages, meets, bonus)
+        before = self.standing
+        after = standing(new, self.tie_breaker)
+        self.store, self.standing = new, after
+
+        admitted_changed = None
+        if seats is not None:
+            admitted_before = (before.rank >= 0) & (before.rank < seats)
+            admitted_after = (after.rank >= 0) & (after.rank < seats)
+            admitted_changed = np.flatnonzero(admitted_before != admitted_after)
+        return RescoreReport(
+            diff=diff,
+            before=before,
+            after=after,
+            passed_changed=np.flatnonzero(before.passed != after.passed),
+            rank_changed=np.flatnonzero(before.rank != after.rank),
+            total_changed=np.flatnonzero(before.total_scores != after.total_scores),
+            admitted_changed=admitted_changed,
+            recomputed_columns=recomputed,
+            reused_columns=reused
+        )
+
+    def _full_stage(self, stage: FormulaStage) -> StageContributions:
+        components = self.batch.component_slots(stage, self.cohort)
+        slots = self.batch.operation_slots(stage, components, self.cohort.size)
+        return StageContributions(stage.id, components, slots, sum_slots(slots, self.cohort.size))
+
+    def _patch_stage(
+        self,
+        stage: FormulaStage,
+        stored: StageContributions,
+        before: FormulaStage,
+        diff: StageDiff
+    ) -> Tuple[StageContributions, int]:
+        """Reuse unchanged component columns; returns the contributions and
+        how many component columns were recomputed"""
+        if not (diff.components or diff.removed_components or diff.component_order
+                or diff.operations):
+            return StageContributions(stage.id, stored.components, stored.slots, stored.score), 0
+
+        latest: Dict[str, FormulaComponent] = {c.id: c for c in stage.components}
+        dirty: Set[str] = set(diff.components)
+        choosers = [c for c in latest.values() if has_alternatives(c)]
+        previous = [c.id for c in {c.id: c for c in before.components}.values() if has_alternatives(c)]
+        # An assignment couples its components, so any change to them, or to
+        # the subjects fixed components take, reruns it
+        mappings = self.batch.calculator.subject_mappings
+        taken = fixed_subjects(stage.components, mappings)
+        rerun_assignment = bool(choosers or previous) and (
+            [c.id for c in choosers] != previous
+            or any(c.id in dirty for c in choosers)
+            or taken != fixed_subjects(before.components, mappings)
+        )
+
+        components: Dict[str, np.ndarray] = {}
+        for cid, component in latest.items():
+            if cid in dirty and not has_alternatives(component):
+                components[cid] = self.batch._calculate_component(component, self.cohort)
+            else:
+                components[cid] = stored.components.get(cid)
+        if rerun_assignment:
+            components.update(self.batch._assign_alternatives(choosers, self.cohort, taken))
+        count = sum(1 for cid in latest if cid in dirty or (
+            rerun_assignment and has_alternatives(latest[cid])
+        ))
+
+        slots = self.batch.operation_slots(stage, components, self.cohort.size)
+        return StageContributions(
+            stage.id, components, slots, sum_slots(slots, self.cohort.size)
+        ), count
+
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Incremental what-if recalculation
+Tracks which components, operations and stages depend on each input so that
+changing one Matura result recomputes only the affected nodes
+"""
+
+import copy
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    CalculationResult,
+    CompiledFormula,
+    CompiledStage,
+    ComponentType,
+    ExtendedScores,
+    Formula,
+    FormulaComponent,
+    FormulaRequirements,
+    InputKey,
+    MATURA_SUBJECTS,
+    SUBJECT_SLOTS,
+    alternative_subjects,
+    matura_vector,
+    resolve_level_coefficients,
+    resolve_matura_field,
+)
+
+
+# InputKey for the presence of any practical exam
+PRACTICAL_EXAMS = "practical_exams"
+SCALAR_INPUTS = ("interview_score", "portfolio_score", "previous_degree_gpa", "is_bilingual")
+
+
+@dataclass(frozen=True)
+class ProgramState:
+    """Observable outputs of one program for the current inputs"""
+    total_score: float
+    stage_scores: Tuple[float, ...]
+    meets_requirements: bool
+    disqualification_reason: Optional[str] = None
+
+
+def component_inputs(
+    component: FormulaComponent, subject_mappings: Dict[str, str]
+) -> Set[InputKey]:
+    """Inputs a component reads"""
+    if component.type == ComponentType.MATURA_EXAM:
+        level = component.level or "R"
+        inputs: Set[InputKey] = set()
+        for _, attr_name in alternative_subjects(component, subject_mappings):
+            inputs.add(("matura", SUBJECT_SLOTS[attr_name]))
+        coefficient, bilingual_coefficient = resolve_level_coefficients(
+            component.level_coefficients, level
+        )
+        if coefficient != bilingual_coefficient:
+            inputs.add("is_bilingual")
+        return inputs
+    if component.type == ComponentType.PRACTICAL_EXAM:
+        return {("practical", component.id)}
+    if component.type == ComponentType.INTERVIEW:
+        return {"interview_score"}
+    if component.type == ComponentType.PORTFOLIO:
+        return {"portfolio_score"}
+    if component.type == ComponentType.PREVIOUS_DEGREE:
+        return {"previous_degree_gpa"}
+    return set()
+
+
+def requirement_inputs(
+    reqs: Optional[FormulaRequirements], subject_mappings: Dict[str, str]
+) -> Set[InputKey]:
+    """Inputs the requirement checks read"""
+    inputs: Set[InputKey] = set()
+    if not reqs:
+        return inputs
+    for subject in reqs.mandatory_subjects or []:
+        for level in ("R", "P"):
+            attr_name = resolve_matura_field(subject, level, subject_mappings)
+            if attr_name is not None:
+                inputs.add(("matura", SUBJECT_SLOTS[attr_name]))
+    for subject in reqs.minimum_scores or {}:
+        attr_name = resolve_matura_field(subject, "R", subject_mappings)
+        if attr_name is not None:
+            inputs.add(("matura", SUBJECT_SLOTS[attr_name]))
+    if reqs.practical_test_required:
+        inputs.add(PRACTICAL_EXAMS)
+    return inputs
+
+
+class _ProgramGraph:
+    """Cached node values and input dependencies of one compiled formula"""
+
+    def __init__(self, plan: CompiledFormula, subject_mappings: Dict[str, str]):
+        self.plan = plan
+        self.requirement_inputs = requirement_inputs(
+            plan.formula.requirements, subject_mappings
+        )
+        self.bonus_table = plan.bonus_table
+        self.bonus_inputs: Set[InputKey] = set()
+        if self.bonus_table is not None:
+            self.bonus_inputs = self.bonus_table.inputs
+
+        # input -> (stage index, component slot) nodes reading it
+        self.dependents: Dict[InputKey, List[Tuple[int, int]]] = {}
+        # Stages where an operation overwrites an existing slot, or where
+        # components choose among alternatives, are recomputed whole, since
+        # their slot values then depend on each other.
+        self.recompute_whole: List[bool] = []
+        for stage_index, stage in enumerate(plan.stages):
+            for slot, component in enumerate(stage.sources):
+                for key in component_inputs(component, subject_mappings):
+                    self.dependents.setdefault(key, []).append((stage_index, slot))
+            self.recompute_whole.append(
+                any(not is_new for _, is_new, _ in stage.operations)
+                or stage.alternatives is not None
+            )
+
+        self.stage_values: List[List[float]] = []
+        self.stage_scores: List[float] = []
+        self.reason: Optional[str] = None
+        self.bonus_points: float = 0
+        self.state: Optional[ProgramState] = None
+
+    @property
+    def inputs(self) -> Set[InputKey]:
+        return set(self.dependents) | self.requirement_inputs | self.bonus_inputs
+
+    def evaluate_all(self, scores: ExtendedScores, matura: List[Optional[int]]) -> None:
+        """Evaluate every node from scratch"""
+        self.stage_values = [stage.values(scores, matura) for stage in self.plan.stages]
+        self.stage_scores = [sum(values) for values in self.stage_values]
+        self.reason = self._check_requirements(scores, matura)
+        self.bonus_points = 0
+        if self.bonus_table is not None:
+            self.bonus_points = self.bonus_table.points(scores, matura)
+        self.state = self._fold()
+
+    def update(
+        self, key: InputKey, scores: ExtendedScores, matura: List[Optional[int]]
+    ) -> bool:
+        """Recompute nodes downstream of an input; True if outputs changed"""
+        changed: Dict[int, Set[int]] = {}
+        for stage_index, slot in self.dependents.get(key, ()):
+            stage = self.plan.stages[stage_index]
+            if self.recompute_whole[stage_index]:
+                changed.setdefault(stage_index, set())
+                continue
+            value = stage.components[slot](scores, matura)
+            values = self.stage_values[stage_index]
+            if value != values[slot]:
+                values[slot] = value
+                changed.setdefault(stage_index, set()).add(slot)
+
+        for stage_index, slots in changed.items():
+            stage = self.plan.stages[stage_index]
+            if self.recompute_whole[stage_index]:
+                self.stage_values[stage_index] = stage.values(scores, matura)
+            else:
+                self._propagate_operations(stage, self.stage_values[stage_index], slots)
+            self.stage_scores[stage_index] = sum(self.stage_values[stage_index])
+
+        if key in self.requirement_inputs:
+            self.reason = self._check_requirements(scores, matura)
+        if key in self.bonus_inputs:
+            self.bonus_points = self.bonus_table.points(scores, matura)
+
+        state = self._fold()
+        if state == self.state:
+            return False
+        self.state = state
+        return True
+
+    @staticmethod
+    def _propagate_operations(
+        stage: CompiledStage, values: List[float], changed: Set[int]
+    ) -> None:
+        for (slot, _, function), inputs in zip(stage.operations, stage.operation_inputs):
+            if inputs.isdisjoint(changed):
+                continue
+            result = function(values)
+            if result != values[slot]:
+                values[slot] = result
+                changed.add(slot)
+
+    def _check_requirements(
+        self, scores: ExtendedScores, matura: List[Optional[int]]
+    ) -> Optional[str]:
+        for check in self.plan.requirement_checks:
+            reason = check(scores, matura)
+            if reason:
+                return reason
+        return None
+
+    def _fold(self) -> ProgramState:
+        """Combine cached stage scores into totals, as CompiledFormula.evaluate does"""
+        if self.reason:
+            return ProgramState(
+                total_score=0,
+                stage_scores=(),
+                meets_requirements=False,
+                disqualification_reason=self.reason
+            )
+
+        total_score = 0
+        reached = []
+        for stage, stage_score in zip(self.plan.stages, self.stage_scores):
+            reached.append(stage_score)
+            if stage.cutoff is not None and stage_score < stage.cutoff:
+                break
+            total_score += stage_score * stage.coefficient
+
+        if self.plan.formula.bonuses:
+            total_score += self.bonus_points
+
+        return ProgramState(
+            total_score=min(total_score, self.plan.max_possible_score),
+            stage_scores=tuple(reached),
+            meets_requirements=True
+        )
+
+
+class ScoringSession:
+    """One candidate's scores evaluated against many programs, kept up to date
+    as individual inputs change"""
+
+    def __init__(
+        self,
+        formulas: List[Formula],
+        scores: ExtendedScores,
+        calculator: Optional[AdvancedFormulaCalculator] = None
+    ):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        self.scores = copy.deepcopy(scores)
+        self.matura: List[Optional[int]] = list(matura_vector(scores.matura_scores))
+
+        self.programs: Dict[str, _ProgramGraph] = {}
+        self.dependents: Dict[InputKey, List[str]] = {}
+        for formula in formulas:
+            graph = _ProgramGraph(
+                self.calculator.compile(formula), self.calculator.subject_mappings
+            )
+            graph.evaluate_all(self.scores, self.matura)
+            self.programs[formula.program_id] = graph
+            for key in graph.inputs:
+                self.dependents.setdefault(key, []).append(formula.program_id)
+
+    def state(self, program_id: str) -> ProgramState:
+        return self.programs[program_id].state
+
+    def result(self, program_id: str, breakdown: bool = True) -> CalculationResult:
+        """Full result for the current inputs"""
+        return self.programs[program_id].plan.evaluate(self.scores, breakdown)
+
+    def update(
+        self, subject: str, value: Any, level: str = "R"
+    ) -> Dict[str, ProgramState]:
+        """Change one input and return the programs whose outputs changed
+
+        subject is a Matura subject code or field name (with level "R" or
+        "P"), or one of interview_score, portfolio_score, previous_degree_gpa
+        and is_bilingual.
+        """
+        if subject in SCALAR_INPUTS:
+            setattr(self.scores, subject, value)
+            return self._propagate(subject)
+
+        attr_name = resolve_matura_field(subject, level, self.calculator.subject_mappings)
+        if attr_name is None:
+            raise ValueError(f"Unknown subject: {subject}")
+        slot = SUBJECT_SLOTS[attr_name]
+        self.matura[slot] = value
+        setattr(self.scores.matura_scores, MATURA_SUBJECTS[slot], value)
+        return self._propagate(("matura", slot))
+
+    def update_practical_exam(
+        self, exam_id: str, value: Optional[float]
+    ) -> Dict[str, ProgramState]:
+        """Set or clear (value None) one practical exam result"""
+        exams = dict(self.scores.practical_exams or {})
+        if value is None:
+            exams.pop(exam_id, None)
+        else:
+            exams[exam_id] = value
+        self.scores.practical_exams = exams or None
+
+        changed = self._propagate(("practical", exam_id))
+        changed.update(self._propagate(PRACTICAL_EXAMS))
+        return changed
+
+    def _propagate(self, key: InputKey) -> Dict[str, ProgramState]:
+        changed = {}
+        for program_id in self.dependents.get(key, ()):
+            graph = self.programs[program_id]
+            if graph.update(key, self.scores, self.matura):
+                changed[program_id] = graph.state
+        return changed
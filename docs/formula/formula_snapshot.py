@@ -0,0 +1,726 @@
+#!/usr/bin/env python3
+"""
+Binary snapshots of formula catalogs
+A memory-mappable file holding every Formula in fixed-layout records plus the
+catalog engine's weight vectors, so worker processes share one page-cached
+copy and start without parsing JSON
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from formula_catalog import INPUT_AXIS, CatalogEngine, CatalogReduction, reduce_catalog
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    BonusRule,
+    BonusType,
+    ComponentType,
+    ExamTask,
+    ExamType,
+    Formula,
+    FormulaComponent,
+    FormulaMetadata,
+    FormulaRequirements,
+    FormulaStage,
+    FormulaType,
+    LevelCoefficients,
+    Operation,
+    OperationType,
+    PracticalExam,
+    Threshold,
+    ThresholdType,
+    _parse_datetime,
+)
+
+
+MAGIC = b"RKFSNAP\0"
+FORMAT_VERSION = 1
+
+# Sentinels for absent values: strings, list ranges, enums and task durations.
+# Absent floats are stored as NaN.
+NO_STRING = 0xFFFFFFFF
+NO_ENUM = 0xFF
+NO_DURATION = -(2 ** 31)
+
+# magic, format version, section count, source size, source mtime (ns),
+# source SHA-256, CRC-32 of everything after the header
+HEADER = struct.Struct("<8sHHQq32sI4x")
+# Section directory entry: offset, size in bytes, record count
+SECTION = struct.Struct("<QQQ")
+
+SECTIONS = (
+    "string_offsets", "string_data", "string_lists", "formulas", "stages",
+    "components", "operations", "exams", "tasks", "bonuses", "requirements",
+    "minimum_scores", "linear", "weights", "biases",
+)
+
+# Records end with their numbers as float64, preceded by a mask of which of
+# them were ints, so decoded formulas compare and serialize like parsed ones.
+# (first, count) ranges point into another table; count NO_STRING means None.
+RANGE = "II"
+
+
+def _layout(fields: str, numbers: int) -> struct.Struct:
+    return struct.Struct("<" + fields + "H" + "d" * numbers)
+
+
+FORMULA = _layout("III" + "B" + RANGE + RANGE + "i" + "IIIII", 3)
+STAGE = _layout("II" + "BI" + RANGE + RANGE + RANGE, 3)
+COMPONENT = _layout("IBBB" + "II" + RANGE, 7)
+OPERATION = _layout("IB" + "I" + RANGE, 1)
+EXAM = _layout("IIB" + "I" + RANGE, 3)
+TASK = _layout("Ii", 1)
+BONUS = _layout("IBI", 3)
+REQUIREMENTS = struct.Struct("<B" + RANGE + RANGE)
+MINIMUM_SCORE = _layout("I", 1)
+
+# Requirement flags
+PRACTICAL_TEST = 1
+INTERVIEW = 2
+PORTFOLIO = 4
+PREVIOUS_DEGREE = 8
+
+# Component flags
+HAS_LEVEL_COEFFICIENTS = 1
+
+FORMULA_TYPES = list(FormulaType)
+COMPONENT_TYPES = list(ComponentType)
+OPERATION_TYPES = list(OperationType)
+THRESHOLD_TYPES = list(ThresholdType)
+EXAM_TYPES = list(ExamType)
+BONUS_TYPES = list(BonusType)
+
+
+class SnapshotError(ValueError):
+    """Raised for files that are not valid snapshots of this format version"""
+
+
+@dataclass
+class SourceStamp:
+    """Identity of the JSONL file a snapshot was built from"""
+    size: int
+    mtime_ns: int
+    sha256: bytes
+
+    @classmethod
+    def of(cls, path: str) -> "SourceStamp":
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        stat = os.stat(path)
+        return cls(stat.st_size, stat.st_mtime_ns, digest.digest())
+
+
+def _pack_numbers(*values: Optional[float]) -> Tuple[float, ...]:
+    """Int mask followed by the values as floats, NaN for None"""
+    mask = 0
+    for bit, value in enumerate(values):
+        if isinstance(value, int):
+            mask |= 1 << bit
+    return (mask,) + tuple(math.nan if v is None else float(v) for v in values)
+
+
+def _unpack_numbers(row: Tuple, count: int) -> Tuple[Tuple, List[Optional[float]]]:
+    """Split a record into its leading fields and its decoded numbers"""
+    mask = row[-count - 1]
+    numbers = [
+        None if math.isnan(value) else int(value) if mask >> bit & 1 else value
+        for bit, value in enumerate(row[-count:])
+    ]
+    return row[:-count - 1], numbers
+
+
+def _enum_index(members: List[Any], value: Any) -> int:
+    return NO_ENUM if value is None else members.index(value)
+
+
+# MARK: - Writer
+
+class _SnapshotWriter:
+    """Flattens formulas into the snapshot tables"""
+
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+        self.string_lists: List[int] = []
+        self.tables: Dict[str, List[bytes]] = {
+            name: [] for name in (
+                "formulas", "stages", "components", "operations", "exams",
+                "tasks", "bonuses", "requirements", "minimum_scores",
+            )
+        }
+
+    def string(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        return self.strings.setdefault(value, len(self.strings))
+
+    def string_list(self, values: Optional[List[str]]) -> Tuple[int, int]:
+        if values is None:
+            return 0, NO_STRING
+        first = len(self.string_lists)
+        self.string_lists.extend(self.string(v) for v in values)
+        return first, len(values)
+
+    def _append(self, table: str, layout: struct.Struct, *values: Any) -> int:
+        rows = self.tables[table]
+        rows.append(layout.pack(*values))
+        return len(rows) - 1
+
+    def _range(self, table: str, count: Optional[int]) -> Tuple[int, int]:
+        """Range for count rows about to be appended to table"""
+        if count is None:
+            return 0, NO_STRING
+        return len(self.tables[table]), count
+
+    def add(self, formula: Formula) -> None:
+        # Children are written before their parent so the ranges are known
+        stages = self._range("stages", len(formula.stages))
+        for stage in formula.stages:
+            self._add_stage(stage)
+
+        bonuses = self._range("bonuses", None if formula.bonuses is None else len(formula.bonuses))
+        for bonus in formula.bonuses or []:
+            self._append(
+                "bonuses", BONUS,
+                self.string(bonus.id), BONUS_TYPES.index(bonus.type),
+                self.string(bonus.condition),
+                *_pack_numbers(bonus.points, bonus.multiplier, bonus.max_bonus)
+            )
+
+        requirements = -1
+        if formula.requirements is not None:
+            requirements = self._add_requirements(formula.requirements)
+
+        metadata = formula.metadata
+        last_updated = metadata.last_updated.isoformat() if metadata.last_updated else None
+        self._append(
+            "formulas", FORMULA,
+            self.string(formula.version), self.string(formula.university_id),
+            self.string(formula.program_id), FORMULA_TYPES.index(formula.type),
+            *stages, *bonuses, requirements,
+            self.string(metadata.description), self.string(metadata.scoring_unit),
+            self.string(metadata.official_calculator_url), self.string(metadata.notes),
+            self.string(last_updated),
+            *_pack_numbers(
+                metadata.max_possible_score, metadata.last_year_threshold,
+                metadata.average_threshold
+            )
+        )
+
+    def _add_stage(self, stage: FormulaStage) -> None:
+        components = self._range("components", len(stage.components))
+        for component in stage.components:
+            lc = component.level_coefficients or LevelCoefficients()
+            self._append(
+                "components", COMPONENT,
+                self.string(component.id), COMPONENT_TYPES.index(component.type),
+                int(component.required),
+                HAS_LEVEL_COEFFICIENTS if component.level_coefficients else 0,
+                self.string(component.subject), self.string(component.level),
+                *self.string_list(component.alternatives),
+                *_pack_numbers(
+                    component.weight, lc.basic, lc.extended, lc.bilingual,
+                    lc.international, component.min_score, component.max_score
+                )
+            )
+
+        operations = self._range(
+            "operations", None if stage.operations is None else len(stage.operations)
+        )
+        for operation in stage.operations or []:
+            self._append(
+                "operations", OPERATION,
+                self.string(operation.id), OPERATION_TYPES.index(operation.type),
+                self.string(operation.result_id),
+                *self.string_list(operation.component_ids),
+                *_pack_numbers(operation.value)
+            )
+
+        exams = self._range(
+            "exams", None if stage.practical_exams is None else len(stage.practical_exams)
+        )
+        for exam in stage.practical_exams or []:
+            # Tasks go to their own table, so exam rows stay contiguous
+            tasks = self._range("tasks", None if exam.tasks is None else len(exam.tasks))
+            for task in exam.tasks or []:
+                self._append(
+                    "tasks", TASK, self.string(task.name),
+                    NO_DURATION if task.duration is None else task.duration,
+                    *_pack_numbers(task.points)
+                )
+            self._append(
+                "exams", EXAM,
+                self.string(exam.id), self.string(exam.name), EXAM_TYPES.index(exam.type),
+                self.string(exam.description), *tasks,
+                *_pack_numbers(exam.weight, exam.max_points, exam.min_score)
+            )
+
+        threshold = stage.threshold
+        self._append(
+            "stages", STAGE,
+            self.string(stage.id), self.string(stage.name),
+            _enum_index(THRESHOLD_TYPES, threshold and threshold.type),
+            self.string(threshold and threshold.description),
+            *components, *operations, *exams,
+            *_pack_numbers(
+                stage.max_points, stage.coefficient, threshold and threshold.value
+            )
+        )
+
+    def _add_requirements(self, reqs: FormulaRequirements) -> int:
+        minimums = self._range(
+            "minimum_scores", None if reqs.minimum_scores is None else len(reqs.minimum_scores)
+        )
+        for subject, value in (reqs.minimum_scores or {}).items():
+            self._append("minimum_scores", MINIMUM_SCORE, self.string(subject), *_pack_numbers(value))
+
+        flags = (
+            (PRACTICAL_TEST if reqs.practical_test_required else 0)
+            | (INTERVIEW if reqs.interview_required else 0)
+            | (PORTFOLIO if reqs.portfolio_required else 0)
+            | (PREVIOUS_DEGREE if reqs.previous_degree_required else 0)
+        )
+        return self._append(
+            "requirements", REQUIREMENTS, flags,
+            *self.string_list(reqs.mandatory_subjects), *minimums
+        )
+
+    def sections(self, reduction: CatalogReduction) -> Dict[str, Tuple[bytes, int]]:
+        encoded = [s.encode("utf-8") for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+
+        sections = {
+            "string_offsets": (offsets.tobytes(), len(encoded)),
+            "string_data": (b"".join(encoded), len(encoded)),
+            "string_lists": (np.array(self.string_lists, dtype="<u4").tobytes(), len(self.string_lists)),
+            "linear": (reduction.linear.astype(np.uint8).tobytes(), reduction.linear.size),
+            "weights": (
+                np.ascontiguousarray(reduction.weights, dtype="<f8").tobytes(),
+                reduction.weights.shape[1]
+            ),
+            "biases": (reduction.biases.astype("<f8").tobytes(), reduction.biases.size),
+        }
+        for name, rows in self.tables.items():
+            sections[name] = (b"".join(rows), len(rows))
+        return sections
+
+
+def write_snapshot(
+    formulas: Sequence[Formula],
+    path: str,
+    source: Optional[SourceStamp] = None,
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> None:
+    """Write formulas and their catalog reduction as a snapshot
+
+    The file is written next to path and renamed into place, so readers never
+    see a partial snapshot.
+    """
+    calculator = calculator or AdvancedFormulaCalculator()
+    writer = _SnapshotWriter()
+    for formula in formulas:
+        writer.add(formula)
+    sections = writer.sections(reduce_catalog(list(formulas), calculator.subject_mappings))
+
+    directory_size = SECTION.size * len(SECTIONS)
+    offset = HEADER.size + directory_size
+    directory = []
+    body = []
+    for name in SECTIONS:
+        data, count = sections[name]
+        padding = -offset % 8  # Keep every section 8-byte aligned for NumPy
+        body.append(b"\0" * padding)
+        offset += padding
+        directory.append(SECTION.pack(offset, len(data), count))
+        body.append(data)
+        offset += len(data)
+
+    payload = b"".join(directory) + b"".join(body)
+    source = source or SourceStamp(0, 0, b"\0" * 32)
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(SECTIONS), source.size, source.mtime_ns,
+        source.sha256, zlib.crc32(payload)
+    )
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(temporary, path)
+
+
+# MARK: - Reader
+
+class FormulaSnapshot:
+    """Read-only, memory-mapped view of a snapshot
+
+    Formulas are decoded from their records on demand. The catalog weight
+    vectors are exposed as NumPy arrays over the mapping itself, so every
+    process opening the same file shares one copy in the page cache.
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files cannot be mapped
+            self._file.close()
+            raise SnapshotError(f"{path}: empty file")
+        try:
+            self._read_header(verify)
+        except Exception:
+            self.close()
+            raise
+
+        self._strings: List[Optional[str]] = [None] * self._sections["string_offsets"][2]
+        self._index: Dict[str, int] = {}
+        for index in range(len(self)):
+            program_id = self._string(self._record("formulas", FORMULA, index)[2])
+            self._index.setdefault(program_id, index)
+
+    def _read_header(self, verify: bool) -> None:
+        data = self._data
+        if len(data) < HEADER.size:
+            raise SnapshotError(f"{self.path}: truncated header")
+        magic, version, section_count, size, mtime_ns, sha256, checksum = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise SnapshotError(f"{self.path}: not a formula snapshot")
+        if version != FORMAT_VERSION or section_count != len(SECTIONS):
+            raise SnapshotError(
+                f"{self.path}: format version {version}, expected {FORMAT_VERSION}"
+            )
+        if verify and zlib.crc32(memoryview(data)[HEADER.size:]) != checksum:
+            raise SnapshotError(f"{self.path}: checksum mismatch")
+
+        self.source = SourceStamp(size, mtime_ns, sha256)
+        self._sections = {
+            name: SECTION.unpack_from(data, HEADER.size + i * SECTION.size)
+            for i, name in enumerate(SECTIONS)
+        }
+        for name, (offset, length, _) in self._sections.items():
+            if offset + length > len(data):
+                raise SnapshotError(f"{self.path}: section {name} out of bounds")
+
+    def __enter__(self) -> "FormulaSnapshot":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the mapping; arrays from reduction() keep it alive until freed"""
+        try:
+            self._data.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    # MARK: - Records
+
+    def _array(self, name: str, dtype: str) -> np.ndarray:
+        offset, length, _ = self._sections[name]
+        return np.frombuffer(self._data, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    def _record(self, table: str, layout: struct.Struct, index: int) -> Tuple:
+        offset, _, count = self._sections[table]
+        if not 0 <= index < count:
+            raise IndexError(f"{table} record {index} out of range")
+        return layout.unpack_from(self._data, offset + index * layout.size)
+
+    def _string(self, index: int) -> Optional[str]:
+        if index == NO_STRING:
+            return None
+        value = self._strings[index]
+        if value is None:
+            table = self._sections["string_offsets"][0]
+            start, end = struct.unpack_from("<II", self._data, table + 4 * index)
+            base = self._sections["string_data"][0]
+            value = self._strings[index] = str(self._data[base + start:base + end], "utf-8")
+        return value
+
+    def _string_list(self, first: int, count: int) -> Optional[List[str]]:
+        if count == NO_STRING:
+            return None
+        offset = self._sections["string_lists"][0] + 4 * first
+        return [self._string(i) for i in struct.unpack_from(f"<{count}I", self._data, offset)]
+
+    def _rows(self, table: str, layout: struct.Struct, first: int, count: int) -> Optional[Iterator[Tuple]]:
+        if count == NO_STRING:
+            return None
+        return (self._record(table, layout, i) for i in range(first, first + count))
+
+    # MARK: - Formulas
+
+    def __len__(self) -> int:
+        return self._sections["formulas"][2]
+
+    def __contains__(self, program_id: object) -> bool:
+        return program_id in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def program_ids(self) -> List[str]:
+        """Program ids in file order; the first record wins for duplicates"""
+        return list(self._index)
+
+    def get(self, program_id: str) -> Formula:
+        index = self._index.get(program_id)
+        if index is None:
+            raise KeyError(program_id)
+        return self.formula(index)
+
+    def __getitem__(self, program_id: str) -> Formula:
+        return self.get(program_id)
+
+    def formulas(self) -> List[Formula]:
+        """Every record in file order, duplicates included"""
+        return [self.formula(i) for i in range(len(self))]
+
+    def formula(self, index: int) -> Formula:
+        """Decode the record at a file position"""
+        fields, (max_score, last_year, average) = _unpack_numbers(
+            self._record("formulas", FORMULA, index), 3
+        )
+        (
+            version, university_id, program_id, formula_type,
+            stage_first, stage_count, bonus_first, bonus_count, requirements,
+            description, unit, url, notes, updated
+        ) = fields
+        s = self._string
+
+        bonuses = self._rows("bonuses", BONUS, bonus_first, bonus_count)
+        if bonuses is not None:
+            bonuses = [self._bonus(row) for row in bonuses]
+
+        return Formula(
+            version=s(version),
+            university_id=s(university_id),
+            program_id=s(program_id),
+            type=FORMULA_TYPES[formula_type],
+            stages=[
+                self._stage(row)
+                for row in self._rows("stages", STAGE, stage_first, stage_count)
+            ],
+            metadata=FormulaMetadata(
+                description=s(description),
+                max_possible_score=max_score,
+                scoring_unit=s(unit),
+                last_year_threshold=last_year,
+                average_threshold=average,
+                official_calculator_url=s(url),
+                notes=s(notes),
+                last_updated=_parse_datetime(s(updated))
+            ),
+            bonuses=bonuses,
+            requirements=None if requirements < 0 else self._requirements(requirements)
+        )
+
+    def _bonus(self, row: Tuple) -> BonusRule:
+        (bonus_id, bonus_type, condition), (points, multiplier, max_bonus) = (
+            _unpack_numbers(row, 3)
+        )
+        return BonusRule(
+            id=self._string(bonus_id),
+            type=BONUS_TYPES[bonus_type],
+            condition=self._string(condition),
+            points=points,
+            multiplier=multiplier,
+            max_bonus=max_bonus
+        )
+
+    def _stage(self, row: Tuple) -> FormulaStage:
+        fields, (max_points, coefficient, threshold_value) = _unpack_numbers(row, 3)
+        (
+            stage_id, name, threshold_type, threshold_description,
+            component_first, component_count, operation_first, operation_count,
+            exam_first, exam_count
+        ) = fields
+        s = self._string
+
+        threshold = None
+        if threshold_type != NO_ENUM:
+            threshold = Threshold(
+                type=THRESHOLD_TYPES[threshold_type],
+                value=threshold_value,
+                description=s(threshold_description)
+            )
+
+        operations = self._rows("operations", OPERATION, operation_first, operation_count)
+        if operations is not None:
+            operations = [self._operation(row) for row in operations]
+
+        exams = self._rows("exams", EXAM, exam_first, exam_count)
+        if exams is not None:
+            exams = [self._exam(row) for row in exams]
+
+        return FormulaStage(
+            id=s(stage_id),
+            name=s(name),
+            components=[
+                self._component(row)
+                for row in self._rows("components", COMPONENT, component_first, component_count)
+            ],
+            max_points=max_points,
+            operations=operations,
+            practical_exams=exams,
+            threshold=threshold,
+            coefficient=coefficient
+        )
+
+    def _operation(self, row: Tuple) -> Operation:
+        (operation_id, operation_type, result_id, ids_first, ids_count), (value,) = (
+            _unpack_numbers(row, 1)
+        )
+        return Operation(
+            id=self._string(operation_id),
+            type=OPERATION_TYPES[operation_type],
+            component_ids=self._string_list(ids_first, ids_count),
+            value=value,
+            result_id=self._string(result_id)
+        )
+
+    def _component(self, row: Tuple) -> FormulaComponent:
+        fields, numbers = _unpack_numbers(row, 7)
+        (
+            component_id, component_type, required, flags, subject, level,
+            alternatives_first, alternatives_count
+        ) = fields
+        weight, basic, extended, bilingual, international, min_score, max_score = numbers
+        level_coefficients = None
+        if flags & HAS_LEVEL_COEFFICIENTS:
+            level_coefficients = LevelCoefficients(
+                basic=basic,
+                extended=extended,
+                bilingual=bilingual,
+                international=international
+            )
+        return FormulaComponent(
+            id=self._string(component_id),
+            type=COMPONENT_TYPES[component_type],
+            weight=weight,
+            required=bool(required),
+            subject=self._string(subject),
+            level=self._string(level),
+            level_coefficients=level_coefficients,
+            alternatives=self._string_list(alternatives_first, alternatives_count),
+            min_score=min_score,
+            max_score=max_score
+        )
+
+    def _exam(self, row: Tuple) -> PracticalExam:
+        fields, (weight, max_points, min_score) = _unpack_numbers(row, 3)
+        exam_id, name, exam_type, description, task_first, task_count = fields
+        tasks = self._rows("tasks", TASK, task_first, task_count)
+        if tasks is not None:
+            tasks = [self._task(row) for row in tasks]
+        return PracticalExam(
+            id=self._string(exam_id),
+            name=self._string(name),
+            type=EXAM_TYPES[exam_type],
+            weight=weight,
+            max_points=max_points,
+            tasks=tasks,
+            min_score=min_score,
+            description=self._string(description)
+        )
+
+    def _task(self, row: Tuple) -> ExamTask:
+        (name, duration), (points,) = _unpack_numbers(row, 1)
+        return ExamTask(
+            name=self._string(name),
+            points=points,
+            duration=None if duration == NO_DURATION else duration
+        )
+
+    def _requirements(self, index: int) -> FormulaRequirements:
+        flags, mandatory_first, mandatory_count, minimum_first, minimum_count = (
+            self._record("requirements", REQUIREMENTS, index)
+        )
+        minimums = self._rows("minimum_scores", MINIMUM_SCORE, minimum_first, minimum_count)
+        if minimums is not None:
+            minimums = {
+                self._string(fields[0]): value
+                for fields, (value,) in (_unpack_numbers(row, 1) for row in minimums)
+            }
+        return FormulaRequirements(
+            mandatory_subjects=self._string_list(mandatory_first, mandatory_count),
+            minimum_scores=minimums,
+            practical_test_required=bool(flags & PRACTICAL_TEST),
+            interview_required=bool(flags & INTERVIEW),
+            portfolio_required=bool(flags & PORTFOLIO),
+            previous_degree_required=bool(flags & PREVIOUS_DEGREE)
+        )
+
+    # MARK: - Compiled Form
+
+    def reduction(self) -> CatalogReduction:
+        """Catalog weight vectors as read-only arrays over the mapping"""
+        linear = self._array("linear", "u1").astype(bool)
+        columns = self._sections["weights"][2]
+        weights = self._array("weights", "<f8").reshape(2 * len(INPUT_AXIS), columns)
+        return CatalogReduction(linear, weights, self._array("biases", "<f8"))
+
+    def engine(self, calculator: Optional[AdvancedFormulaCalculator] = None) -> CatalogEngine:
+        """Catalog engine over every record, without reducing formulas again"""
+        return CatalogEngine(self.formulas(), calculator, self.reduction())
+
+    def is_fresh(self, source_path: str) -> bool:
+        """True if the snapshot was built from the current source file"""
+        stat = os.stat(source_path)
+        if stat.st_size != self.source.size:
+            return False
+        if stat.st_mtime_ns == self.source.mtime_ns:
+            return True
+        return SourceStamp.of(source_path).sha256 == self.source.sha256
+
+
+# MARK: - Building
+
+def build_snapshot(
+    source_path: str,
+    snapshot_path: str,
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> None:
+    """Parse a JSONL formula catalog and write its snapshot"""
+    calculator = calculator or AdvancedFormulaCalculator()
+    stamp = SourceStamp.of(source_path)
+    with open(source_path, encoding="utf-8") as f:
+        formulas = [calculator.parse_formula_json(line) for line in f if line.strip()]
+    write_snapshot(formulas, snapshot_path, stamp, calculator)
+
+
+def load_snapshot(
+    source_path: str,
+    snapshot_path: Optional[str] = None,
+    calculator: Optional[AdvancedFormulaCalculator] = None
+) -> FormulaSnapshot:
+    """Open the snapshot of a JSONL catalog, rebuilding it if missing or stale
+
+    snapshot_path defaults to the source path with a .snap suffix. Snapshots
+    from another format version, with a bad checksum, or built from a
+    different source file are rebuilt.
+    """
+    snapshot_path = snapshot_path or source_path + ".snap"
+    try:
+        snapshot = FormulaSnapshot(snapshot_path)
+    except (OSError, SnapshotError):
+        pass
+    else:
+        if snapshot.is_fresh(source_path):
+            return snapshot
+        snapshot.close()
+
+    build_snapshot(source_path, snapshot_path, calculator)
+    return FormulaSnapshot(snapshot_path)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Inverse solver for admission formulas
+Answers "how much do I need in physics to get into X?" for a whole catalog:
+closed form for linear formulas, monotone bisection for everything else,
+and a scan over every result where bonus conditions break monotonicity
+"""
+
+import math
+from dataclasses import dataclass, replace
+from itertools import product
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from formula_batch import Cohort
+from formula_catalog import INPUT_AXIS, INPUT_INDEX, CatalogEngine
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    CompiledFormula,
+    ComponentType,
+    ExtendedScores,
+    Formula,
+    FormulaComponent,
+    FormulaStage,
+    Operation,
+    OperationType,
+    SUBJECT_SLOTS,
+    matura_vector,
+    resolve_level_coefficients,
+    resolve_matura_field,
+    threshold_cutoff,
+)
+
+
+# Matura results are whole percentages
+MATURA_MIN = 0
+MATURA_MAX = 100
+
+# Most free subjects scanned over the whole grid of results when a formula
+# is not monotone (101 ** 2 evaluations per program)
+MAX_SCAN_SUBJECTS = 2
+
+
+@dataclass
+class SolveResult:
+    """Minimum Matura results needed to reach a program's target
+
+    minimums gives, per free subject, the lowest result that reaches the
+    target when the other free subjects take their most favourable value;
+    together they bound the feasible region. uniform_minimum is the lowest
+    result that works when every free subject gets the same value. For linear
+    formulas the region is exactly sum(region[s] * x[s]) >= region_bound.
+    feasible is None when the program could not be solved
+    (method="unsupported").
+    """
+    program_id: str
+    target: Optional[float]
+    feasible: Optional[bool]
+    minimums: Dict[str, Optional[int]]
+    uniform_minimum: Optional[int]
+    method: str
+    region: Optional[Dict[str, float]] = None
+    region_bound: Optional[float] = None
+
+
+class InverseSolver:
+    """Finds the minimum Matura results needed across a catalog
+
+    Totals are non-decreasing in every Matura result when Matura components
+    have non-negative weights and coefficients, MULTIPLY and DIVIDE scale by
+    non-negative values, stage coefficients are non-negative and bonus
+    conditions only reward higher results; MAX/MIN/THRESHOLD operations,
+    clamps and stage thresholds preserve it. Such formulas are bisected
+    (see is_monotone). Others (a negative weight, "MAT_R < 50", "not ...")
+    are scanned over every result instead.
+    """
+
+    def __init__(
+        self,
+        formulas: List[Formula],
+        calculator: Optional[AdvancedFormulaCalculator] = None
+    ):
+        self.calculator = calculator or AdvancedFormulaCalculator()
+        self.formulas = formulas
+        self.engine = CatalogEngine(formulas, self.calculator)
+        self.plans: List[CompiledFormula] = [self.calculator.compile(f) for f in formulas]
+        self.monotone = [is_monotone(f, self.calculator) for f in formulas]
+
+        # Linear formulas with requirements go through bisection, since a
+        # requirement can depend on the free subject itself.
+        self.closed_form = np.array([
+            bool(linear) and not formula.requirements
+            for linear, formula in zip(self.engine.linear, formulas)
+        ])
+        column_of = {index: column for column, index in enumerate(self.engine.linear_indices)}
+        self.closed_form_indices = np.flatnonzero(self.closed_form)
+        self.closed_form_columns = np.array(
+            [column_of[index] for index in self.closed_form_indices], dtype=np.int64
+        )
+
+    def solve(
+        self,
+        scores: ExtendedScores,
+        subjects: Union[str, Sequence[str]],
+        level: str = "R",
+        targets: Optional[Sequence[Optional[float]]] = None
+    ) -> List[SolveResult]:
+        """Solve every program in the catalog for the given free subjects
+
+        targets defaults to each program's metadata.last_year_threshold;
+        programs without a target are reported as infeasible.
+        """
+        if isinstance(subjects, str):
+            subjects = [subjects]
+        fields = []
+        for subject in subjects:
+            attr_name = resolve_matura_field(subject, level, self.calculator.subject_mappings)
+            if attr_name is None:
+                raise ValueError(f"Unknown subject: {subject}")
+            fields.append(attr_name)
+
+        if targets is None:
+            targets = [f.metadata.last_year_threshold for f in self.formulas]
+        target_array = np.array(
+            [np.nan if t is None else t for t in targets], dtype=np.float64
+        )
+
+        results: List[Optional[SolveResult]] = [None] * len(self.formulas)
+        for index, result in self._solve_closed_form(scores, fields, target_array):
+            results[index] = result
+        for index in np.flatnonzero(~self.closed_form):
+            solve = self._solve_bisection if self.monotone[index] else self._solve_scan
+            results[index] = solve(index, scores, fields, targets[index])
+        return results
+
+    # MARK: - Closed Form
+
+    def _solve_closed_form(
+        self, scores: ExtendedScores, fields: List[str], targets: np.ndarray
+    ) -> Iterator[Tuple[int, SolveResult]]:
+        if not self.closed_form_indices.size:
+            return
+
+        free_scores = replace(
+            scores,
+            matura_scores=replace(scores.matura_scores, **{name: None for name in fields})
+        )
+        features = self.engine.features(Cohort.from_scores([free_scores]))[0]
+        weights = self.engine.weights[:, self.closed_form_columns]
+        base = features @ weights + self.engine.biases[self.closed_form_columns]
+        caps = self.engine.caps[self.closed_form_indices]
+        targets = targets[self.closed_form_indices]
+
+        offset = len(INPUT_AXIS) if scores.is_bilingual else 0
+        rows = [offset + INPUT_INDEX[name] for name in fields]
+        free_weights = weights[rows, :]                        # free subjects x programs
+        best = np.maximum(free_weights, 0.0) * MATURA_MAX
+        best_total = base + best.sum(axis=0)
+
+        feasible = ~np.isnan(targets) & (caps >= targets) & (best_total >= targets)
+
+        minimums = np.full((len(fields), len(targets)), np.nan)
+        for row in range(len(fields)):
+            others = best_total - best[row]
+            minimums[row] = _linear_minimum(others, free_weights[row], targets)
+
+        uniform = _linear_minimum(base, free_weights.sum(axis=0), targets)
+
+        for column, index in enumerate(self.closed_form_indices):
+            ok = bool(feasible[column])
+            yield index, SolveResult(
+                program_id=self.formulas[index].program_id,
+                target=None if np.isnan(targets[column]) else float(targets[column]),
+                feasible=ok,
+                minimums={
+                    name: _as_score(minimums[row, column]) if ok else None
+                    for row, name in enumerate(fields)
+                },
+                uniform_minimum=_as_score(uniform[column]) if ok else None,
+                method="linear",
+                region={name: float(free_weights[row, column]) for row, name in enumerate(fields)},
+                region_bound=float(targets[column] - base[column])
+            )
+
+    # MARK: - Bisection
+
+    def _solve_bisection(
+        self,
+        index: int,
+        scores: ExtendedScores,
+        fields: List[str],
+        target: Optional[float]
+    ) -> SolveResult:
+        plan = self.plans[index]
+        program_id = self.formulas[index].program_id
+        if target is None:
+            return SolveResult(program_id, None, False, {f: None for f in fields}, None, "bisection")
+
+        matura = list(matura_vector(scores.matura_scores))
+        slots = [SUBJECT_SLOTS[name] for name in fields]
+
+        def total(values: Dict[int, int]) -> float:
+            for slot, value in values.items():
+                matura[slot] = value
+            return plan.evaluate_with_matura(scores, matura, breakdown=False).total_score
+
+        feasible = total({slot: MATURA_MAX for slot in slots}) >= target
+
+        minimums = {}
+        for slot, name in zip(slots, fields):
+            others = {other: MATURA_MAX for other in slots if other != slot}
+            minimums[name] = _bisect(
+                lambda value: total({**others, slot: value}) >= target
+            ) if feasible else None
+
+        uniform = _bisect(
+            lambda value: total({slot: value for slot in slots}) >= target
+        ) if feasible else None
+
+        return SolveResult(
+            program_id=program_id,
+            target=target,
+            feasible=feasible,
+            minimums=minimums,
+            uniform_minimum=uniform,
+            method="bisection"
+        )
+
+    # MARK: - Scan
+
+    def _solve_scan(
+        self,
+        index: int,
+        scores: ExtendedScores,
+        fields: List[str],
+        target: Optional[float]
+    ) -> SolveResult:
+        plan = self.plans[index]
+        program_id = self.formulas[index].program_id
+        if target is None:
+            return SolveResult(program_id, None, False, {f: None for f in fields}, None, "scan")
+        if len(fields) > MAX_SCAN_SUBJECTS:
+            return SolveResult(
+                program_id, target, None, {f: None for f in fields}, None, "unsupported"
+            )
+
+        matura = list(matura_vector(scores.matura_scores))
+        slots = [SUBJECT_SLOTS[name] for name in fields]
+
+        def reaches(values: Tuple[int, ...]) -> bool:
+            for slot, value in zip(slots, values):
+                matura[slot] = value
+            return plan.evaluate_with_matura(scores, matura, breakdown=False).total_score >= target
+
+        results = range(MATURA_MIN, MATURA_MAX + 1)
+        reaching = [values for values in product(results, repeat=len(slots)) if reaches(values)]
+        feasible = bool(reaching)
+        return SolveResult(
+            program_id=program_id,
+            target=target,
+            feasible=feasible,
+            minimums={
+                name: min(values[row] for values in reaching) if feasible else None
+                for row, name in enumerate(fields)
+            },
+            uniform_minimum=next(
+                (value for value in results if reaches((value,) * len(slots))), None
+            ),
+            method="scan"
+        )
+
+
+# MARK: - Monotonicity
+
+@dataclass
+class Term:
+    """How a component, operation or stage value moves with Matura results
+
+    direction is 0 for a constant, 1 for non-decreasing and None when the
+    value may fall as a result rises; non_negative holds when the value can
+    never drop below zero.
+    """
+    direction: Optional[int]
+    non_negative: bool
+
+
+CONSTANT = Term(0, True)
+
+
+def _combine(terms: Sequence[Term]) -> Term:
+    """Term of a value that rises with each of its inputs (sum, max, min)"""
+    directions = {term.direction for term in terms}
+    if None in directions:
+        direction = None
+    else:
+        direction = max(directions, default=0)
+    return Term(direction, all(term.non_negative for term in terms))
+
+
+def _scale(term: Term, factor: float) -> Term:
+    if term.direction == 0 or factor >= 0:
+        return Term(term.direction, term.non_negative and factor >= 0)
+    return Term(None, False)
+
+
+def component_term(component: FormulaComponent) -> Term:
+    """Term of a component; non-Matura inputs are fixed and non-negative"""
+    weight = component.weight
+    cap = component.max_score * weight if component.max_score else None
+    if cap is not None and cap < 0:
+        return Term(None, False)  # A min_score failure jumps up to 0
+    if component.type != ComponentType.MATURA_EXAM:
+        return Term(0, weight >= 0)
+    coefficients = resolve_level_coefficients(
+        component.level_coefficients, component.level or "R"
+    )
+    factor = min(coefficient * weight for coefficient in coefficients)
+    return _scale(Term(1, True), factor)
+
+
+def operation_term(operation: Operation, inputs: Sequence[Term]) -> Term:
+    op_type = operation.type
+    if op_type in (OperationType.MAX, OperationType.MIN, OperationType.SUM, OperationType.AVERAGE):
+        return _combine(inputs)
+    if op_type == OperationType.DIVIDE:
+        return _scale(_combine(inputs), 1 / (operation.value or 1.0))
+    if op_type == OperationType.MULTIPLY:
+        combined = _combine(inputs)
+        if combined.direction == 0 or combined.non_negative:
+            return _scale(combined, operation.value or 1.0)
+        return Term(None, False)
+    if op_type == OperationType.THRESHOLD:
+        value = inputs[0] if inputs else CONSTANT
+        if value.direction == 0 or value.non_negative:
+            return value
+        return Term(None, False)
+    return CONSTANT
+
+
+def stage_term(stage: FormulaStage) -> Term:
+    """Term of a stage's contribution to the total, coefficient applied"""
+    slots: Dict[str, Term] = {}
+    for component in stage.components:
+        slots[component.id] = component_term(component)
+    for operation in stage.operations or []:
+        if operation.result_id:
+            inputs = [slots.get(cid, CONSTANT) for cid in operation.component_ids]
+            slots[operation.result_id] = operation_term(operation, inputs)
+    return _scale(_combine(list(slots.values())), stage.coefficient or 1.0)
+
+
+def is_monotone(formula: Formula, calculator: AdvancedFormulaCalculator) -> bool:
+    """True when no Matura result can lower the total by rising
+
+    Stage scores must each be non-decreasing. A stage threshold or failed
+    requirements drop what comes after them, so everything they gate must
+    also be non-negative.
+    """
+    terms = [stage_term(stage) for stage in formula.stages]
+    if any(term.direction is None for term in terms):
+        return False
+    gates = [
+        index for index, stage in enumerate(formula.stages)
+        if threshold_cutoff(stage.threshold, stage.max_points) is not None
+    ]
+    if formula.requirements:
+        gates.append(0)
+        if any(b.points < 0 or (b.multiplier or 0) < 0 for b in formula.bonuses or []):
+            return False
+    if gates and not all(term.non_negative for term in terms[min(gates):]):
+        return False
+    return not formula.bonuses or calculator.bonus_table(formula.bonuses).monotone
+
+
+def _bisect(reaches) -> Optional[int]:
+    """Smallest whole result in [MATURA_MIN, MATURA_MAX] for a monotone predicate"""
+    if not reaches(MATURA_MAX):
+        return None
+    if reaches(MATURA_MIN):
+        return MATURA_MIN
+    low, high = MATURA_MIN, MATURA_MAX  # low fails, high reaches
+    while high - low > 1:
+        middle = (low + high) // 2
+        if reaches(middle):
+            high = middle
+        else:
+            low = middle
+    return high
+
+
+def _linear_minimum(
+    base: np.ndarray, weight: np.ndarray, targets: np.ndarray
+) -> np.ndarray:
+    """Smallest whole x in range with base + weight * x >= target, NaN if none"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        needed = np.ceil((targets - base) / weight)
+        needed = np.where(base >= targets, MATURA_MIN, needed)
+        needed = np.where(np.isfinite(needed), np.maximum(needed, MATURA_MIN), np.nan)
+        # Step back where rounding error pushed ceil one too high
+        step_back = (needed > MATURA_MIN) & (base + weight * (needed - 1) >= targets)
+        needed = np.where(step_back, needed - 1, needed)
+        reaches = base + weight * needed >= targets
+    return np.where((needed <= MATURA_MAX) & reaches, needed, np.nan)
+
+
+def _as_score(value: float) -> Optional[int]:
+    return None if math.isnan(value) else int(value)
+
+
+def solve_catalog(
+    formulas: List[Formula],
+    scores: ExtendedScores,
+    subjects: Union[str, Sequence[str]],
+    level: str = "R",
+    targets: Optional[Sequence[Optional[float]]] = None
+) -> List[SolveResult]:
+    """Minimum results needed in the free subjects for every program"""
+    return InverseSolver(formulas).solve(scores, subjects, level, targets)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Randomized parity test between BatchFormulaCalculator and the scalar calculator
+Run from this directory: python -m unittest test_formula_batch
+"""
+
+import random
+import unittest
+from typing import List
+
+import numpy as np
+
+from formula_batch import Cohort, calculate_batch
+from formula_parser import (
+    AdvancedFormulaCalculator,
+    BonusRule,
+    BonusType,
+    Certificate,
+    ComponentType,
+    ExtendedScores,
+    Formula,
+    FormulaComponent,
+    FormulaMetadata,
+    FormulaRequirements,
+    FormulaStage,
+    FormulaType,
+    LevelCoefficients,
+    MATURA_SUBJECTS,
+    MaturaScores,
+    OlympiadLevel,
+    OlympiadResult,
+    Operation,
+    OperationType,
+    Threshold,
+    ThresholdType,
+)
+
+
+SEEDS = 300
+CANDIDATES = 40
+SUBJECTS = ["MAT", "POL", "J.OBC", "FIZ", "CHEM", "BIO", "INF", "HIS", "GROUP1"]
+
+
+def random_component(r: random.Random, component_id: str) -> FormulaComponent:
+    component_type = r.choice(list(ComponentType) + [ComponentType.MATURA_EXAM] * 3)
+    if component_type == ComponentType.PRACTICAL_EXAM:
+        component_id = r.choice(["psp", "art"])
+    coefficients = None
+    if r.random() < 0.4:
+        coefficients = LevelCoefficients(
+            basic=r.choice([None, 0.4]), extended=r.choice([None, 1.2]),
+            bilingual=r.choice([None, 1.3])
+        )
+    return FormulaComponent(
+        id=component_id,
+        type=component_type,
+        weight=r.choice([1.0, 0.5, 2.0, -0.5, -1.0]),
+        required=True,
+        subject=r.choice(SUBJECTS + [None]),
+        level=r.choice(["R", "P", None]),
+        level_coefficients=coefficients,
+        alternatives=r.choice([None, None, None, ["MAT", "FIZ", "INF"]]),
+        min_score=r.choice([None, None, 10, 30, -20]),
+        max_score=r.choice([None, None, 100, 50])
+    )
+
+
+def random_formula(r: random.Random) -> Formula:
+    stages = []
+    for s in range(r.randint(1, 3)):
+        components = [random_component(r, f"c{s}_{c}") for c in range(r.randint(1, 4))]
+        ids = [component.id for component in components]
+        operations = None
+        if r.random() < 0.5:
+            operations = [
+                Operation(
+                    id=f"o{o}",
+                    type=r.choice(list(OperationType)),
+                    component_ids=r.sample(ids, k=min(len(ids), r.randint(1, 3))),
+                    value=r.choice([None, 2.0, 40]),
+                    result_id=r.choice([None, f"r{o}", ids[0]])
+                )
+                for o in range(r.randint(1, 2))
+            ]
+        threshold = None
+        if r.random() < 0.4:
+            threshold = Threshold(type=r.choice(list(ThresholdType)), value=r.choice([10, 30, 60]))
+        stages.append(FormulaStage(
+            id=f"s{s}", name=f"Stage {s}", components=components,
+            max_points=r.choice([100, 200, 400]), operations=operations,
+            threshold=threshold, coefficient=r.choice([None, 0.6, 0.4])
+        ))
+
+    bonuses = None
+    if r.random() < 0.4:
+        bonuses = [
+            BonusRule(
+                id=f"b{b}", type=r.choice(list(BonusType)), condition="Laureaci",
+                points=r.choice([10, 20]), max_bonus=r.choice([None, 30])
+            )
+            for b in range(r.randint(1, 2))
+        ]
+    requirements = None
+    if r.random() < 0.3:
+        requirements = FormulaRequirements(
+            mandatory_subjects=r.choice([None, ["MAT"], ["MAT", "J.OBC"]]),
+            minimum_scores=r.choice([None, {"MAT": 30}, {"FIZ": 20}])
+        )
+    return Formula(
+        version="2.0", university_id="u", program_id=f"p{r.random()}",
+        type=FormulaType.MULTI_STAGE, stages=stages,
+        metadata=FormulaMetadata(
+            description="random", max_possible_score=r.choice([100, 400, 1000]),
+            scoring_unit="points"
+        ),
+        bonuses=bonuses, requirements=requirements
+    )
+
+
+def random_scores(r: random.Random) -> ExtendedScores:
+    def result():
+        return r.choice([None, r.randint(0, 100), r.randint(0, 100)])
+
+    return ExtendedScores(
+        matura_scores=MaturaScores(**{name: result() for name in MATURA_SUBJECTS}),
+        practical_exams=r.choice([None, {"psp": r.randint(0, 200)}, {"art": r.uniform(0, 100)}]),
+        interview_score=r.choice([None, r.uniform(0, 100)]),
+        portfolio_score=r.choice([None, r.uniform(0, 100)]),
+        previous_degree_gpa=r.choice([None, r.uniform(2, 5)]),
+        olympiad_results=r.choice([None, [OlympiadResult("o", r.choice(list(OlympiadLevel)), "MAT")]]),
+        certificates=r.choice([None, [Certificate("CAE")]]),
+        is_bilingual=r.random() < 0.2
+    )
+
+
+class BatchParityTest(unittest.TestCase):
+    """calculate_batch must agree with AdvancedFormulaCalculator.calculate"""
+
+    def test_random_formulas(self):
+        calculator = AdvancedFormulaCalculator()
+        for seed in range(SEEDS):
+            r = random.Random(seed)
+            formula = random_formula(r)
+            scores: List[ExtendedScores] = [random_scores(r) for _ in range(CANDIDATES)]
+            batch = calculate_batch(formula, Cohort.from_scores(scores))
+            for row, candidate in enumerate(scores):
+                with self.subTest(seed=seed, candidate=row):
+                    result = calculator.calculate(formula, candidate)
+                    self.assertAlmostEqual(batch.total_scores[row], result.total_score, places=9)
+                    self.assertAlmostEqual(batch.bonus_points[row], result.bonus_points, places=9)
+                    self.assertEqual(bool(batch.meets_requirements[row]), result.meets_requirements)
+                    for index, stage in enumerate(result.stage_results):
+                        self.assertAlmostEqual(batch.stage_scores[row, index], stage.score, places=9)
+                        self.assertEqual(bool(batch.stage_passed[row, index]), stage.passed)
+                    for index in range(len(result.stage_results), len(formula.stages)):
+                        self.assertTrue(np.isnan(batch.stage_scores[row, index]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Parity test for converted foreign grades across the scoring paths
+Run from this directory: python -m unittest test_formula_conversion
+"""
+
+import random
+import unittest
+from dataclasses import replace
+
+from formula_batch import calculate_batch
+from formula_conversion import ForeignGrade, GradeConverter
+from formula_parser import AdvancedFormulaCalculator, CompactScores, ExamSystem
+from test_formula_batch import CANDIDATES, SUBJECTS, random_formula, random_scores
+
+
+SEEDS = 100
+GRADES = {
+    ExamSystem.IB: (["HL", "SL"], lambda r: r.randint(1, 7)),
+    ExamSystem.EB: (["advanced", "standard"], lambda r: r.randint(100, 1000) / 100),
+}
+
+
+def random_grades(r: random.Random, system: ExamSystem):
+    levels, grade = GRADES[system]
+    return [
+        ForeignGrade(subject, r.choice(levels), grade(r))
+        for subject in r.sample(SUBJECTS[:-1], k=r.randint(1, 4))
+    ]
+
+
+class ConversionParityTest(unittest.TestCase):
+    """Converted candidates score the same packed, compiled, batched and scalar"""
+
+    def test_convert_pack_score(self):
+        calculator = AdvancedFormulaCalculator()
+        converter = GradeConverter(calculator=calculator)
+        for seed in range(SEEDS):
+            r = random.Random(seed)
+            formula = random_formula(r)
+            plan = calculator.compile(formula)
+            scores = []
+            grades = []
+            for _ in range(CANDIDATES):
+                system = r.choice(list(GRADES))
+                scores.append(replace(random_scores(r), exam_system=system))
+                grades.append(random_grades(r, system))
+            batch = calculate_batch(formula, converter.cohort(scores, grades))
+            for row, (candidate, candidate_grades) in enumerate(zip(scores, grades)):
+                with self.subTest(seed=seed, candidate=row):
+                    converted = converter.convert(candidate, candidate_grades)
+                    compact = CompactScores.from_extended(converted)
+                    expected = calculator.calculate(formula, converted)
+                    result = plan.evaluate(compact)
+                    self.assertAlmostEqual(result.total_score, expected.total_score, places=9)
+                    self.assertAlmostEqual(batch.total_scores[row], expected.total_score, places=9)
+
+
+if __name__ == "__main__":
+    unittest.main()